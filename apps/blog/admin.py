@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Post, Category,Tag
+from .models import Post, Category, Tag, ArchivedPost
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -18,4 +18,9 @@ class PostAdmin(admin.ModelAdmin):
 
 @admin.register(Tag)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name')
\ No newline at end of file
+    list_display = ('id', 'name')
+
+@admin.register(ArchivedPost)
+class ArchivedPostAdmin(admin.ModelAdmin):
+    list_display = ('title', 'author', 'status', 'created_at', 'archived_at')
+    search_fields = ('title',)
@@ -0,0 +1,143 @@
+"""
+冷数据归档
+
+绝大多数流量都落在最近的文章上，但 Post / Comment 表只增不减，列表查询、COUNT(*)、
+索引维护的成本都跟着涨。发布超过 ARCHIVE['POST_AGE_DAYS'] 天的文章连同它的评论、
+标签、点赞搬到 ArchivedPost / ArchivedComment 及其多对多表里：
+    - 每批 BATCH_SIZE 篇一个事务：先复制到归档表，再从热表删掉，中途失败整批回滚
+    - 主键沿用原来的 id，归档前先把 Redis 里更大的浏览量带上
+    - 热表上的列表、统计、自动补全都只看 Post，归档后的文章从这些地方消失
+    - 详情（retrieve）和评论分页在热表里找不到时回退到归档表，只读
+
+定期跑 `python manage.py archive_posts`（--dry-run 只看会搬多少）。
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.users.models import User
+from utils.redis_pool import redis
+from .cache import post_version_key, bump_generation, like_key
+from .models import Post, Comment, ArchivedPost, ArchivedComment
+from . import stats, autocomplete
+
+
+def _conf():
+    return getattr(settings, 'ARCHIVE', {})
+
+
+def cutoff(days=None):
+    days = _conf().get('POST_AGE_DAYS', 365) if days is None else days
+    return timezone.now() - timedelta(days=days)
+
+
+def candidates(before, batch_size):
+    """下一批要归档的文章 id：id 和发布时间基本同序，按主键顺序扫，找够一批就停"""
+    return list(Post.objects.filter(created_at__lt=before).exclude(status='deleted').order_by('id')
+                .values_list('id', flat=True)[:batch_size])
+
+
+def archive_batch(ids, before):
+    """把一批文章搬到归档表，返回 (文章数, 评论数)；事务提交后清掉它们在 Redis 里的痕迹"""
+    with transaction.atomic():
+        posts = list(Post.objects.select_for_update().filter(pk__in=ids, created_at__lt=before)
+                     .exclude(status='deleted').order_by('id'))
+        if not posts:
+            return 0, 0
+        ids = [post.pk for post in posts]
+        # 浏览量以 Redis 为准（每 10 次才落一次库）
+        counted = redis.mget([f"post:{pk}:view_count" for pk in ids])
+        ArchivedPost.objects.bulk_create([
+            ArchivedPost(id=post.pk, title=post.title, body=post.body, author_id=post.author_id,
+                         category_id=post.category_id, status=post.status,
+                         views=max(post.views, int(views or 0)), revision=post.revision,
+                         created_at=post.created_at, updated_at=post.updated_at)
+            for post, views in zip(posts, counted)
+        ])
+        _copy_m2m(Post.tags.through, ArchivedPost.tags.through, 'tag_id', ids)
+        _copy_likes(ids)
+        # 按 id 升序插入，父评论总在回复之前，自关联外键不会悬空
+        comments = [ArchivedComment(**row) for row in
+                    Comment.objects.filter(post_id__in=ids).order_by('id')
+                    .values('id', 'body', 'author_id', 'post_id', 'parent_id', 'created_at')]
+        ArchivedComment.objects.bulk_create(comments, batch_size=1000)
+
+        Post.tags.through.objects.filter(post_id__in=ids).delete()
+        Post.likes.through.objects.filter(post_id__in=ids).delete()
+        Comment.objects.filter(post_id__in=ids).delete()
+        Post.objects.filter(pk__in=ids).delete()
+        transaction.on_commit(lambda: _forget(ids))
+    return len(ids), len(comments)
+
+
+def _copy_m2m(source, target, column, ids):
+    rows = source.objects.filter(post_id__in=ids).values_list('post_id', column)
+    target.objects.bulk_create([target(archivedpost_id=pk, **{column: value}) for pk, value in rows],
+                               batch_size=1000)
+
+
+def _copy_likes(ids):
+    """
+    点赞以 Redis 集合为准：切换过但 persist_like 还没落库的也要带上（取消了的不带），
+    集合随后就在 _forget 里删掉；集合不在 Redis 里的文章用表里的
+    """
+    pipe = redis.pipeline(transaction=False)
+    for pk in ids:
+        pipe.exists(like_key(pk))
+        pipe.smembers(like_key(pk))
+    results = pipe.execute()
+    cached = {pk: {int(uid) for uid in results[2 * n + 1]} for n, pk in enumerate(ids) if results[2 * n]}
+    rows = [(pk, uid) for pk, uid in Post.likes.through.objects.filter(post_id__in=ids)
+            .values_list('post_id', 'user_id') if pk not in cached]
+    # 集合里可能有已经注销的用户，外键会失败
+    alive = set(User.objects.filter(pk__in=set().union(*cached.values())).values_list('id', flat=True))
+    rows += [(pk, uid) for pk, uids in cached.items() for uid in uids if uid in alive]
+    through = ArchivedPost.likes.through
+    through.objects.bulk_create([through(archivedpost_id=pk, user_id=uid) for pk, uid in rows], batch_size=1000)
+
+
+def _forget(ids):
+    pipe = redis.pipeline(transaction=False)
+    for pk in ids:
+        # 片段换一代（批量详情直接读片段），计数键删掉，retrieve 会回源到归档表
+        pipe.incr(post_version_key(pk, 'core'))
+        pipe.incr(post_version_key(pk, 'comments'))
+    pipe.execute()
+    redis.delete(*[key for pk in ids for key in (f"post:{pk}:view_count", like_key(pk))])
+    for pk in ids:
+        autocomplete.remove('post', pk)
+    bump_generation('posts')
+
+
+def archive_older_than(days=None, batch_size=None, dry_run=False):
+    """归档所有超龄文章，返回 (文章数, 评论数)；dry_run 只统计"""
+    before = cutoff(days)
+    batch_size = batch_size or _conf().get('BATCH_SIZE', 200)
+    if dry_run:
+        old = Post.objects.filter(created_at__lt=before).exclude(status='deleted')
+        return old.count(), Comment.objects.filter(post__in=old).count()
+    posts = comments = 0
+    while True:
+        ids = candidates(before, batch_size)
+        if not ids:
+            break
+        moved_posts, moved_comments = archive_batch(ids, before)
+        posts += moved_posts
+        comments += moved_comments
+    if posts:
+        # 分类/标签统计只算热表里的文章，整体重算一次比逐篇扣减便宜
+        for kind in stats.KINDS:
+            stats.rebuild(kind)
+    return posts, comments
+
+
+def get_post(pk, user=None):
+    """归档表里的文章：已发布的谁都能看，草稿只有作者能看；没有返回 None"""
+    visible = Q(status='published')
+    if user is not None and user.is_authenticated:
+        visible |= Q(author=user)
+    return ArchivedPost.objects.select_related('author', 'category').prefetch_related('tags') \
+        .filter(visible, pk=pk).first()
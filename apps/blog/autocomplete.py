@@ -0,0 +1,166 @@
+"""
+标题 / 标签 / 分类的前缀自动补全
+
+每个前缀一个 ZSET：ac:p:{前缀} → {kind:id: 分数}，只保留分数最高的 PREFIX_KEEP 个。
+条目本身存在 ac:items（hash，kind:id → {"type", "id", "text"}），改名/删除时靠它找到旧前缀。
+前缀单独放在 ac:p: 下面，不然 "items" 这个前缀会和 ac:items 撞成同一个 key。
+前缀取整段文本以及其中每个词的开头（最多 MAX_WORDS 个词），转小写，最长 MAX_PREFIX 个字符。
+文章按浏览量排序，标签/分类固定排在文章前面、按文章数排序。
+查询是一个 Lua 脚本：ZREVRANGE + HMGET 一次往返。
+
+写操作时增量维护，分数只在写入时计算；分数漂移、索引被清掉时用
+`python manage.py rebuild_autocomplete` 从数据库重建。
+"""
+import json
+
+from django.db.models import Count, Q
+
+from utils.redis_pool import redis, register_script
+from .models import Post, Tag, Category
+
+MAX_PREFIX = 12
+MAX_WORDS = 8
+PREFIX_KEEP = 100
+ITEMS_KEY = 'ac:items'
+TAXONOMY_BOOST = 10 ** 12
+REBUILD_BATCH = 500
+
+_SUGGEST = register_script("""
+local members = redis.call('ZREVRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #members == 0 then
+    return {}
+end
+return redis.call('HMGET', KEYS[2], unpack(members))
+""")
+
+
+def prefix_key(prefix):
+    return f"ac:p:{prefix}"
+
+
+def normalize(text):
+    return ' '.join(text.lower().split())
+
+
+def _word_starts(text):
+    return [0] + [i + 1 for i, ch in enumerate(text) if ch == ' ']
+
+
+def prefixes(text):
+    text = normalize(text)
+    result = set()
+    for start in _word_starts(text)[:MAX_WORDS]:
+        head = text[start:start + MAX_PREFIX]
+        result.update(head[:end] for end in range(1, len(head) + 1) if not head[end - 1].isspace())
+    return result
+
+
+def post_entry(post):
+    return 'post', post.pk, post.title, post.views
+
+
+def add_many(entries):
+    """
+    entries: [(kind, id, text, score)]；已经在索引里的条目先摘掉旧前缀再加，
+    读旧条目一次往返，写入一个 pipeline
+    """
+    if not entries:
+        return
+    members = [f"{kind}:{pk}" for kind, pk, _, _ in entries]
+    old_items = redis.hmget(ITEMS_KEY, members)
+    pipe = redis.pipeline(transaction=False)
+    for member, raw in zip(members, old_items):
+        if raw:
+            for prefix in prefixes(json.loads(raw)['text']):
+                pipe.zrem(prefix_key(prefix), member)
+    _write(pipe, entries, members)
+    pipe.execute()
+
+
+def _write(pipe, entries, members):
+    for (kind, pk, text, score), member in zip(entries, members):
+        for prefix in prefixes(text):
+            pipe.zadd(prefix_key(prefix), {member: score})
+            pipe.zremrangebyrank(prefix_key(prefix), 0, -PREFIX_KEEP - 1)
+        pipe.hset(ITEMS_KEY, member, json.dumps({'type': kind, 'id': pk, 'text': text}, ensure_ascii=False))
+
+
+def remove(kind, pk):
+    member = f"{kind}:{pk}"
+    raw = redis.hget(ITEMS_KEY, member)
+    if raw is None:
+        return
+    pipe = redis.pipeline(transaction=False)
+    for prefix in prefixes(json.loads(raw)['text']):
+        pipe.zrem(prefix_key(prefix), member)
+    pipe.hdel(ITEMS_KEY, member)
+    pipe.execute()
+
+
+def index_post(post):
+    """文章写完以后调用：已发布的进索引，草稿从索引里拿掉"""
+    if post.status == 'published':
+        add_many([post_entry(post)])
+    else:
+        remove('post', post.pk)
+
+
+def index_taxonomy(kind, obj, post_count=0):
+    add_many([(kind, obj.pk, obj.name, TAXONOMY_BOOST + post_count)])
+
+
+def suggest(q, limit=10):
+    q = normalize(q)
+    if not q:
+        return []
+    # 超过 MAX_PREFIX 的输入先按前缀取一批，再在应用里精确过滤
+    fetch = limit if len(q) <= MAX_PREFIX else limit * 5
+    items = [json.loads(raw) for raw in _SUGGEST(keys=[prefix_key(q[:MAX_PREFIX]), ITEMS_KEY], args=[fetch]) if raw]
+    if len(q) > MAX_PREFIX:
+        items = [item for item in items if _matches(normalize(item['text']), q)]
+    return items[:limit]
+
+
+def _matches(text, q):
+    return any(text.startswith(q, start) for start in _word_starts(text))
+
+
+def rebuild():
+    """按数据库重建整个索引：先清掉 ac:*，再分批写入"""
+    batch = []
+    for key in redis.scan_iter('ac:*', count=1000):
+        batch.append(key)
+        if len(batch) >= REBUILD_BATCH:
+            redis.delete(*batch)
+            batch = []
+    if batch:
+        redis.delete(*batch)
+
+    published = Q(post__status='published')
+    sources = [
+        (('post', pk, title, views) for pk, title, views in
+         Post.objects.filter(status='published').values_list('id', 'title', 'views').iterator(chunk_size=REBUILD_BATCH)),
+        (('tag', pk, name, TAXONOMY_BOOST + n) for pk, name, n in
+         Tag.objects.annotate(n=Count('post', filter=published)).values_list('id', 'name', 'n')),
+        (('category', pk, name, TAXONOMY_BOOST + n) for pk, name, n in
+         Category.objects.annotate(n=Count('post', filter=published)).values_list('id', 'name', 'n')),
+    ]
+    total = 0
+    for source in sources:
+        chunk = []
+        for entry in source:
+            chunk.append(entry)
+            if len(chunk) >= REBUILD_BATCH:
+                total += _write_fresh(chunk)
+                chunk = []
+        total += _write_fresh(chunk)
+    return total
+
+
+def _write_fresh(entries):
+    if not entries:
+        return 0
+    pipe = redis.pipeline(transaction=False)
+    _write(pipe, entries, [f"{kind}:{pk}" for kind, pk, _, _ in entries])
+    pipe.execute()
+    return len(entries)
@@ -0,0 +1,431 @@
+"""
+文章详情的片段缓存
+
+详情拆成三块，各自带版本号：
+    post:{pk}:frag:core:v{n}       文章本体（标题/正文/标签/分类...）
+    post:{pk}:frag:comments:v{n}   第一页评论
+    user:{uid}:frag:card:v{n}      作者卡片
+版本号存在 post:{pk}:ver:core / post:{pk}:ver:comments / user:{uid}:ver:card，
+数据变了只 INCR 对应的版本号，旧片段不用删，等 TTL 自然过期。
+新评论只让 comments 失效，不会连带重新序列化正文。
+
+列表页缓存按"代"失效：
+    list:{name}:{查询参数摘要}:g{n}
+代号存在 {name}:gen（例如 posts:gen），任何写操作 INCR 一下，
+所有旧列表页一起失效，不需要 SCAN 找键再删。
+"""
+import gzip
+import hashlib
+import json
+import uuid
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count
+from django.utils import timezone
+from rest_framework.response import Response
+
+from utils.redis_pool import redis, register_script, group_keys
+from .models import Post
+from .visitors import uv_key
+
+try:
+    import brotli
+except ImportError:  # brotli 是可选依赖，没装就只用 gzip
+    brotli = None
+
+FRAGMENT_TTL = 86400
+LIST_CACHE_TTL = 300
+
+# 一次往返同时读版本号和对应版本的片段
+# KEYS[i] 是版本号键，ARGV[i] 是片段键前缀（拼上版本号就是片段键）
+_FETCH_FRAGMENTS = register_script("""
+local out = {}
+for i, ver_key in ipairs(KEYS) do
+    local ver = redis.call('GET', ver_key) or '0'
+    out[#out + 1] = ver
+    out[#out + 1] = redis.call('GET', ARGV[i] .. ver)
+end
+return out
+""")
+
+
+def post_version_key(pk, part):
+    return f"post:{pk}:ver:{part}"
+
+
+def post_fragment_prefix(pk, part):
+    return f"post:{pk}:frag:{part}:v"
+
+
+def card_version_key(user_id):
+    return f"user:{user_id}:ver:card"
+
+
+def card_fragment_prefix(user_id):
+    return f"user:{user_id}:frag:card:v"
+
+
+def _fetch(version_keys, prefixes):
+    """返回 [(version, data 或 None), ...]；Redis 分片时按节点分组，每个节点一次往返"""
+    result = [None] * len(version_keys)
+    for indexes in group_keys(version_keys):
+        raw = _FETCH_FRAGMENTS(keys=[version_keys[i] for i in indexes], args=[prefixes[i] for i in indexes])
+        for n, i in enumerate(indexes):
+            ver, data = raw[2 * n], raw[2 * n + 1]
+            result[i] = (int(ver), json.loads(data) if data else None)
+    return result
+
+
+# 换版本号；读到的旧版本之后没人换过（INCR 之后正好是旧版本 + 1）才把改好的片段写到新版本上
+_BUMP_AND_SET = register_script("""
+local ver = redis.call('INCR', KEYS[1])
+if ARGV[1] ~= '' and ver == tonumber(ARGV[2]) + 1 then
+    redis.call('SET', ARGV[3] .. ver, ARGV[1], 'EX', ARGV[4])
+end
+return ver
+""")
+
+
+def get_post_fragments(pk):
+    """返回 {'core': (ver, data), 'comments': (ver, data)}"""
+    parts = ('core', 'comments')
+    fetched = _fetch([post_version_key(pk, p) for p in parts],
+                     [post_fragment_prefix(pk, p) for p in parts])
+    return dict(zip(parts, fetched))
+
+
+def set_post_fragment(pk, part, version, data):
+    redis.set(f"{post_fragment_prefix(pk, part)}{version}", json.dumps(data), ex=FRAGMENT_TTL)
+
+
+def patch_post_core(pk, changes, revision):
+    """
+    正文增量更新提交以后调用：正文片段换一个版本，评论片段、作者卡片照常命中
+    版本号一定要换：同时在回源的读请求可能拿着更新前的行，它只会写到旧版本的键上；
+    旧版本的片段正好是更新前那一版（revision - 1）时，直接套上改动写到新版本，省一次回源
+    """
+    (ver, data), = _fetch([post_version_key(pk, 'core')], [post_fragment_prefix(pk, 'core')])
+    patched = ''
+    if data is not None and data.get('revision') == revision - 1:
+        patched = json.dumps({**data, **changes})
+    _BUMP_AND_SET(keys=[post_version_key(pk, 'core')],
+                  args=[patched, ver, post_fragment_prefix(pk, 'core'), FRAGMENT_TTL])
+
+
+def get_many_post_fragments(pks, part):
+    """多篇文章的同一个片段，一次往返：[(ver, data 或 None), ...]，顺序和 pks 一致"""
+    return _fetch([post_version_key(pk, part) for pk in pks],
+                  [post_fragment_prefix(pk, part) for pk in pks])
+
+
+def get_author_card(user_id):
+    return _fetch([card_version_key(user_id)], [card_fragment_prefix(user_id)])[0]
+
+
+def get_many_author_cards(user_ids):
+    return _fetch([card_version_key(uid) for uid in user_ids],
+                  [card_fragment_prefix(uid) for uid in user_ids])
+
+
+def set_author_card(user_id, version, data):
+    redis.set(f"{card_fragment_prefix(user_id)}{version}", json.dumps(data), ex=FRAGMENT_TTL)
+
+
+def set_many_fragments(post_fragments=(), author_cards=()):
+    """
+    批量回填，一个 pipeline
+    post_fragments: [(pk, part, version, data)]，author_cards: [(user_id, version, data)]
+    """
+    pipe = redis.pipeline(transaction=False)
+    for pk, part, version, data in post_fragments:
+        pipe.set(f"{post_fragment_prefix(pk, part)}{version}", json.dumps(data), ex=FRAGMENT_TTL)
+    for user_id, version, data in author_cards:
+        pipe.set(f"{card_fragment_prefix(user_id)}{version}", json.dumps(data), ex=FRAGMENT_TTL)
+    pipe.execute()
+
+
+def bump_post(pk, *parts):
+    """让文章的某几个片段失效，例如 bump_post(pk, 'comments')"""
+    pipe = redis.pipeline(transaction=False)
+    for part in parts:
+        pipe.incr(post_version_key(pk, part))
+    pipe.execute()
+
+
+def bump_author_card(user_id):
+    # 注意：评论里内嵌的作者信息不跟着失效，等评论页片段自然过期
+    redis.incr(card_version_key(user_id))
+
+
+LIKE_SET_TTL = 86400
+LIKE_LOAD_BATCH = 5000
+LIKE_SCAN_ROUNDS = 10  # 一页最多扫几次，集合很稀疏时也不会一直扫下去
+LIKE_LOAD_TTL = 300    # 加载用的临时集合最多留这么久，加载进程挂了也会自己消失
+
+# 加载完换上去：正式的集合已经有了（别人先加载完，之后可能还点过赞）就丢掉这份，不覆盖
+_SWAP_LIKE_SET = register_script("""
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+redis.call('RENAME', KEYS[1], KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return 1
+""")
+
+# 点赞切换：在集合里就移除，不在就加入；顺带续期，返回 {是否点赞, 点赞数}
+_TOGGLE_LIKE = register_script("""
+local liked
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1 then
+    redis.call('SREM', KEYS[1], ARGV[1])
+    liked = 0
+else
+    redis.call('SADD', KEYS[1], ARGV[1])
+    liked = 1
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return {liked, redis.call('SCARD', KEYS[1])}
+""")
+
+
+def like_key(pk):
+    return f"post:{pk}:like_member"
+
+
+def ensure_like_set(post):
+    """
+    点赞集合不在 Redis 里就从数据库加载一次
+    按 user_id 分批读、分批 SADD 到临时 key，最后原子地换上去：点赞几百万的文章内存也有上限，
+    别人也不会读到只加载了一半的集合
+    临时 key 每次加载都不一样（带 uuid，前缀相同所以和正式 key 在同一个分片），
+    并发加载互不干扰；加载期间别人已经换上去的集合不会被覆盖
+    """
+    key = like_key(post.pk)
+    if redis.exists(key):
+        return
+    through = Post.likes.through
+    tmp = f"{key}:loading:{uuid.uuid4().hex}"
+    last_id, loaded = 0, False
+    try:
+        while True:
+            user_ids = list(through.objects.filter(post_id=post.pk, user_id__gt=last_id)
+                            .order_by('user_id').values_list('user_id', flat=True)[:LIKE_LOAD_BATCH])
+            if not user_ids:
+                break
+            pipe = redis.pipeline(transaction=False)
+            pipe.sadd(tmp, *user_ids)
+            pipe.expire(tmp, LIKE_LOAD_TTL)
+            pipe.execute()
+            last_id, loaded = user_ids[-1], True
+    except BaseException:
+        redis.delete(tmp)
+        raise
+    if loaded:
+        _SWAP_LIKE_SET(keys=[tmp, key], args=[LIKE_SET_TTL])
+
+
+def scan_likers(pk, cursor=0, count=20):
+    """
+    用 SSCAN 取一页点赞用户 id，返回 (ids, 下一页游标)，游标为 0 表示扫完了
+    每次只扫集合的一小段，和集合多大无关；COUNT 只是提示，一页的条数会在 count 上下浮动，
+    扫描期间集合有变动时同一个人可能出现在两页里（SSCAN 的语义）
+    """
+    key = like_key(pk)
+    ids = []
+    for _ in range(LIKE_SCAN_ROUNDS):
+        cursor, batch = redis.sscan(key, cursor, count=count)
+        ids.extend(int(uid) for uid in batch)
+        if cursor == 0 or len(ids) >= count:
+            break
+    return ids, cursor
+
+
+def toggle_like(pk, user_id):
+    liked, count = _TOGGLE_LIKE(keys=[like_key(pk)], args=[user_id, LIKE_SET_TTL])
+    return bool(liked), count
+
+
+def liked_post_ids(ids, user):
+    """一批文章里当前用户点过赞的 id：一次 pipeline 查点赞集合，集合不在 Redis 的再一条 SQL 回源"""
+    if not user.is_authenticated or not ids:
+        return set()
+    pipe = redis.pipeline(transaction=False)
+    for pk in ids:
+        pipe.exists(like_key(pk))
+        pipe.sismember(like_key(pk), user.id)
+    results = pipe.execute()
+    liked, missing = set(), []
+    for i, pk in enumerate(ids):
+        exists, member = results[2 * i], results[2 * i + 1]
+        if not exists:
+            missing.append(pk)
+        elif member:
+            liked.add(pk)
+    if missing:
+        liked.update(Post.likes.through.objects.filter(user_id=user.id, post_id__in=missing)
+                     .values_list('post_id', flat=True))
+    return liked
+
+
+def like_counts(ids):
+    """一批文章的点赞数 {id: 数}：一次 pipeline 读点赞集合的 SCARD，集合不在 Redis 的再一条 SQL 回源"""
+    if not ids:
+        return {}
+    pipe = redis.pipeline(transaction=False)
+    for pk in ids:
+        pipe.exists(like_key(pk))
+        pipe.scard(like_key(pk))
+    results = pipe.execute()
+    counts, missing = {}, []
+    for i, pk in enumerate(ids):
+        if results[2 * i]:
+            counts[pk] = results[2 * i + 1]
+        else:
+            missing.append(pk)
+            counts[pk] = 0
+    if missing:
+        counts.update(Post.likes.through.objects.filter(post_id__in=missing).values('post_id')
+                      .annotate(n=Count('user_id')).values_list('post_id', 'n'))
+    return counts
+
+
+def is_liked(pk, user):
+    """当前用户是否点过赞"""
+    return int(pk) in liked_post_ids([int(pk)], user)
+
+
+def generation_key(name):
+    return f"{name}:gen"
+
+
+def bump_generation(name):
+    redis.incr(generation_key(name))
+
+
+def list_cache_prefix(name, request):
+    """按 host + 路径 + 排好序的查询参数 算摘要，参数顺序不同也能命中同一份缓存"""
+    params = sorted(
+        (key, value)
+        for key in request.query_params
+        for value in request.query_params.getlist(key)
+        if value != ''
+    )
+    # 分页里的 next/previous 是带 host 的绝对地址，所以 host 也要算进去
+    raw = json.dumps([request.get_host(), request.path, params])
+    digest = hashlib.sha1(raw.encode()).hexdigest()
+    return f"list:{name}:{digest}:g"
+
+
+class CachedListMixin:
+    """
+    列表接口的响应缓存，配合 bump_generation 使用
+    子类设置 list_cache_name，按需重写 list_cache_allowed / overlay_list_data
+    """
+    list_cache_name = None
+
+    def list_cache_allowed(self, request):
+        return True
+
+    def overlay_list_data(self, request, data):
+        """缓存里只放所有人都一样的部分，和用户相关的字段在这里补上"""
+        return data
+
+    def list(self, request, *args, **kwargs):
+        if not self.list_cache_allowed(request):
+            return super().list(request, *args, **kwargs)
+        prefix = list_cache_prefix(self.list_cache_name, request)
+        gen, data = _fetch([generation_key(self.list_cache_name)], [prefix])[0]
+        if data is None:
+            response = super().list(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            data = response.data
+            redis.set(f"{prefix}{gen}", json.dumps(data, cls=DjangoJSONEncoder), ex=LIST_CACHE_TTL)
+        return Response(self.overlay_list_data(request, data))
+
+
+# 预压缩的详情：post:{pk}:enc:{encoding}:{core版本}.{comments版本}，hash 里存
+# author（作者 id）/ card（压缩时的作者卡片版本）/ body（压缩好的字节）
+_FETCH_ENCODED = register_script("""
+local core = redis.call('GET', KEYS[1]) or '0'
+local comments = redis.call('GET', KEYS[2]) or '0'
+local key = ARGV[1] .. core .. '.' .. comments
+local res = redis.call('HMGET', key, 'author', 'card', 'body')
+return {key, res[1], res[2], res[3]}
+""")
+
+
+def negotiate_encoding(accept_encoding):
+    accepted = {part.split(';')[0].strip() for part in accept_encoding.split(',')}
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return 'identity'
+
+
+def _encode(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+
+def _fetch_encoded(pk, encoding):
+    return _FETCH_ENCODED(keys=[post_version_key(pk, 'core'), post_version_key(pk, 'comments')],
+                          args=[f"post:{pk}:enc:{encoding}:"])
+
+
+def get_encoded_detail(pk, encoding):
+    """
+    返回 (key, body)：key 是按读的这一刻的版本号拼出来的缓存键，没命中时 body 为 None
+    （作者卡片版本变了也算没命中），重建好以后拿这个 key 调 set_encoded_detail
+    """
+    key, author, card, body = _fetch_encoded(pk, encoding)
+    if body is None:
+        return key, None
+    if (redis.get(card_version_key(int(author))) or b'0') != card:
+        return key, None
+    return key, body
+
+
+def set_encoded_detail(key, encoding, data, cacheable=True):
+    """
+    压缩并缓存详情的静态部分，返回压缩后的字节
+    key 必须是组装 data 之前读到的：组装期间文章或评论换了版本，旧内容只会写到旧版本的键上
+    """
+    body = _encode(json.dumps(data, cls=DjangoJSONEncoder).encode(), encoding)
+    if cacheable:
+        author_id = data['author']['id']
+        card = redis.get(card_version_key(author_id)) or b'0'
+        pipe = redis.pipeline()
+        pipe.hset(key, mapping={'author': author_id, 'card': card, 'body': body})
+        pipe.expire(key, FRAGMENT_TTL)
+        pipe.execute()
+    return body
+
+
+def read_counters(pk, user):
+    """会变的计数：浏览量、今天的独立访客、点赞数、当前用户是否点赞；不存在的文章返回 None"""
+    pk = int(pk)
+    pipe = redis.pipeline(transaction=False)
+    pipe.get(f"post:{pk}:view_count")
+    pipe.pfcount(uv_key(pk, timezone.localdate()))
+    pipe.exists(like_key(pk))
+    pipe.scard(like_key(pk))
+    views, unique, has_likes, like_count = pipe.execute()
+    if views is None:
+        row = Post.objects.filter(pk=pk).exclude(status='deleted').values('views').first()
+        if row is None:
+            return None
+        views = row['views']
+    if not has_likes:
+        like_count = Post.likes.through.objects.filter(post_id=pk).count()
+    return {
+        'id': pk,
+        'views': int(views),
+        'unique_visitors': unique,
+        'like_count': like_count,
+        'is_like': is_liked(pk, user),
+    }
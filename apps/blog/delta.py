@@ -0,0 +1,20 @@
+"""
+正文增量更新
+
+客户端只传改动：基于 revision 版本的正文，按顺序执行一串编辑操作
+    {"pos": 起始位置, "delete": 删除的字符数, "insert": 插入的文本}
+位置按 Unicode 字符（code point）算，后一个操作的位置基于前一个操作执行完的文本。
+"""
+
+
+class DeltaError(ValueError):
+    pass
+
+
+def apply_ops(text, ops):
+    for i, op in enumerate(ops):
+        pos, delete, insert = op['pos'], op.get('delete', 0), op.get('insert', '')
+        if pos + delete > len(text):
+            raise DeltaError(f'第 {i + 1} 个操作超出了正文范围')
+        text = text[:pos] + insert + text[pos + delete:]
+    return text
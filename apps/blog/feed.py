@@ -0,0 +1,115 @@
+"""
+关注动态（首页时间线）
+
+写扩散：发文时把文章 id 推进每个粉丝的时间线 user:{uid}:timeline
+（ZSET，score 是发文时间戳，只保留最近 TIMELINE_SIZE 条）。
+粉丝特别多的作者（大 V）不扇出，读的时候再把他们的新文章合并进来。
+只给已经有时间线的粉丝推，不活跃用户的时间线过期后下次读再从数据库重建。
+"""
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from apps.users.models import Follow
+from utils.jobs import job
+from utils.redis_pool import redis
+from .models import Post
+
+TIMELINE_SIZE = 800
+TIMELINE_TTL = 86400 * 7
+FANOUT_BATCH = 1000
+CELEBRITY_THRESHOLD = getattr(settings, 'FEED_CELEBRITY_THRESHOLD', 5000)
+CELEBRITIES_KEY = 'feed:celebrities'
+# 重建时总会写进去的占位成员（score 0，读的时候区间从 (0 开始所以不会读到）：
+# 关注的人还没发过文章时时间线也要存在，否则每次读都重查数据库，扇出也会跳过这个用户
+EMPTY_MARKER = 'none'
+
+
+def timeline_key(user_id):
+    return f"user:{user_id}:timeline"
+
+
+def refresh_celebrity(user_id):
+    """粉丝数跨过阈值时进出大 V 集合"""
+    if Follow.objects.filter(followee_id=user_id).count() >= CELEBRITY_THRESHOLD:
+        redis.sadd(CELEBRITIES_KEY, user_id)
+    else:
+        redis.srem(CELEBRITIES_KEY, user_id)
+
+
+def _celebrity_ids():
+    return {int(uid) for uid in redis.smembers(CELEBRITIES_KEY)}
+
+
+@job
+def fanout_post(post_id):
+    """把新文章推给作者的粉丝，按 Follow.id 分批，每批一个 pipeline"""
+    post = Post.objects.filter(pk=post_id, status='published').values('author_id', 'created_at').first()
+    if not post or post['author_id'] in _celebrity_ids():
+        return
+    score = post['created_at'].timestamp()
+    last_id = 0
+    while True:
+        batch = list(Follow.objects.filter(followee_id=post['author_id'], id__gt=last_id)
+                     .order_by('id').values_list('id', 'follower_id')[:FANOUT_BATCH])
+        if not batch:
+            break
+        last_id = batch[-1][0]
+        keys = [timeline_key(follower_id) for _, follower_id in batch]
+        pipe = redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.exists(key)
+        alive = [key for key, exists in zip(keys, pipe.execute()) if exists]
+        pipe = redis.pipeline(transaction=False)
+        for key in alive:
+            pipe.zadd(key, {post_id: score})
+            pipe.zremrangebyrank(key, 0, -TIMELINE_SIZE - 1)
+        pipe.execute()
+
+
+def rebuild_timeline(user_id):
+    """时间线不在 Redis 里时，从数据库取关注的（非大 V）作者最近的文章重建"""
+    followee_ids = set(Follow.objects.filter(follower_id=user_id).values_list('followee_id', flat=True))
+    followee_ids -= _celebrity_ids()
+    rows = Post.objects.filter(author_id__in=followee_ids, status='published') \
+        .order_by('-created_at').values_list('id', 'created_at')[:TIMELINE_SIZE]
+    key = timeline_key(user_id)
+    pipe = redis.pipeline()
+    pipe.zadd(key, {EMPTY_MARKER: 0, **{pk: created_at.timestamp() for pk, created_at in rows}})
+    pipe.expire(key, TIMELINE_TTL)
+    pipe.execute()
+
+
+def invalidate_timeline(user_id):
+    # 关注/取关后直接丢掉，下次读的时候按新的关注列表重建
+    redis.delete(timeline_key(user_id))
+
+
+def feed_page(user_id, before=None, size=20):
+    """
+    返回 ([(post_id, score)], 下一页游标)
+    普通作者的文章：一次 ZREVRANGEBYSCORE；关注了大 V 的话再查一次大 V 的新文章合并
+    """
+    key = timeline_key(user_id)
+    if not redis.exists(key):
+        rebuild_timeline(user_id)
+    max_score = f"({before}" if before else '+inf'
+    entries = [(int(pk), score) for pk, score in
+               redis.zrevrangebyscore(key, max_score, '(0', start=0, num=size, withscores=True)]
+
+    celebrities = _celebrity_ids()
+    if celebrities:
+        followed = list(Follow.objects.filter(follower_id=user_id, followee_id__in=celebrities)
+                        .values_list('followee_id', flat=True))
+        if followed:
+            queryset = Post.objects.filter(author_id__in=followed, status='published')
+            if before:
+                queryset = queryset.filter(created_at__lt=datetime.fromtimestamp(before, tz=timezone.utc))
+            # 刚变成大 V 的作者，之前扇出的文章还在粉丝时间线里，按文章 id 去重
+            merged = dict(entries)
+            merged.update((pk, created_at.timestamp()) for pk, created_at in
+                          queryset.order_by('-created_at').values_list('id', 'created_at')[:size])
+            entries = sorted(merged.items(), key=lambda e: e[1], reverse=True)[:size]
+
+    next_cursor = entries[-1][1] if len(entries) == size else None
+    return entries, next_cursor
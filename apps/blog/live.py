@@ -0,0 +1,210 @@
+"""
+实时计数推送（Server-Sent Events）
+
+客户端不用再轮询详情接口刷新浏览量/点赞数（轮询每次都走 retrieve 的完整路径，还会加浏览量），
+改成连一个 SSE：GET /api/live/counters/?ids=1,2,3（最多 LIVE['MAX_IDS'] 篇）
+    - 连上先推一次当前计数（不加浏览量），之后只推变了的字段
+    - like / retrieve 写完计数后 PUBLISH 到 live:post:{pk}，消息里是最新的绝对值，
+      合并时后到的直接覆盖先到的，丢一条也不会算错
+    - 每个 worker（每个事件循环）只有一个 Redis 订阅连接（Broadcaster），
+      有人看的文章才 SUBSCRIBE，最后一个人走了就 UNSUBSCRIBE；
+      收到的更新按文章合并，每 LIVE['WINDOW'] 秒统一推一次，热门文章每秒上千次浏览也只推一条
+    - 每个连接自己也只攒最新值，慢客户端不会让内存越积越多
+    - 空闲时每 HEARTBEAT 秒发一个注释行，防止代理把连接当成死连接断掉
+
+长连接只能跑在 ASGI 上（config/asgi.py，例如 uvicorn worker），WSGI 下直接返回 501；
+建议在 nginx 上把 /api/live/ 单独转给 ASGI 进程，并关掉这个路径的响应缓冲。
+"""
+import asyncio
+import json
+import logging
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+
+from utils.redis_pool import redis
+from .cache import read_counters
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'live:post:'
+
+
+def _conf():
+    return getattr(settings, 'LIVE', {})
+
+
+def channel(pk):
+    return f"{CHANNEL_PREFIX}{pk}"
+
+
+def publish(pk, **counters):
+    """计数变了以后调用，例如 publish(pk, like_count=3)；没人订阅时 PUBLISH 几乎没有开销"""
+    redis.publish(channel(pk), json.dumps(counters))
+
+
+def _async_client():
+    # redis.asyncio 只有 ASGI 进程里真的推送时才导入
+    import redis.asyncio
+    conf = _conf()
+    url = conf.get('REDIS_URL') or settings.CACHES['default']['LOCATION']
+    return redis.asyncio.from_url(url, **conf.get('CONNECTION_KWARGS', {}))
+
+
+class Listener:
+    """一个 SSE 连接：只保留每篇文章每个字段的最新值"""
+
+    def __init__(self, pks):
+        self.pks = pks
+        self.updates = {}
+        self.event = asyncio.Event()
+
+    def push(self, pk, counters):
+        self.updates.setdefault(pk, {}).update(counters)
+        self.event.set()
+
+    def take(self):
+        self.event.clear()
+        updates, self.updates = self.updates, {}
+        return updates
+
+
+class Broadcaster:
+    """一个事件循环一个：共用一条订阅连接，按文章合并更新，按时间窗口分发给所有连接"""
+
+    def __init__(self):
+        self.window = _conf().get('WINDOW', 1.0)
+        self.listeners = {}  # pk -> {Listener}
+        self.pending = {}    # pk -> 这个窗口里合并好的计数
+        self.pubsub = None
+        self._lock = asyncio.Lock()
+        self._tasks = []
+
+    async def join(self, pks):
+        listener = Listener(pks)
+        async with self._lock:
+            if self.pubsub is None:
+                self.pubsub = _async_client().pubsub(ignore_subscribe_messages=True)
+                self._tasks = [asyncio.create_task(self._read()), asyncio.create_task(self._flush())]
+            new = [pk for pk in pks if pk not in self.listeners]
+            if new:
+                await self.pubsub.subscribe(*map(channel, new))
+            for pk in pks:
+                self.listeners.setdefault(pk, set()).add(listener)
+        return listener
+
+    async def leave(self, listener):
+        async with self._lock:
+            gone = []
+            for pk in listener.pks:
+                group = self.listeners.get(pk, set())
+                group.discard(listener)
+                if not group:
+                    self.listeners.pop(pk, None)
+                    gone.append(pk)
+            if gone:
+                await self.pubsub.unsubscribe(*map(channel, gone))
+
+    async def _read(self):
+        from redis.exceptions import ConnectionError, TimeoutError
+        while True:
+            if not self.pubsub.subscribed:
+                await asyncio.sleep(self.window)
+                continue
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=self.window)
+            except (ConnectionError, TimeoutError) as exc:
+                # redis-py 下次读的时候会重连并重新订阅
+                logger.warning('实时计数订阅连接断开: %s', exc)
+                await asyncio.sleep(1)
+                continue
+            if message is None or message['type'] != 'message':
+                continue
+            name = message['channel']
+            pk = int((name.decode() if isinstance(name, bytes) else name)[len(CHANNEL_PREFIX):])
+            self.pending.setdefault(pk, {}).update(json.loads(message['data']))
+
+    async def _flush(self):
+        while True:
+            await asyncio.sleep(self.window)
+            pending, self.pending = self.pending, {}
+            for pk, counters in pending.items():
+                for listener in self.listeners.get(pk, ()):
+                    listener.push(pk, counters)
+
+
+_broadcasters = weakref.WeakKeyDictionary()
+
+
+def get_broadcaster():
+    loop = asyncio.get_running_loop()
+    if loop not in _broadcasters:
+        _broadcasters[loop] = Broadcaster()
+    return _broadcasters[loop]
+
+
+def _event(data):
+    return f"event: counters\ndata: {json.dumps(data)}\n\n"
+
+
+def _snapshot(pks):
+    # 只推已发布的文章：草稿、已删除（等后台清理、计数键还在）的不能让别人订阅到
+    # 这里拿不到 DRF 的 JWT 认证，作者看自己草稿的计数走 /api/articles/{id}/counters/
+    published = set(Post.objects.filter(pk__in=pks, status='published').values_list('id', flat=True))
+    rows = []
+    for pk in pks:
+        if pk not in published:
+            continue
+        counters = read_counters(pk, AnonymousUser())
+        if counters is not None:
+            counters.pop('is_like')
+            rows.append(counters)
+    return rows
+
+
+async def counters_stream(request):
+    """GET /api/live/counters/?ids=1,2,3"""
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'detail': '实时推送需要用 ASGI 部署（config.asgi）'}, status=501)
+    max_ids = _conf().get('MAX_IDS', 100)
+    try:
+        pks = list(dict.fromkeys(int(i) for i in request.GET.get('ids', '').split(',') if i.strip()))
+    except ValueError:
+        return JsonResponse({'detail': 'ids 必须是逗号分隔的整数'}, status=400)
+    if not pks or len(pks) > max_ids:
+        return JsonResponse({'detail': f'ids 需要 1 到 {max_ids} 个'}, status=400)
+
+    snapshot = await sync_to_async(_snapshot)(pks)
+    if not snapshot:
+        return JsonResponse({'detail': '文章不存在'}, status=404)
+    pks = [row['id'] for row in snapshot]
+    heartbeat = _conf().get('HEARTBEAT', 15)
+
+    async def stream():
+        broadcaster = get_broadcaster()
+        # 快照和订阅之间的更新会漏掉，但推的是绝对值，下一次变化就补齐了
+        listener = await broadcaster.join(pks)
+        try:
+            yield 'retry: 3000\n\n'
+            for row in snapshot:
+                yield _event(row)
+            while True:
+                try:
+                    await asyncio.wait_for(listener.event.wait(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+                    continue
+                for pk, counters in listener.take().items():
+                    yield _event({'id': pk, **counters})
+        finally:
+            await broadcaster.leave(listener)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from apps.blog import archive
+
+
+class Command(BaseCommand):
+    help = '把发布超过 ARCHIVE["POST_AGE_DAYS"] 天的文章连同评论、点赞、标签分批搬到归档表'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='归档多少天以前的文章，默认取 settings.ARCHIVE')
+        parser.add_argument('--batch', type=int, help='每个事务搬多少篇')
+        parser.add_argument('--dry-run', action='store_true', help='只统计会搬多少，不真的搬')
+
+    def handle(self, *args, **options):
+        posts, comments = archive.archive_older_than(options['days'], options['batch'], options['dry_run'])
+        verb = '将归档' if options['dry_run'] else '已归档'
+        self.stdout.write(f'{verb} {posts} 篇文章、{comments} 条评论')
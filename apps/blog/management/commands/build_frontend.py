@@ -0,0 +1,86 @@
+import gzip
+import hashlib
+import itertools
+import json
+import re
+import shutil
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+try:
+    import brotli
+except ImportError:  # 可选依赖
+    brotli = None
+
+STYLE_RE = re.compile(r'<style>(.*?)</style>', re.S)
+# 只抽没有 src 的内联脚本
+SCRIPT_RE = re.compile(r'<script>(.*?)</script>', re.S)
+# 压缩后比这个还小就不值得存 .gz 了
+MIN_COMPRESS_BYTES = 256
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def replace_blocks(regex, html, tag, keep):
+    """第 keep 个匹配换成 tag，其余匹配删掉"""
+    counter = itertools.count()
+    return regex.sub(lambda m: tag if next(counter) == keep else '', html)
+
+
+class Command(BaseCommand):
+    help = '构建前端：内联的 CSS/JS 抽成带内容哈希的文件，index.html 预压缩，输出到 FRONTEND_DIST_DIR'
+
+    def handle(self, *args, **options):
+        src = Path(settings.FRONTEND_SRC_DIR)
+        dist = Path(settings.FRONTEND_DIST_DIR)
+        assets = dist / 'assets'
+        if dist.exists():
+            shutil.rmtree(dist)
+        assets.mkdir(parents=True)
+        manifest = {}
+
+        def emit(logical_name, data):
+            stem, ext = logical_name.rsplit('.', 1)
+            name = f"{stem}.{content_hash(data)}.{ext}"
+            self.write(assets / name, data)
+            manifest[logical_name] = f"{settings.FRONTEND_ASSET_URL}{name}"
+            return manifest[logical_name]
+
+        # 1. fronted/ 下的其它静态文件（图片、字体...）原样带哈希复制，index.html 里的引用跟着改
+        html = (src / 'index.html').read_text(encoding='utf-8')
+        for path in sorted(src.rglob('*')):
+            if not path.is_file() or path.name == 'index.html' or dist in path.parents:
+                continue
+            rel = path.relative_to(src).as_posix()
+            url = emit(rel.replace('/', '_'), path.read_bytes())
+            html = html.replace(f'"{rel}"', f'"{url}"').replace(f'"/{rel}"', f'"{url}"')
+
+        # 2. 内联的 <style> / <script> 抽成独立文件，可以被浏览器长期缓存
+        styles = STYLE_RE.findall(html)
+        if styles:
+            url = emit('app.css', '\n'.join(styles).encode('utf-8'))
+            html = replace_blocks(STYLE_RE, html, f'<link href="{url}" rel="stylesheet">', keep=0)
+        scripts = SCRIPT_RE.findall(html)
+        if scripts:
+            url = emit('app.js', '\n;\n'.join(scripts).encode('utf-8'))
+            # 合并后的脚本放在最后一个内联脚本的位置（body 末尾），执行时机不变
+            html = replace_blocks(SCRIPT_RE, html, f'<script src="{url}"></script>', keep=len(scripts) - 1)
+
+        # 3. 预渲染好的 index.html（及其压缩版），运行时直接读进内存
+        self.write(dist / 'index.html', html.encode('utf-8'))
+        self.write(dist / 'manifest.json', json.dumps(manifest, indent=2).encode('utf-8'), compress=False)
+        for logical, url in manifest.items():
+            self.stdout.write(f'{logical} -> {url}')
+        self.stdout.write(self.style.SUCCESS(f'前端已构建到 {dist}'))
+
+    def write(self, path, data, compress=True):
+        path.write_bytes(data)
+        if not compress or len(data) < MIN_COMPRESS_BYTES:
+            return
+        path.with_name(path.name + '.gz').write_bytes(gzip.compress(data, compresslevel=9))
+        if brotli is not None:
+            path.with_name(path.name + '.br').write_bytes(brotli.compress(data))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.blog import synthetic, stats, autocomplete
+from apps.blog.cache import bump_generation
+
+
+class Command(BaseCommand):
+    help = '生成压测用的合成数据（用户 / 文章 / 标签 / 分类 / 带回复树的评论 / 点赞）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--comments', type=int, default=50000)
+        parser.add_argument('--likes', type=int, default=100000, help='大约的点赞数')
+        parser.add_argument('--tags', type=int, default=200)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--days', type=int, default=730, help='文章发布时间分布在最近多少天里')
+        parser.add_argument('--seed', type=int, default=0, help='同一个 seed 生成的数据一样')
+        parser.add_argument('--workers', type=int, default=1, help='并行写入的进程数')
+        parser.add_argument('--index', action='store_true', help='跑完以后重建自动补全索引（数据多时很慢）')
+
+    def handle(self, *args, **options):
+        if min(options[name] for name in ('users', 'posts', 'comments', 'likes', 'tags', 'categories')) < 0:
+            raise CommandError('数量不能是负数')
+
+        def report(phase, counts, seconds):
+            rows = sum(counts.values())
+            rate = f'{rows / seconds:,.0f} 行/秒' if seconds > 0 else '-'
+            detail = ', '.join(f'{key} {value:,}' for key, value in counts.items())
+            self.stdout.write(f'{phase}: {detail}（{seconds:.1f}s，{rate}）')
+
+        try:
+            totals = synthetic.generate(
+                users=options['users'], posts=options['posts'], comments=options['comments'],
+                likes=options['likes'], tags=options['tags'], categories=options['categories'],
+                days=options['days'], seed=options['seed'], workers=options['workers'], report=report,
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        # 数据是绕过视图直接写的库，Redis 里的列表缓存和统计要跟上
+        bump_generation('posts')
+        for kind in stats.KINDS:
+            stats.rebuild(kind)
+        if options['index']:
+            autocomplete.rebuild()
+        self.stdout.write(f'完成，共 {totals.pop("seconds")}s；登录密码都是 {synthetic.PASSWORD}')
@@ -0,0 +1,54 @@
+import glob
+import io
+import os
+import pstats
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = '按路由汇总 ProfilingMiddleware 写下的 pstats / collapsed stack 文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--route', help='只看这个路由（目录名），默认全部')
+        parser.add_argument('--sort', default='cumulative', help='pstats 排序字段')
+        parser.add_argument('--limit', type=int, default=20, help='每个路由输出多少行')
+
+    def handle(self, *args, **options):
+        directory = str(settings.PROFILING.get('DIR', os.path.join(settings.BASE_DIR, 'profiles')))
+        routes = [options['route']] if options['route'] else sorted(
+            name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name))
+        ) if os.path.isdir(directory) else []
+        if not routes:
+            self.stdout.write('还没有性能分析记录')
+            return
+
+        for route in routes:
+            route_dir = os.path.join(directory, route)
+            files = sorted(f for f in glob.glob(os.path.join(route_dir, '*.prof'))
+                           if not f.endswith('aggregate.prof'))
+            if files:
+                # 合并成一个 aggregate.prof，snakeviz / gprof2dot 可以直接打开
+                out = io.StringIO()
+                stats = pstats.Stats(*files, stream=out)
+                stats.dump_stats(os.path.join(route_dir, 'aggregate.prof'))
+                stats.sort_stats(options['sort']).print_stats(options['limit'])
+                self.stdout.write(f'== {route}: {len(files)} 个请求 ==')
+                self.stdout.write(out.getvalue())
+
+            folded = os.path.join(route_dir, 'stacks.folded')
+            if os.path.exists(folded):
+                # 追加写入时同一个栈会出现多行，合并后写到 aggregate.folded（原文件还在被追加，不动它）
+                counts = Counter()
+                with open(folded, encoding='utf-8') as f:
+                    for line in f:
+                        stack, _, count = line.rstrip('\n').rpartition(' ')
+                        if stack:
+                            counts[stack] += int(count)
+                with open(os.path.join(route_dir, 'aggregate.folded'), 'w', encoding='utf-8') as f:
+                    f.writelines(f'{stack} {count}\n' for stack, count in counts.items())
+                self.stdout.write(f'== {route}: {sum(counts.values())} 个采样，最热的调用栈 ==')
+                for stack, count in counts.most_common(options['limit']):
+                    self.stdout.write(f'{count:>6}  {stack}')
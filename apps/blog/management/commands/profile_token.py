@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from utils.profiling import make_token
+
+
+class Command(BaseCommand):
+    help = '生成 X-Profile 请求头用的签名 token'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=3600, help='有效期（秒）')
+
+    def handle(self, *args, **options):
+        self.stdout.write(make_token(options['max_age']))
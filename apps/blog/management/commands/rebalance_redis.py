@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.redis_pool import redis
+from utils.redis_shard import rebalance
+
+
+class Command(BaseCommand):
+    help = '加减 Redis 分片节点之后，把不在该在的节点上的 key 搬过去（DUMP / RESTORE）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='只统计要搬多少 key，不真的搬')
+        parser.add_argument('--batch', type=int, default=500, help='每批搬多少个 key')
+        parser.add_argument('--retired', nargs='*',
+                            default=getattr(settings, 'REDIS_SHARDS', {}).get('RETIRED', []),
+                            help='刚去掉的节点（CACHES 别名），上面的 key 全部搬走')
+
+    def handle(self, *args, **options):
+        if not hasattr(redis, 'ring'):
+            raise CommandError('没有配置 REDIS_SHARDS["NODES"]，不需要 rebalance')
+        from django_redis import get_redis_connection
+        retired = {alias: get_redis_connection(alias) for alias in options['retired']}
+        moved = rebalance(redis, old_nodes=retired, batch_size=options['batch'], dry_run=options['dry_run'])
+        for (source, target), count in sorted(moved.items()):
+            self.stdout.write(f'{source} -> {target}: {count}')
+        verb = '需要搬' if options['dry_run'] else '已搬'
+        self.stdout.write(f'{verb} {sum(moved.values())} 个 key')
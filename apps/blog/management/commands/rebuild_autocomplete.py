@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.blog import autocomplete
+
+
+class Command(BaseCommand):
+    help = '按数据库重建标题/标签/分类的自动补全前缀索引'
+
+    def handle(self, *args, **options):
+        total = autocomplete.rebuild()
+        self.stdout.write(f'已索引 {total} 条')
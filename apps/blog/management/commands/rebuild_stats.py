@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from apps.blog import stats
+
+
+class Command(BaseCommand):
+    help = '按数据库重算分类/标签的文章数和最新发布时间，纠正 Redis 里的统计漂移'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=stats.KINDS, help='只重算一种，默认全部')
+
+    def handle(self, *args, **options):
+        for kind in [options['kind']] if options['kind'] else stats.KINDS:
+            stats.rebuild(kind)
+            self.stdout.write(f'{kind} 统计已重建')
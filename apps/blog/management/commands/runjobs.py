@@ -0,0 +1,38 @@
+import signal
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import autodiscover_modules
+
+from utils.jobs import Worker
+
+
+class Command(BaseCommand):
+    help = '启动后台任务 worker（Redis Streams 消费组）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queues', default='default', help='逗号分隔的队列名')
+        parser.add_argument('--concurrency', type=int, default=4, help='线程/进程池大小')
+        parser.add_argument('--processes', action='store_true', help='用进程池代替线程池（CPU 密集型任务）')
+        parser.add_argument('--block-ms', type=int, default=5000, help='没有任务时阻塞等待的毫秒数')
+        parser.add_argument('--claim-idle-ms', type=int, default=60000,
+                            help='别的 worker 领走但超过这么久没 ack 的任务会被重新认领')
+
+    def handle(self, *args, **options):
+        # 各个 app 的 tasks.py 里用 @job 注册任务，先全部导入
+        autodiscover_modules('tasks')
+        worker = Worker(
+            queues=[q.strip() for q in options['queues'].split(',') if q.strip()],
+            concurrency=options['concurrency'],
+            use_processes=options['processes'],
+            block_ms=options['block_ms'],
+            claim_idle_ms=options['claim_idle_ms'],
+        )
+
+        def stop(signum, frame):
+            self.stdout.write('收到退出信号，处理完当前这批就退出')
+            worker.stopping = True
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        self.stdout.write(f'worker {worker.consumer} 开始消费: {", ".join(worker.queues)}')
+        worker.run()
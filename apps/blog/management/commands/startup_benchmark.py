@@ -0,0 +1,78 @@
+import json
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# 在全新的子进程里跑：模块缓存是空的，测到的才是 gunicorn worker 真实的启动开销
+CHILD = r"""
+import json, os, sys, time
+start = time.perf_counter()
+os.environ['DJANGO_SETTINGS_MODULE'] = sys.argv[1]
+from config.wsgi import application
+booted = time.perf_counter()
+
+from wsgiref.util import setup_testing_defaults
+environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': sys.argv[2], 'HTTP_HOST': sys.argv[3]}
+setup_testing_defaults(environ)
+status = []
+response = application(environ, lambda s, headers, exc_info=None: status.append(s))
+b''.join(response)
+response.close()
+done = time.perf_counter()
+
+print(json.dumps({
+    'boot_ms': (booted - start) * 1000,
+    'first_request_ms': (done - booted) * 1000,
+    'status': status[0],
+    'modules': sorted(sys.modules),
+}))
+"""
+
+
+class Command(BaseCommand):
+    help = '测 worker 启动耗时和第一个请求的耗时，超过 STARTUP_BUDGET 就失败'
+
+    def add_arguments(self, parser):
+        budget = getattr(settings, 'STARTUP_BUDGET', {})
+        parser.add_argument('--settings-module', default='config.settings_prod', help='被测的配置')
+        parser.add_argument('--path', default=budget.get('PATH', '/'), help='第一个请求的路径')
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--runs', type=int, default=3, help='跑几次取中位数')
+        parser.add_argument('--boot-budget-ms', type=float, default=budget.get('BOOT_MS', 1500))
+        parser.add_argument('--request-budget-ms', type=float, default=budget.get('FIRST_REQUEST_MS', 500))
+        parser.add_argument('--forbid', nargs='*', default=budget.get('FORBIDDEN_MODULES', []),
+                            help='启动后不应该被导入的模块')
+
+    def handle(self, *args, **options):
+        results = []
+        for _ in range(options['runs']):
+            proc = subprocess.run(
+                [sys.executable, '-c', CHILD, options['settings_module'], options['path'], options['host']],
+                capture_output=True, text=True, cwd=settings.BASE_DIR,
+            )
+            if proc.returncode != 0:
+                raise CommandError(f'子进程启动失败:\n{proc.stderr}')
+            # 视图里可能有 print，结果在最后一行
+            results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+        boot = statistics.median(r['boot_ms'] for r in results)
+        first = statistics.median(r['first_request_ms'] for r in results)
+        modules = results[-1]['modules']
+        self.stdout.write(f"{options['settings_module']}  {options['path']} -> {results[-1]['status']}")
+        self.stdout.write(f"启动 {boot:.0f}ms（预算 {options['boot_budget_ms']:.0f}ms），"
+                          f"第一个请求 {first:.0f}ms（预算 {options['request_budget_ms']:.0f}ms），"
+                          f"已导入 {len(modules)} 个模块")
+
+        problems = []
+        if boot > options['boot_budget_ms']:
+            problems.append(f'启动耗时 {boot:.0f}ms 超出预算')
+        if first > options['request_budget_ms']:
+            problems.append(f'第一个请求耗时 {first:.0f}ms 超出预算')
+        loaded = [m for m in options['forbid'] if m in modules]
+        if loaded:
+            problems.append(f"不该加载的模块被导入了: {', '.join(loaded)}")
+        if problems:
+            raise CommandError('；'.join(problems))
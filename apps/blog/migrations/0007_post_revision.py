@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0006_comment"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="revision",
+            field=models.PositiveIntegerField(default=0, verbose_name="正文版本"),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.5 on 2026-10-19 18:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0009_notification"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="post",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("draft", "草稿"),
+                    ("published", "发布"),
+                    ("deleted", "已删除"),
+                ],
+                default="published",
+                max_length=10,
+            ),
+        ),
+    ]
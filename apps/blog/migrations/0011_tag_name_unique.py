@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+
+def merge_duplicate_tags(apps, schema_editor):
+    """同名标签合并到 id 最小的那个上：文章 / 归档文章的关联改指过去，再删掉多余的"""
+    Tag = apps.get_model("blog", "Tag")
+    Post = apps.get_model("blog", "Post")
+    ArchivedPost = apps.get_model("blog", "ArchivedPost")
+    keep = {}
+    for tag_id, name in Tag.objects.order_by("id").values_list("id", "name"):
+        keep.setdefault(name, tag_id)
+        if keep[name] == tag_id:
+            continue
+        for through, owner in ((Post.tags.through, "post_id"), (ArchivedPost.tags.through, "archivedpost_id")):
+            owners = through.objects.filter(tag_id=tag_id).values_list(owner, flat=True)
+            through.objects.bulk_create([through(**{owner: pk, "tag_id": keep[name]}) for pk in owners],
+                                        ignore_conflicts=True)
+            through.objects.filter(tag_id=tag_id).delete()
+        Tag.objects.filter(pk=tag_id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0010_post_status_deleted"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_tags, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="tag",
+            name="name",
+            field=models.CharField(max_length=20, unique=True, verbose_name="标签名称"),
+        ),
+    ]
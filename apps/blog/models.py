@@ -3,7 +3,8 @@ from apps.users.models import User
 # Create your models here.
 class Tag(models.Model):
     """文章标签"""
-    name = models.CharField("标签名称", max_length=20)
+    # 唯一：批量导入按名字找标签，两个并发导入同时插同一个名字时只有一个能插进去
+    name = models.CharField("标签名称", max_length=20, unique=True)
     def __str__(self):
         return self.name
 
@@ -36,8 +37,11 @@ class Post(models.Model):
     tags = models.ManyToManyField(Tag, blank=True)
     # 状态字段 (草稿/发布)，工业级项目必备
     STATUS_CHOICES = (('draft', '草稿'), ('published', '发布'))
-    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='published')
+    # 删除是异步的：先标成 deleted 对所有人隐藏，后台任务再分批清掉（tasks.purge_post），接口不能设置这个状态
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES + (('deleted', '已删除'),), default='published')
     views = models.IntegerField(default=0)
+    # 正文版本号，每次改正文 +1，增量更新（PATCH .../body/）靠它做乐观并发控制
+    revision = models.PositiveIntegerField("正文版本", default=0)
     likes = models.ManyToManyField(User, related_name='liked_posts', blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -55,3 +59,61 @@ class Comment(models.Model):
         ordering = ['-created_at']
     def __str__(self):
         return f"{self.author.username} -> {self.post.title}"
+
+
+class ArchivedPost(models.Model):
+    """
+    归档的旧文章（见 archive.py），主键沿用原来的文章 id
+    只读：不再计浏览量、不能点赞评论，热表 Post 上的列表/COUNT 都不会扫到它
+    """
+    id = models.BigIntegerField(primary_key=True)
+    title = models.CharField("标题", max_length=100)
+    body = models.TextField("正文")
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_posts')
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name='archived_posts')
+    tags = models.ManyToManyField(Tag, blank=True, related_name='archived_posts')
+    status = models.CharField(max_length=10, choices=Post.STATUS_CHOICES, default='published')
+    views = models.IntegerField(default=0)
+    revision = models.PositiveIntegerField("正文版本", default=0)
+    likes = models.ManyToManyField(User, related_name='archived_liked_posts', blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.title
+
+
+class ArchivedComment(models.Model):
+    """归档文章的评论，跟着文章一起搬过来，主键沿用原来的评论 id"""
+    id = models.BigIntegerField(primary_key=True)
+    body = models.TextField("评论内容")
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_comments')
+    post = models.ForeignKey(ArchivedPost, on_delete=models.CASCADE, related_name='comments')
+    parent = models.ForeignKey('self', null=True, blank=True, related_name='children', on_delete=models.CASCADE)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-created_at']
+
+
+class Notification(models.Model):
+    """
+    回复通知：同一条评论下的回复合并成一条（count 是合并了几条回复）
+    实时数据在 Redis 收件箱里，这张表是定期批量落的库（见 notifications.py）
+    """
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    # 被回复的那条评论（收件人自己的）
+    parent = models.ForeignKey(Comment, on_delete=models.CASCADE, related_name='+')
+    last_comment_id = models.BigIntegerField("最新一条回复")
+    count = models.PositiveIntegerField(default=0)
+    # 最近回复的几个人：[{"id": 1, "username": "u1"}]
+    actors = models.JSONField(default=list)
+    is_read = models.BooleanField(default=False)
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('recipient', 'parent')
+        indexes = [models.Index(fields=['recipient', '-updated_at'])]
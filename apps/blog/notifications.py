@@ -0,0 +1,273 @@
+"""
+回复通知收件箱
+
+有人回复了我的评论就通知我。发评论的请求里只做一次 Redis 脚本调用，落库攒一批再做：
+    user:{uid}:inbox          ZSET  会话（被回复的评论 id）→ 最新回复时间，只留最近 INBOX_SIZE 个
+    user:{uid}:inbox:items    HASH  会话 → {"thread", "post", "comment", "count", "actors", "at"}，
+                                    '_' 字段标记已经从数据库加载过
+    user:{uid}:inbox:unread   SET   未读的会话，SCARD 就是未读数，O(1)
+    notify:dirty              SET   收件箱变了、还没落库的用户
+同一条评论下连续来的回复合并成一条（count 累加，actors 留最近几个人）。
+用户第一次变脏时排一个 FLUSH_DELAY 秒后执行的 flush_notifications 任务，
+把这段时间里所有变脏的收件箱一次 upsert 到 Notification 表。
+收件箱过期或被清掉时，下次读或落库之前先从表里加载最近的 INBOX_SIZE 条
+（和加载之前新来的回复合并）；更早的通知翻页时直接查表。
+"""
+import json
+import logging
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from utils.jobs import job
+from utils.redis_pool import redis, register_script
+from .models import Comment, Notification
+
+logger = logging.getLogger(__name__)
+
+INBOX_SIZE = 200
+INBOX_TTL = 86400 * 30
+MAX_ACTORS = 3
+FLUSH_BATCH = 500
+FLUSH_DELAY = getattr(settings, 'NOTIFICATION_FLUSH_DELAY', 5)
+FLUSH_RETRY_DELAY = 30
+DIRTY_KEY = 'notify:dirty'
+BUILT_FIELD = '_'
+
+# 合并一条回复进收件箱，返回 1 表示这个用户刚变脏（需要排一次落库任务）
+_PUSH = register_script("""
+local raw = redis.call('HGET', KEYS[2], ARGV[1])
+local item
+if raw then
+    item = cjson.decode(raw)
+else
+    item = {thread = tonumber(ARGV[1]), post = tonumber(ARGV[2]), count = 0, actors = {}}
+end
+item.count = item.count + 1
+item.comment = tonumber(ARGV[3])
+item.at = tonumber(ARGV[6])
+local actors = {{id = tonumber(ARGV[4]), username = ARGV[5]}}
+for _, actor in ipairs(item.actors) do
+    if actor.id ~= actors[1].id and #actors < tonumber(ARGV[9]) then
+        table.insert(actors, actor)
+    end
+end
+item.actors = actors
+redis.call('HSET', KEYS[2], ARGV[1], cjson.encode(item))
+redis.call('ZADD', KEYS[1], ARGV[6], ARGV[1])
+redis.call('SADD', KEYS[3], ARGV[1])
+local old = redis.call('ZRANGE', KEYS[1], 0, -tonumber(ARGV[8]) - 1)
+if #old > 0 then
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, #old - 1)
+    redis.call('HDEL', KEYS[2], unpack(old))
+    redis.call('SREM', KEYS[3], unpack(old))
+end
+for i = 1, 3 do
+    redis.call('EXPIRE', KEYS[i], ARGV[10])
+end
+return redis.call('SADD', KEYS[4], ARGV[7])
+""")
+
+# 一页通知：ZREVRANGEBYSCORE + 每条的内容和已读状态 + 未读数，一次往返
+_PAGE = register_script("""
+local ids = redis.call('ZREVRANGEBYSCORE', KEYS[1], ARGV[1], '-inf', 'LIMIT', 0, tonumber(ARGV[2]))
+local rows = {}
+for _, id in ipairs(ids) do
+    table.insert(rows, redis.call('HGET', KEYS[2], id) or false)
+    table.insert(rows, redis.call('SISMEMBER', KEYS[3], id))
+end
+return {redis.call('HEXISTS', KEYS[2], ARGV[3]), redis.call('SCARD', KEYS[3]), redis.call('ZCARD', KEYS[1]), rows}
+""")
+
+# 从数据库加载：Redis 里已经有的会话是加载之前新来的回复，计数加上库里的，其余字段以 Redis 为准
+_LOAD = register_script("""
+for i = 1, #ARGV - 2, 3 do
+    local thread, raw, unread = ARGV[i], ARGV[i + 1], ARGV[i + 2]
+    local item = cjson.decode(raw)
+    local current = redis.call('HGET', KEYS[2], thread)
+    if current then
+        local merged = cjson.decode(current)
+        merged.count = merged.count + item.count
+        redis.call('HSET', KEYS[2], thread, cjson.encode(merged))
+    else
+        redis.call('HSET', KEYS[2], thread, raw)
+        redis.call('ZADD', KEYS[1], item.at, thread)
+        if unread == '1' then
+            redis.call('SADD', KEYS[3], thread)
+        end
+    end
+end
+redis.call('HSET', KEYS[2], ARGV[#ARGV - 1], 1)
+for i = 1, 3 do
+    redis.call('EXPIRE', KEYS[i], ARGV[#ARGV])
+end
+return 1
+""")
+
+
+def inbox_key(user_id):
+    return f"user:{user_id}:inbox"
+
+
+def items_key(user_id):
+    return f"user:{user_id}:inbox:items"
+
+
+def unread_key(user_id):
+    return f"user:{user_id}:inbox:unread"
+
+
+def _keys(user_id):
+    return [inbox_key(user_id), items_key(user_id), unread_key(user_id)]
+
+
+def now():
+    # 精确到毫秒：cjson 只保留 14 位有效数字，游标要和 ZSET 里的分数完全一致
+    return round(time.time(), 3)
+
+
+def notify_reply(comment, actor):
+    """评论提交以后调用：有 parent 且不是自己回复自己时，通知 parent 的作者"""
+    parent = comment.parent
+    if parent is None or parent.author_id == actor.id:
+        return
+    recipient = parent.author_id
+    newly_dirty = _PUSH(keys=[*_keys(recipient), DIRTY_KEY],
+                        args=[parent.pk, comment.post_id, comment.pk, actor.id, actor.username, now(),
+                              recipient, INBOX_SIZE, MAX_ACTORS, INBOX_TTL])
+    if newly_dirty:
+        # 同样参数的任务到期前只排一次：一个窗口里所有用户的通知一起落库
+        flush_notifications.delay_for(FLUSH_DELAY)
+
+
+def _row_item(row):
+    return {'thread': row.parent_id, 'post': row.post_id, 'comment': row.last_comment_id, 'count': row.count,
+            'actors': row.actors, 'at': row.updated_at.timestamp()}
+
+
+def ensure_loaded(user_ids):
+    """收件箱没加载过的（过期了、第一次用）从数据库加载最近的 INBOX_SIZE 条"""
+    pipe = redis.pipeline(transaction=False)
+    for uid in user_ids:
+        pipe.hexists(items_key(uid), BUILT_FIELD)
+    for uid, built in zip(user_ids, pipe.execute()):
+        if not built:
+            _load(uid)
+
+
+def _load(user_id):
+    rows = Notification.objects.filter(recipient_id=user_id).order_by('-updated_at')[:INBOX_SIZE]
+    args = []
+    for row in rows:
+        args += [row.parent_id, json.dumps(_row_item(row)), '0' if row.is_read else '1']
+    _LOAD(keys=_keys(user_id), args=[*args, BUILT_FIELD, INBOX_TTL])
+
+
+def persist(user_ids):
+    """把这些用户的 Redis 收件箱 upsert 到 Notification 表，每 FLUSH_BATCH 行一条 upsert"""
+    if not user_ids:
+        return 0
+    ensure_loaded(user_ids)
+    pipe = redis.pipeline(transaction=False)
+    for uid in user_ids:
+        pipe.hgetall(items_key(uid))
+        pipe.smembers(unread_key(uid))
+    results = pipe.execute()
+    items = []
+    for n, uid in enumerate(user_ids):
+        raw_items, unread = results[2 * n], {int(t) for t in results[2 * n + 1]}
+        items += [(uid, json.loads(raw), int(thread) in unread)
+                  for thread, raw in raw_items.items() if thread not in (BUILT_FIELD, BUILT_FIELD.encode())]
+    # 被回复的评论已经删掉的会话不落库（外键会失败）
+    alive = set(Comment.objects.filter(pk__in={item['thread'] for _, item, _ in items})
+                .values_list('id', flat=True))
+    tz = timezone.get_current_timezone()
+    rows = [Notification(recipient_id=uid, post_id=item['post'], parent_id=item['thread'],
+                         last_comment_id=item['comment'], count=item['count'], actors=item['actors'],
+                         is_read=not unread, updated_at=datetime.fromtimestamp(item['at'], tz))
+            for uid, item, unread in items if item['thread'] in alive]
+    # MySQL 不支持指定冲突列，靠 (recipient, parent) 的唯一索引走 ON DUPLICATE KEY UPDATE；
+    # PostgreSQL / SQLite 必须写明 ON CONFLICT (recipient_id, parent_id)
+    conflict = {'unique_fields': ['recipient', 'parent']} \
+        if connection.features.supports_update_conflicts_with_target else {}
+    Notification.objects.bulk_create(
+        rows, batch_size=FLUSH_BATCH, update_conflicts=True,
+        update_fields=['last_comment_id', 'count', 'actors', 'is_read', 'updated_at'], **conflict,
+    )
+    return len(rows)
+
+
+@job
+def flush_notifications():
+    """把 notify:dirty 里的用户分批落库，直到取空"""
+    while True:
+        user_ids = [int(uid) for uid in redis.spop(DIRTY_KEY, FLUSH_BATCH) or []]
+        if not user_ids:
+            break
+        try:
+            persist(user_ids)
+        except Exception:
+            # 放回去并自己再排一次：这些用户已经在 notify:dirty 里，新回复不会再触发落库，
+            # 只靠任务重试的话重试次数用完以后他们的收件箱就再也不落库了
+            redis.sadd(DIRTY_KEY, *user_ids)
+            flush_notifications.delay_for(FLUSH_RETRY_DELAY)
+            logger.exception('通知落库失败，%s 秒后重试（%s 个用户）', FLUSH_RETRY_DELAY, len(user_ids))
+            return
+
+
+def page(user_id, before=None, size=20):
+    """
+    一页通知（按最新回复时间倒序），返回 (unread_count, items, 下一页游标)
+    before 是上一页最后一条的时间戳；Redis 里放不下的更早的通知从数据库查
+    """
+    bound = f"({before!r}" if before is not None else '+inf'
+    built, unread, total, rows = _PAGE(keys=_keys(user_id), args=[bound, size, BUILT_FIELD])
+    if not built:
+        ensure_loaded([user_id])
+        built, unread, total, rows = _PAGE(keys=_keys(user_id), args=[bound, size, BUILT_FIELD])
+    items = []
+    for raw, is_unread in zip(rows[::2], rows[1::2]):
+        if raw:
+            items.append({**json.loads(raw), 'is_read': not is_unread})
+    if len(items) < size and total >= INBOX_SIZE:
+        oldest = items[-1]['at'] if items else before
+        queryset = Notification.objects.filter(recipient_id=user_id).order_by('-updated_at')
+        if oldest is not None:
+            queryset = queryset.filter(updated_at__lt=datetime.fromtimestamp(oldest, timezone.get_current_timezone()))
+        shown = {item['thread'] for item in items}
+        items += [{**_row_item(row), 'is_read': row.is_read}
+                  for row in queryset[:size - len(items)] if row.parent_id not in shown]
+    next_cursor = items[-1]['at'] if len(items) >= size else None
+    return unread, items, next_cursor
+
+
+def mark_read(user_id, threads=None):
+    """标记已读：threads 为空表示全部；返回剩下的未读数"""
+    ensure_loaded([user_id])
+    pipe = redis.pipeline(transaction=False)
+    if threads:
+        pipe.srem(unread_key(user_id), *threads)
+    else:
+        pipe.delete(unread_key(user_id))
+    pipe.scard(unread_key(user_id))
+    remaining = pipe.execute()[-1]
+    # 表里直接改（用户主动操作，不在热路径上），Redis 放不下的更早的会话也一起标掉
+    rows = Notification.objects.filter(recipient_id=user_id, is_read=False)
+    if threads:
+        rows = rows.filter(parent_id__in=threads)
+    rows.update(is_read=True)
+    return remaining
+
+
+def unread_count(user_id):
+    pipe = redis.pipeline(transaction=False)
+    pipe.hexists(items_key(user_id), BUILT_FIELD)
+    pipe.scard(unread_key(user_id))
+    built, count = pipe.execute()
+    if built:
+        return count
+    ensure_loaded([user_id])
+    return redis.scard(unread_key(user_id))
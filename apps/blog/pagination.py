@@ -0,0 +1,43 @@
+from django.conf import settings
+from rest_framework import pagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class CommentKeysetPagination(pagination.BasePagination):
+    """
+    评论的游标分页：按 id 倒序，游标就是上一页最后一条评论的 id
+    WHERE id < ? ORDER BY id DESC LIMIT n 走主键索引，翻到第几页都一样快，
+    新评论插进来也不会让后面的页错位（PageNumber 分页会）
+    """
+    page_size = getattr(settings, 'POST_DETAIL_COMMENTS', 20)
+    max_page_size = 100
+    cursor_query_param = 'before'
+    page_size_query_param = 'page_size'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        try:
+            before = int(request.query_params.get(self.cursor_query_param, 0)) or None
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            before, size = None, self.page_size
+        size = max(1, min(size, self.max_page_size))
+        self.page, last_id = self.first_page(queryset, before=before, size=size)
+        # 相对地址：detail 里的游标会进缓存，不能带上第一个请求的 host
+        self.next = replace_query_param(request.path, self.cursor_query_param, last_id) \
+            if last_id else None
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.next, 'results': data})
+
+    @classmethod
+    def first_page(cls, queryset, before=None, size=None):
+        """取一页评论，返回 (comments, 下一页游标或 None)；多取一条用来判断有没有下一页"""
+        size = size or cls.page_size
+        if before:
+            queryset = queryset.filter(id__lt=before)
+        items = list(queryset.order_by('-id')[:size + 1])
+        if len(items) > size:
+            return items[:size], items[size - 1].id
+        return items, None
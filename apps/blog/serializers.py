@@ -1,18 +1,32 @@
+from django.urls import reverse
 from rest_framework import serializers
+from rest_framework.utils.urls import replace_query_param
+from apps.users.avatars import variant_urls
 from apps.users.models import User
-from .models import Post, Category, Tag, Comment
+from .models import Post, Category, Tag, Comment, ArchivedPost, ArchivedComment
+from .pagination import CommentKeysetPagination
 
 
 # 1. 简单的用户序列化器 (用于嵌套显示作者信息，防泄露密码)
 class AuthorSerializer(serializers.ModelSerializer):
+    # 头像缩略图：{'32': {'webp': url, 'jpeg': url}, '64': ..., '128': ...}
+    avatar_thumbs = serializers.SerializerMethodField()
+
     class Meta:
         model = User
-        fields = ['id', 'username', 'avatar', 'bio']
+        fields = ['id', 'username', 'avatar', 'avatar_thumbs', 'bio']
+
+    def get_avatar_thumbs(self, obj):
+        return variant_urls(obj.avatar_hash)
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tag
         fields = '__all__'
 
+def make_summary(body):
+    return body[:50] + '...' if len(body) > 50 else body
+
+
 # 2. 分类序列化器
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -28,6 +42,10 @@ class PostSerializer(serializers.ModelSerializer):
     tags_ids = serializers.PrimaryKeyRelatedField(queryset=Tag.objects.all(), many=True,
                                                   write_only=True, required=False,
                                                   source='tags')
+    category_id = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all(), write_only=True,
+                                                     required=False, allow_null=True, source='category')
+    # 只能在草稿/发布之间切换，deleted 由删除接口设置
+    status = serializers.ChoiceField(choices=Post.STATUS_CHOICES, required=False)
     is_like = serializers.SerializerMethodField()
     like_count = serializers.SerializerMethodField()
     # 动态字段：比如前端只想显示摘要
@@ -35,20 +53,86 @@ class PostSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Post
-        fields = ['like_count','is_like', 'id','title', 'summary', 'body', 'author', 'tags','tags_ids', 'category', 'status', 'created_at','views']
-        read_only_fields = ['id','author', 'created_at','views','is_like','like_count']  # 作者由后端自动指定，不允许前端传
+        fields = ['like_count','is_like', 'id','title', 'summary', 'body', 'author', 'tags','tags_ids', 'category', 'category_id', 'status', 'created_at','views', 'revision']
+        read_only_fields = ['id','author', 'created_at','views','is_like','like_count', 'revision']  # 作者由后端自动指定，不允许前端传
+
+    def update(self, instance, validated_data):
+        """
+        只保存这次传了的字段：整行 save 会把并发提交的正文增量更新（body / revision）
+        用内存里的旧值盖回去；revision 之类传进来的 F() 表达式保存后从库里读回真实值
+        """
+        tags = validated_data.pop('tags', None)
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        fields = [*validated_data, 'updated_at']
+        instance.save(update_fields=fields)
+        expressions = [f for f in fields if hasattr(getattr(instance, f), 'resolve_expression')]
+        if expressions:
+            instance.refresh_from_db(fields=expressions)
+        if tags is not None:
+            instance.tags.set(tags)
+        return instance
 
     def get_summary(self, obj):
-        return obj.body[:50] + '...' if len(obj.body) > 50 else obj.body
+        return make_summary(obj.body)
     def get_is_like(self, obj):
+        # 调用方已经批量查好了点赞状态就直接用，避免每行一次查询
+        liked_ids = self.context.get('liked_ids')
+        if liked_ids is not None:
+            return obj.id in liked_ids
         request = self.context.get('request')
         if not request or not request.user.is_authenticated:
             return False
         return obj.likes.filter(id=request.user.id).exists()
     def get_like_count(self, obj):
+        # 批量接口会先 annotate 好 like_total，省掉每行一次 COUNT
+        if hasattr(obj, 'like_total'):
+            return obj.like_total
         return obj.likes.count()
 
 
+# 导出文件里的评论：id / parent_id 是导出时的 id，只用来在同一篇文章内还原回复关系
+class CommentImportSerializer(serializers.Serializer):
+    id = serializers.IntegerField(required=False)
+    body = serializers.CharField()
+    author_id = serializers.IntegerField()
+    parent_id = serializers.IntegerField(required=False, allow_null=True)
+    created_at = serializers.DateTimeField(required=False)
+
+
+# 批量导入用的轻量校验：不走 PrimaryKeyRelatedField，避免每行都查一次库
+class PostImportSerializer(serializers.Serializer):
+    title = serializers.CharField(max_length=100)
+    body = serializers.CharField()
+    status = serializers.ChoiceField(choices=Post.STATUS_CHOICES, default='published')
+    category_id = serializers.IntegerField(required=False, allow_null=True)
+    tags = serializers.ListField(child=serializers.CharField(max_length=20), required=False)
+    created_at = serializers.DateTimeField(required=False)
+    comments = CommentImportSerializer(many=True, required=False)
+
+    def validate_comments(self, comments):
+        ids = [c['id'] for c in comments if 'id' in c]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError("评论 id 重复")
+        for c in comments:
+            parent = c.get('parent_id')
+            if parent is not None and parent not in ids:
+                raise serializers.ValidationError(f"回复的评论 {parent} 不在这篇文章的 comments 里")
+        return comments
+
+
+class BodyOpSerializer(serializers.Serializer):
+    pos = serializers.IntegerField(min_value=0)
+    delete = serializers.IntegerField(min_value=0, default=0)
+    insert = serializers.CharField(allow_blank=True, trim_whitespace=False, default='')
+
+
+# 正文增量更新：基于 revision 的一串编辑操作，见 delta.py
+class BodyPatchSerializer(serializers.Serializer):
+    revision = serializers.IntegerField(min_value=0)
+    ops = BodyOpSerializer(many=True, allow_empty=False)
+
+
 class CommentSerializer(serializers.ModelSerializer):
     author = AuthorSerializer(read_only=True)
     reply_to = serializers.SerializerMethodField()
@@ -64,6 +148,8 @@ class CommentSerializer(serializers.ModelSerializer):
 
         if parent and parent.post !=post:
             return serializers.ValidationError("数据逻辑错误,不能跨文章回复评论")
+        if post and post.status == 'deleted':
+            raise serializers.ValidationError("文章已删除")
 
         return attrs
     def get_reply_to(self, obj):
@@ -81,8 +167,53 @@ class CommentSerializer(serializers.ModelSerializer):
         return obj.likes.count()
 
 
-class PostDetailSerializer(PostSerializer):
-    comments = CommentSerializer(many=True, read_only=True)
+def comment_page_data(post_pk, context, model=Comment):
+    """文章详情里的第一页评论：评论列表 + 总数 + 下一页链接；归档文章传 model=ArchivedComment"""
+    queryset = model.objects.filter(post_id=post_pk).select_related('author', 'parent__author')
+    comments, last_id = CommentKeysetPagination.first_page(queryset)
+    next_url = None
+    if last_id:
+        url = reverse('对文章的操作-comments', args=[post_pk])
+        next_url = replace_query_param(url, CommentKeysetPagination.cursor_query_param, last_id)
+    return {
+        'comments': CommentSerializer(comments, many=True, context=context).data,
+        'comment_count': queryset.count(),
+        'comments_next': next_url,
+    }
+
+
+class ArchivedPostSerializer(serializers.ModelSerializer):
+    """归档文章的详情（只读），字段和文章详情（PostViewSet.detail_payload）对齐，另加 archived / archived_at"""
+    author = AuthorSerializer(read_only=True)
+    category = CategorySerializer(read_only=True)
+    tags = TagSerializer(many=True, read_only=True)
+    is_like = serializers.SerializerMethodField()
+    like_count = serializers.SerializerMethodField()
+    summary = serializers.SerializerMethodField()
+    archived = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ArchivedPost
+        fields = ['like_count', 'is_like', 'id', 'title', 'summary', 'body', 'author', 'tags', 'category',
+                  'status', 'created_at', 'views', 'revision', 'archived', 'archived_at']
+        read_only_fields = fields
+
+    def get_summary(self, obj):
+        return make_summary(obj.body)
+
+    def get_is_like(self, obj):
+        request = self.context.get('request')
+        if not request or not request.user.is_authenticated:
+            return False
+        return obj.likes.filter(id=request.user.id).exists()
+
+    def get_like_count(self, obj):
+        return obj.likes.count()
+
+    def get_archived(self, obj):
+        return True
 
-    class Meta(PostSerializer.Meta):
-        fields = PostSerializer.Meta.fields + ['comments']
\ No newline at end of file
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data.update(comment_page_data(instance.pk, self.context, model=ArchivedComment))
+        return data
@@ -0,0 +1,154 @@
+"""
+分类 / 标签统计：已发布文章数 + 最新一篇的发布时间
+
+不在请求里做 COUNT ... GROUP BY，而是在文章增删改时增量维护两个 Redis hash：
+    stats:{kind}:count     {id: 文章数}，另有一个 '_' 字段标记已经建好
+    stats:{kind}:latest    {id: 最新文章的 created_at 时间戳}
+kind 是 category / tag。hash 很小，Redis 用紧凑编码存。
+Redis 里没有（首次启动、被清掉）时按数据库重建一次；计数漂移了用
+`python manage.py rebuild_stats` 纠正。
+"""
+from datetime import datetime
+
+from django.db.models import Count, Max
+from django.utils import timezone
+from rest_framework.fields import DateTimeField
+
+from utils.redis_pool import redis, register_script
+from .models import Post
+
+KINDS = ('category', 'tag')
+BUILT_FIELD = '_'
+
+# 对一批 id 加减计数；新增时顺便推高 latest。
+# 没建好的 hash 不动（下次读的时候整体重建），返回 latest 正好是被删文章、需要回源重算的 id
+_APPLY = register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return {}
+end
+local delta = tonumber(ARGV[1])
+local ts = ARGV[2]
+local stale = {}
+for i = 3, #ARGV do
+    local id = ARGV[i]
+    local count = redis.call('HINCRBY', KEYS[1], id, delta)
+    local latest = redis.call('HGET', KEYS[2], id)
+    if count <= 0 then
+        redis.call('HDEL', KEYS[1], id)
+        redis.call('HDEL', KEYS[2], id)
+    elseif delta > 0 then
+        if not latest or tonumber(latest) < tonumber(ts) then
+            redis.call('HSET', KEYS[2], id, ts)
+        end
+    elseif latest == ts then
+        table.insert(stale, id)
+    end
+end
+return stale
+""")
+
+
+def count_key(kind):
+    return f"stats:{kind}:count"
+
+
+def latest_key(kind):
+    return f"stats:{kind}:latest"
+
+
+def snapshot(post):
+    """文章对统计的贡献：没发布的文章不计入，返回 None"""
+    if post.status != 'published':
+        return None
+    return {
+        'category': [post.category_id] if post.category_id else [],
+        'tag': sorted(post.tags.values_list('id', flat=True)),
+        'ts': repr(post.created_at.timestamp()),
+    }
+
+
+def apply_change(before, after):
+    """
+    before / after 是 snapshot() 的结果（新建时 before 为 None，删除时 after 为 None）
+    只对发生变化的分类/标签加减
+    """
+    for kind in KINDS:
+        old = set(before[kind]) if before else set()
+        new = set(after[kind]) if after else set()
+        old_only, new_only = old - new, new - old
+        stale = []
+        if old_only:
+            stale = _APPLY(keys=[count_key(kind), latest_key(kind)],
+                           args=[-1, before['ts'], *old_only])
+        if new_only:
+            _APPLY(keys=[count_key(kind), latest_key(kind)], args=[1, after['ts'], *new_only])
+        for pk in stale:
+            _refresh_latest(kind, int(pk))
+
+
+def _published(kind, pk):
+    if kind == 'category':
+        return Post.objects.filter(status='published', category_id=pk)
+    return Post.objects.filter(status='published', tags__id=pk)
+
+
+def _refresh_latest(kind, pk):
+    # 最新那篇被删了/改了，只回源查这一个分类（标签）
+    latest = _published(kind, pk).aggregate(latest=Max('created_at'))['latest']
+    if latest is None:
+        redis.hdel(latest_key(kind), pk)
+    else:
+        redis.hset(latest_key(kind), pk, repr(latest.timestamp()))
+
+
+def forget(kind, pk):
+    """分类/标签被删掉时调用"""
+    pipe = redis.pipeline()
+    pipe.hdel(count_key(kind), pk)
+    pipe.hdel(latest_key(kind), pk)
+    pipe.execute()
+
+
+def rebuild(kind):
+    """按数据库重算一种统计；先写临时 key 再 RENAME，读的人看不到一半的数据"""
+    field = 'category' if kind == 'category' else 'tags'
+    rows = Post.objects.filter(status='published', **{f'{field}__isnull': False}) \
+        .values(field).annotate(count=Count('id', distinct=True), latest=Max('created_at')).order_by()
+    counts = {BUILT_FIELD: 1}
+    latest = {}
+    for row in rows:
+        counts[row[field]] = row['count']
+        latest[row[field]] = repr(row['latest'].timestamp())
+
+    pipe = redis.pipeline()
+    pipe.delete(f"{count_key(kind)}:tmp", f"{latest_key(kind)}:tmp")
+    pipe.hset(f"{count_key(kind)}:tmp", mapping=counts)
+    if latest:
+        pipe.hset(f"{latest_key(kind)}:tmp", mapping=latest)
+        pipe.rename(f"{latest_key(kind)}:tmp", latest_key(kind))
+    else:
+        pipe.delete(latest_key(kind))
+    pipe.rename(f"{count_key(kind)}:tmp", count_key(kind))
+    pipe.execute()
+
+
+def attach_stats(kind, rows):
+    """给序列化好的分类/标签列表补上 post_count / latest_post_at，一次 pipeline 读完"""
+    if not rows:
+        return rows
+    ids = [row['id'] for row in rows]
+    pipe = redis.pipeline(transaction=False)
+    pipe.exists(count_key(kind))
+    pipe.hmget(count_key(kind), ids)
+    pipe.hmget(latest_key(kind), ids)
+    exists, counts, latest = pipe.execute()
+    if not exists:
+        rebuild(kind)
+        return attach_stats(kind, rows)
+
+    to_datetime = DateTimeField().to_representation
+    tz = timezone.get_current_timezone()
+    for row, count, ts in zip(rows, counts, latest):
+        row['post_count'] = int(count) if count else 0
+        row['latest_post_at'] = to_datetime(datetime.fromtimestamp(float(ts), tz)) if ts else None
+    return rows
@@ -0,0 +1,219 @@
+"""
+压测用的合成数据：几百万用户 / 文章 / 评论 / 点赞，按真实分布生成
+
+    - 主键预先分配：从各表当前最大 id 往后排，每个分块的 id 区间事先算好，
+      多进程并行写也不会冲突，评论的 parent 直接引用本分块里的 id，不用插完再查回来
+    - 实体用 bulk_create，中间表（标签、点赞）拼多行 INSERT 直接写
+    - 密码只 make_password 一次，所有生成的用户共用这个哈希（PBKDF2 一次就要几百毫秒）
+    - 每个分块用 (seed, 分块号) 建自己的随机数发生器，同一个 seed 不管开几个进程结果都一样
+    - 文章的评论数、点赞数、浏览量都是长尾分布；一半左右的评论是回复，越新的评论越容易被回复
+
+生成过程中不碰 Redis，跑完以后按需重建统计 / 自动补全（generate_dataset 命令负责）。
+"""
+import multiprocessing
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from apps.users.models import User
+from .models import Post, Comment, Tag, Category
+
+CHUNK_SIZE = 5000       # 每个分块（一个事务）多少个用户 / 文章
+INSERT_BATCH = 1000     # 多行 INSERT 每条语句多少行
+REPLY_RATE = 0.5        # 评论里回复所占比例
+PASSWORD = 'pass12345'  # 生成的用户都用这个密码登录
+
+WORDS = ('django redis mysql python cache index query shard stream worker queue token '
+         'latency throughput profile deploy docker nginx async feed like comment tag '
+         'benchmark memory cpu thread process pool batch lock replica backup').split()
+
+
+def _next_id(model):
+    return (model.objects.aggregate(m=Max('id'))['m'] or 0) + 1
+
+
+def _split(total, parts):
+    """把 total 按份数切开，前面的份多 1"""
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)] if parts else []
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def _long_tail(rng, n, alpha=1.2):
+    """n 个权重，少数很大、大部分很小"""
+    return [rng.paretovariate(alpha) for _ in range(n)]
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """bulk_create 会用 auto_now / auto_now_add 覆盖掉手工指定的时间，生成期间临时关掉"""
+    fields = [f for model in models for f in model._meta.concrete_fields
+              if getattr(f, 'auto_now', False) or getattr(f, 'auto_now_add', False)]
+    saved = [(f, f.auto_now, f.auto_now_add) for f in fields]
+    for f in fields:
+        f.auto_now = f.auto_now_add = False
+    try:
+        yield
+    finally:
+        for f, auto_now, auto_now_add in saved:
+            f.auto_now, f.auto_now_add = auto_now, auto_now_add
+
+
+def insert_rows(table, columns, rows):
+    """多行 INSERT：一条语句写 INSERT_BATCH 行，比 bulk_create 少掉建模型对象的开销"""
+    if not rows:
+        return
+    qn = connection.ops.quote_name
+    head = f"INSERT INTO {qn(table)} ({', '.join(map(qn, columns))}) VALUES "
+    row_sql = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), INSERT_BATCH):
+            chunk = rows[start:start + INSERT_BATCH]
+            cursor.execute(head + ', '.join([row_sql] * len(chunk)), [v for row in chunk for v in row])
+
+
+def _user_chunk(task):
+    seed, index, first_id, count, password, joined = task
+    rng = random.Random(f"{seed}:users:{index}")
+    users = [User(id=pk, username=f"load{pk}", password=password, email=f"load{pk}@example.com",
+                  bio=_text(rng, rng.randint(0, 12)) or None,
+                  date_joined=joined - timedelta(seconds=rng.randint(0, 86400 * 365)))
+             for pk in range(first_id, first_id + count)]
+    with transaction.atomic():
+        User.objects.bulk_create(users, batch_size=INSERT_BATCH)
+    return {'users': count}
+
+
+def _post_chunk(task):
+    """一个分块的文章 + 标签 + 评论 + 点赞，一个事务"""
+    (seed, index, first_post, n_posts, first_comment, n_comments, n_likes,
+     user_ids, tag_ids, category_ids, now, days) = task
+    rng = random.Random(f"{seed}:posts:{index}")
+    span = 86400 * days
+
+    posts = []
+    for pk in range(first_post, first_post + n_posts):
+        created = now - timedelta(seconds=rng.randint(0, span))
+        posts.append(Post(
+            id=pk, title=_text(rng, rng.randint(2, 8)).title()[:100], body=_text(rng, rng.randint(30, 400)),
+            author_id=rng.choice(user_ids),
+            category_id=rng.choice(category_ids) if category_ids and rng.random() < 0.9 else None,
+            status='published' if rng.random() < 0.95 else 'draft',
+            views=int(rng.paretovariate(1.1) * 10), created_at=created, updated_at=created,
+        ))
+    post_tags = [(post.pk, tag) for post in posts
+                 for tag in rng.sample(tag_ids, min(len(tag_ids), rng.randint(0, 3)))]
+
+    # 评论：按长尾权重分给各篇文章，同一篇里按时间顺序生成回复树
+    per_post = {}
+    for post in rng.choices(posts, weights=_long_tail(rng, len(posts)), k=n_comments) if posts else []:
+        per_post[post.pk] = per_post.get(post.pk, 0) + 1
+    comments = []
+    next_id = first_comment
+    for post in posts:
+        thread = []
+        at = post.created_at
+        for i in range(per_post.get(post.pk, 0)):
+            at = min(at + timedelta(seconds=rng.randint(1, 86400)), now)
+            parent = None
+            if thread and rng.random() < REPLY_RATE:
+                parent = thread[-1 - min(int(rng.expovariate(0.3)), len(thread) - 1)]
+            thread.append(next_id)
+            comments.append(Comment(id=next_id, body=_text(rng, rng.randint(3, 40)), post_id=post.pk,
+                                    author_id=rng.choice(user_ids), parent_id=parent, created_at=at))
+            next_id += 1
+
+    # 点赞：同样长尾，同一篇文章不会重复点赞
+    likes = []
+    weights = _long_tail(rng, len(posts), alpha=1.0)
+    total = sum(weights) or 1
+    for post, weight in zip(posts, weights):
+        k = min(len(user_ids), int(round(n_likes * weight / total)))
+        likes += [(post.pk, uid) for uid in rng.sample(user_ids, k)]
+
+    with transaction.atomic():
+        Post.objects.bulk_create(posts, batch_size=INSERT_BATCH)
+        # 先插的评论 id 小，父评论总在回复之前
+        Comment.objects.bulk_create(comments, batch_size=INSERT_BATCH)
+        insert_rows(Post.tags.through._meta.db_table, ['post_id', 'tag_id'], post_tags)
+        insert_rows(Post.likes.through._meta.db_table, ['post_id', 'user_id'], likes)
+    return {'posts': len(posts), 'comments': len(comments), 'likes': len(likes), 'post_tags': len(post_tags)}
+
+
+def _run(tasks, func, workers):
+    if workers <= 1:
+        return [func(task) for task in tasks]
+    # fork 出来的子进程不能共用父进程的数据库连接，各自重新连
+    connections.close_all()
+    with multiprocessing.get_context('fork').Pool(workers) as pool:
+        return pool.map(func, tasks, chunksize=1)
+
+
+def generate(users=1000, posts=10000, comments=50000, likes=100000, tags=200, categories=20,
+             days=730, seed=0, workers=1, report=None):
+    """
+    生成数据，返回 {'users': n, 'posts': n, ..., 'seconds': s}
+    report(phase, counts, seconds) 每个阶段结束时回调一次
+    """
+    started = time.monotonic()
+    now = timezone.now()
+    totals = {}
+
+    def phase(name, results, t0):
+        counts = {}
+        for result in results:
+            for key, value in result.items():
+                counts[key] = counts.get(key, 0) + value
+        for key, value in counts.items():
+            totals[key] = totals.get(key, 0) + value
+        if report:
+            report(name, counts, time.monotonic() - t0)
+
+    t0 = time.monotonic()
+    rng = random.Random(f"{seed}:taxonomy")
+    first_tag, first_category = _next_id(Tag), _next_id(Category)
+    Tag.objects.bulk_create([Tag(id=first_tag + i, name=f"{rng.choice(WORDS)}-{first_tag + i}"[:20])
+                             for i in range(tags)], batch_size=INSERT_BATCH)
+    Category.objects.bulk_create([Category(id=first_category + i, name=f"{rng.choice(WORDS)}-{first_category + i}")
+                                  for i in range(categories)], batch_size=INSERT_BATCH)
+    phase('taxonomy', [{'tags': tags, 'categories': categories}], t0)
+
+    t0 = time.monotonic()
+    first_user = _next_id(User)
+    password = make_password(PASSWORD)
+    sizes = _split(users, -(-users // CHUNK_SIZE))
+    starts = [first_user + sum(sizes[:i]) for i in range(len(sizes))]
+    phase('users', _run([(seed, i, start, size, password, now) for i, (start, size) in enumerate(zip(starts, sizes))],
+                        _user_chunk, workers), t0)
+
+    # 作者 / 点赞的人从生成的用户里挑；range 传给子进程只是三个整数
+    user_ids = range(first_user, first_user + users) if users else list(User.objects.values_list('id', flat=True))
+    if not user_ids:
+        raise ValueError('没有用户可以当作者：--users 不能为 0')
+    tag_ids = range(first_tag, first_tag + tags) if tags else list(Tag.objects.values_list('id', flat=True))
+    category_ids = range(first_category, first_category + categories) if categories \
+        else list(Category.objects.values_list('id', flat=True))
+
+    t0 = time.monotonic()
+    first_post, first_comment = _next_id(Post), _next_id(Comment)
+    post_sizes = _split(posts, -(-posts // CHUNK_SIZE))
+    comment_sizes = _split(comments, len(post_sizes))
+    like_sizes = _split(likes, len(post_sizes))
+    tasks = []
+    for i, size in enumerate(post_sizes):
+        tasks.append((seed, i, first_post + sum(post_sizes[:i]), size,
+                      first_comment + sum(comment_sizes[:i]), comment_sizes[i], like_sizes[i],
+                      user_ids, tag_ids, category_ids, now, days))
+    with explicit_timestamps(Post, Comment):
+        phase('posts', _run(tasks, _post_chunk, workers), t0)
+
+    totals['seconds'] = round(time.monotonic() - started, 3)
+    return totals
@@ -0,0 +1,103 @@
+"""
+blog 的后台任务：请求线程里只做 Redis 操作，落库和清理交给 worker
+
+任务都是幂等的（at-least-once 投递下可能执行不止一次）
+"""
+from utils.jobs import job
+from utils.redis_pool import redis
+from .cache import like_key
+from .models import Post, Comment, Notification
+from . import stats
+# 放在别的模块里的任务也要在这里导入，runjobs 只自动发现 tasks.py
+from .feed import fanout_post  # noqa: F401
+from .notifications import flush_notifications  # noqa: F401
+
+
+@job
+def sync_post_views(pk, views):
+    """把 Redis 里的浏览量同步回 MySQL；只会往大了改，乱序执行也不会倒退"""
+    Post.objects.filter(pk=pk, views__lt=views).update(views=views)
+
+
+@job
+def persist_like(pk, user_id, liked):
+    """点赞/取消点赞落库；以 Redis 点赞集合的最新状态为准，连点几次乱序执行也不会写反"""
+    key = like_key(pk)
+    pipe = redis.pipeline(transaction=False)
+    pipe.exists(key)
+    pipe.sismember(key, user_id)
+    exists, member = pipe.execute()
+    if exists:
+        liked = bool(member)
+    through = Post.likes.through
+    if liked:
+        if Post.objects.filter(pk=pk).exclude(status='deleted').exists():
+            through.objects.bulk_create([through(post_id=pk, user_id=user_id)], ignore_conflicts=True)
+    else:
+        through.objects.filter(post_id=pk, user_id=user_id).delete()
+
+
+PURGE_BATCH = 500
+PURGE_MAX_BATCHES = 40  # 一次任务最多删这么多批，剩下的重新入队，不长时间占着 worker
+
+
+@job
+def clear_post_keys(pk):
+    """文章删掉以后清理它在 Redis 里的所有键（post:{pk}:*）"""
+    batch = []
+    for key in redis.scan_iter(match=f"post:{pk}:*", count=1000):
+        batch.append(key)
+        if len(batch) >= PURGE_BATCH:
+            redis.delete(*batch)
+            batch = []
+    if batch:
+        redis.delete(*batch)
+
+
+def _delete_in_batches(queryset, budget):
+    """按主键每次删 PURGE_BATCH 行，每批一个短事务；返回剩下的批数，删完之前用完了返回 0"""
+    while budget > 0:
+        ids = list(queryset.order_by('id').values_list('id', flat=True)[:PURGE_BATCH])
+        if not ids:
+            break
+        queryset.model.objects.filter(id__in=ids).delete()
+        budget -= 1
+    return budget
+
+
+@job
+def purge_post(pk):
+    """
+    分批清掉已标记删除的文章：点赞、标签、通知、评论，最后是文章本身和 Redis 里的键
+    一次 DELETE 级联几千条评论会长时间锁表，这里每批只碰 PURGE_BATCH 行；
+    幂等，中途失败重跑会接着删
+    """
+    if not Post.objects.filter(pk=pk, status='deleted').exists():
+        return
+    # 回复链先断开，评论就能按任意顺序分批删，不用 Django 在内存里递归收集整棵树
+    budget = PURGE_MAX_BATCHES
+    replies = Comment.objects.filter(post_id=pk, parent__isnull=False)
+    while budget > 0:
+        ids = list(replies.order_by('id').values_list('id', flat=True)[:PURGE_BATCH])
+        if not ids:
+            break
+        Comment.objects.filter(id__in=ids).update(parent=None)
+        budget -= 1
+    for queryset in (Post.likes.through.objects.filter(post_id=pk),
+                     Post.tags.through.objects.filter(post_id=pk),
+                     Notification.objects.filter(post_id=pk),
+                     Comment.objects.filter(post_id=pk)):
+        budget = _delete_in_batches(queryset, budget)
+    if budget <= 0:
+        # 还没删完，排到队尾接着删
+        purge_post.delay(pk)
+        return
+    Post.objects.filter(pk=pk).delete()
+    clear_post_keys(pk)
+
+
+@job
+def rebuild_post_stats():
+    """批量导入等场景下整体重算分类/标签统计"""
+    for kind in stats.KINDS:
+        stats.rebuild(kind)
@@ -1,8 +1,22 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.management import call_command, CommandError
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from rest_framework.test import APITransactionTestCase
 from rest_framework import status
 
+from apps.blog.models import Post, Comment, Category, Tag, ArchivedPost, ArchivedComment
+from utils.jobs import Worker
+from utils.profiling import make_token
+from utils.redis_pool import redis
+
 User = get_user_model()
 
 
@@ -16,6 +30,9 @@ class TestJustDRFAPI(APITransactionTestCase):
     """
 
     def setUp(self):
+        # 限流计数存在 Redis 里，跨用例/跨次运行会累积，每个用例开始前清掉
+        for key in redis.scan_iter("throttle:*"):
+            redis.delete(key)
         # 创建两个用户：作者 & 非作者
         self.user1 = User.objects.create_user(username="u1", password="pass12345")
         self.user2 = User.objects.create_user(username="u2", password="pass12345")
@@ -112,6 +129,15 @@ class TestJustDRFAPI(APITransactionTestCase):
         self.assertEqual(unlike_resp.status_code, status.HTTP_200_OK, unlike_resp.data)
         self.assertEqual(unlike_resp.data["like_count"], 0)
 
+        # 详情的正文片段已经缓存了，点赞数照样是最新的（不随片段冻住）
+        self.assertEqual(self.client.get(f"/api/articles/{post_id}/").data["like_count"], 0)
+        self.client.post(f"/api/articles/{post_id}/like/", format="json")
+        detail = self.client.get(f"/api/articles/{post_id}/").data
+        self.assertEqual((detail["like_count"], detail["is_like"]), (1, True))
+        resp = self.client.get(f"/api/articles/{post_id}/?mode=static")
+        self.assertEqual(resp["X-Post-Like-Count"], "1")
+        self.assertNotIn("like_count", json.loads(resp.content))
+
     def test_04_permission_non_author_cannot_update_or_delete(self):
         # u1 创建文章
         self.login("u1", "pass12345")
@@ -139,4 +165,910 @@ class TestJustDRFAPI(APITransactionTestCase):
         del_resp = self.client.delete(f"/api/articles/{post_id}/")
         self.assertEqual(del_resp.status_code, status.HTTP_403_FORBIDDEN)
 
+
+    def test_05_unique_visitors(self):
+        self.login("u1", "pass12345")
+        create_resp = self.client.post(
+            "/api/articles/",
+            {"title": "uv test", "body": "body", "status": "published"},
+            format="json",
+        )
+        post_id = create_resp.data["id"]
+
+        # 同一个用户刷新两次：views 涨 2，独立访客仍是 1
+        first = self.client.get(f"/api/articles/{post_id}/")
+        second = self.client.get(f"/api/articles/{post_id}/")
+        self.assertEqual(second.data["views"], first.data["views"] + 1)
+        self.assertEqual(second.data["unique_visitors"], first.data["unique_visitors"])
+
+        # 换成 u2 再看一次，独立访客 +1
+        self.logout()
+        self.login("u2", "pass12345")
+        third = self.client.get(f"/api/articles/{post_id}/")
+        self.assertEqual(third.data["unique_visitors"], second.data["unique_visitors"] + 1)
+
+        uv_resp = self.client.get(f"/api/articles/{post_id}/uv/?days=7")
+        self.assertEqual(uv_resp.status_code, status.HTTP_200_OK, uv_resp.data)
+        self.assertEqual(uv_resp.data["unique_visitors"], third.data["unique_visitors"])
+        self.assertEqual(len(uv_resp.data["daily"]), 7)
+
+        # 匿名用户换着填 X-Forwarded-For 也只算一个访客
+        self.logout()
+        counts = [
+            self.client.get(f"/api/articles/{post_id}/", HTTP_X_FORWARDED_FOR=f"10.0.0.{i}").data["unique_visitors"]
+            for i in range(3)
+        ]
+        self.assertEqual(counts, [third.data["unique_visitors"] + 1] * 3)
+
+        # 看不到的草稿直接 404，不计访客、不加浏览量
+        from apps.blog.visitors import unique_visitors
+        draft = Post.objects.create(title="d", body="b", author=self.user2, status="draft")
+        resp = self.client.get(f"/api/articles/{draft.id}/")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(unique_visitors(draft.id, 1)[0], 0)
+        self.assertFalse(redis.exists(f"post:{draft.id}:view_count"))
+
+    def test_06_bulk_import_and_export(self):
+        self.login("u1", "pass12345")
+        lines = [
+            {"title": "bulk-1", "body": "b1", "tags": ["python", "django"]},
+            {"title": "bulk-2", "body": "b2", "status": "draft", "tags": ["python"]},
+            {"body": "没有标题"},
+        ]
+        payload = "\n".join(json.dumps(line, ensure_ascii=False) for line in lines)
+        import_resp = self.client.post(
+            "/api/articles/import/", payload, content_type="application/x-ndjson"
+        )
+        self.assertEqual(import_resp.status_code, status.HTTP_201_CREATED, import_resp.data)
+        self.assertEqual(import_resp.data["created"], 2)
+        self.assertEqual([e["line"] for e in import_resp.data["errors"]], [3])
+        self.assertIn("rows_per_sec", import_resp.data)
+
+        export_resp = self.client.get("/api/articles/export/")
+        self.assertEqual(export_resp.status_code, status.HTTP_200_OK)
+        rows = [json.loads(line) for line in b"".join(export_resp.streaming_content).splitlines()]
+        self.assertEqual(rows[-1]["_summary"]["rows"], 2)
+        exported = {row["title"]: row for row in rows[:-1]}
+        self.assertEqual(sorted(exported["bulk-1"]["tags"]), ["django", "python"])
+        self.assertEqual(exported["bulk-2"]["status"], "draft")
+
+        # 匿名用户导出看不到草稿
+        self.logout()
+        export_resp = self.client.get("/api/articles/export/")
+        rows = [json.loads(line) for line in b"".join(export_resp.streaming_content).splitlines()]
+        self.assertEqual(rows[-1]["_summary"]["rows"], 1)
+
+        # 导出再导入：评论（含回复关系）和原始时间都保留，标签不会重复建
+        post = Post.objects.get(title="bulk-1")
+        root = Comment.objects.create(post=post, author=self.user2, body="root")
+        Comment.objects.create(post=post, author=self.user1, body="reply", parent=root)
+        Post.objects.filter(pk=post.pk).update(created_at="2020-01-01T00:00:00Z")
+        self.login("u1", "pass12345")
+        export_resp = self.client.get("/api/articles/export/")
+        payload = b"".join(export_resp.streaming_content)
+        import_resp = self.client.post(
+            "/api/articles/import/", payload, content_type="application/x-ndjson"
+        )
+        self.assertEqual(import_resp.data["created"], 2, import_resp.data)
+        copy = Post.objects.filter(title="bulk-1").exclude(pk=post.pk).get()
+        self.assertEqual(copy.created_at.year, 2020)
+        self.assertEqual(Tag.objects.filter(name="python").count(), 1)
+        reply = copy.comments.get(body="reply")
+        self.assertEqual((reply.author_id, reply.parent.body, reply.parent.post_id), (self.user1.id, "root", copy.id))
+
+    def test_07_detail_comments_are_paginated(self):
+        self.login("u1", "pass12345")
+        create_resp = self.client.post(
+            "/api/articles/",
+            {"title": "many comments", "body": "body", "status": "published"},
+            format="json",
+        )
+        post = Post.objects.get(pk=create_resp.data["id"])
+        Comment.objects.bulk_create(
+            [Comment(post=post, author=self.user2, body=f"c{i}") for i in range(25)]
+        )
+
+        detail = self.client.get(f"/api/articles/{post.id}/").data
+        self.assertEqual(len(detail["comments"]), 20)
+        self.assertEqual(detail["comment_count"], 25)
+        self.assertIsNotNone(detail["comments_next"])
+
+        rest = self.client.get(detail["comments_next"]).data
+        self.assertEqual(len(rest["results"]), 5)
+        self.assertIsNone(rest["next"])
+        seen = {c["id"] for c in detail["comments"]} | {c["id"] for c in rest["results"]}
+        self.assertEqual(len(seen), 25)
+
+    def test_08_detail_fragments_invalidate_independently(self):
+        self.login("u1", "pass12345")
+        create_resp = self.client.post(
+            "/api/articles/",
+            {"title": "fragments", "body": "body", "status": "published"},
+            format="json",
+        )
+        post_id = create_resp.data["id"]
+        detail = self.client.get(f"/api/articles/{post_id}/").data
+        self.assertEqual(detail["comment_count"], 0)
+
+        # 新评论：评论片段刷新
+        comment_resp = self.client.post(
+            "/api/comments/", {"post": post_id, "body": "first!"}, format="json"
+        )
+        self.assertEqual(comment_resp.status_code, status.HTTP_201_CREATED, comment_resp.data)
+        detail = self.client.get(f"/api/articles/{post_id}/").data
+        self.assertEqual(detail["comment_count"], 1)
+        self.assertEqual(detail["comments"][0]["body"], "first!")
+
+        # 改标题：正文片段刷新，评论片段还在
+        self.client.patch(f"/api/articles/{post_id}/", {"title": "fragments-2"}, format="json")
+        detail = self.client.get(f"/api/articles/{post_id}/").data
+        self.assertEqual(detail["title"], "fragments-2")
+        self.assertEqual(detail["comment_count"], 1)
+
+        # 改个人简介：作者卡片刷新
+        self.client.patch("/api/users/me/", {"bio": "new bio"}, format="json")
+        detail = self.client.get(f"/api/articles/{post_id}/").data
+        self.assertEqual(detail["author"]["bio"], "new bio")
+
+    def test_09_list_cache_generation_and_is_like_overlay(self):
+        self.login("u1", "pass12345")
+        first = self.client.post(
+            "/api/articles/", {"title": "g1", "body": "b", "status": "published"}, format="json"
+        ).data
+        self.client.post(f"/api/articles/{first['id']}/like/", format="json")
+
+        self.logout()
+        anon = self.client.get("/api/articles/?ordering=-created_at").data
+        self.assertFalse(any(item["is_like"] for item in anon["results"]))
+
+        # 同一份缓存，登录用户看到自己的点赞状态
+        self.login("u1", "pass12345")
+        mine = self.client.get("/api/articles/?ordering=-created_at").data
+        liked = {item["id"]: item["is_like"] for item in mine["results"]}
+        self.assertTrue(liked[first["id"]])
+
+        # 新文章让整代列表缓存失效
+        second = self.client.post(
+            "/api/articles/", {"title": "g2", "body": "b", "status": "published"}, format="json"
+        ).data
+        self.logout()
+        anon = self.client.get("/api/articles/?ordering=-created_at").data
+        self.assertIn(second["id"], [item["id"] for item in anon["results"]])
+
+    def test_10_login_is_throttled_per_username(self):
+        for _ in range(10):
+            self.client.post(
+                "/api/token/login/", {"username": "u1", "password": "wrong"}, format="json"
+            )
+        resp = self.client.post(
+            "/api/token/login/", {"username": "u1", "password": "pass12345"}, format="json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        # 别的账号不受影响
+        self.login("u2", "pass12345")
+
+    def test_11_like_is_persisted_by_job_worker(self):
+        self.login("u1", "pass12345")
+        post_id = self.client.post(
+            "/api/articles/", {"title": "jobs", "body": "b", "status": "published"}, format="json"
+        ).data["id"]
+        like_resp = self.client.post(f"/api/articles/{post_id}/like/", format="json")
+        self.assertEqual(like_resp.data["like_count"], 1)
+
+        # 请求里只改了 Redis，落库由 worker 完成
+        worker = Worker(["default"], block_ms=None)
+        worker.ensure_groups()
+        while worker.run_once():
+            pass
+        self.assertTrue(Post.objects.get(pk=post_id).likes.filter(pk=self.user1.pk).exists())
+
+        self.client.post(f"/api/articles/{post_id}/like/", format="json")
+        while worker.run_once():
+            pass
+        self.assertFalse(Post.objects.get(pk=post_id).likes.exists())
+
+    def test_12_follow_feed(self):
+        # u2 关注 u1，u1 发两篇文章，u2 的动态里按时间倒序出现
+        self.login("u2", "pass12345")
+        follow_resp = self.client.post(f"/api/users/{self.user1.id}/follow/", format="json")
+        self.assertTrue(follow_resp.data["is_following"])
+        self.assertEqual(self.client.get("/api/feed/").data["results"], [])
+        # 空时间线也留在 Redis 里（占位成员），再读不查库，发文时也会推过来
+        with self.assertNumQueries(1):  # 只有 JWT 认证查用户
+            self.assertEqual(self.client.get("/api/feed/").data["results"], [])
+
+        self.logout()
+        self.login("u1", "pass12345")
+        ids = [
+            self.client.post(
+                "/api/articles/", {"title": f"feed-{i}", "body": "b", "status": "published"},
+                format="json",
+            ).data["id"]
+            for i in range(2)
+        ]
+        worker = Worker(["default"], block_ms=None)
+        worker.ensure_groups()
+        while worker.run_once():
+            pass
+
+        self.logout()
+        self.login("u2", "pass12345")
+        # 查询数和本页条数无关：JWT 查用户 + 批量取文章（带点赞数）+ 预取标签 + 点赞集合不在 Redis 时回源一次
+        with self.assertNumQueries(4):
+            feed = self.client.get("/api/feed/").data
+        self.assertEqual([item["id"] for item in feed["results"]], ids[::-1])
+
+        # u1 变成大 V：时间线里已有的文章和读时合并的是同一批，不能重复
+        from apps.blog import feed as feed_module
+        redis.sadd(feed_module.CELEBRITIES_KEY, self.user1.id)
+        try:
+            feed = self.client.get("/api/feed/").data
+        finally:
+            redis.srem(feed_module.CELEBRITIES_KEY, self.user1.id)
+        self.assertEqual([item["id"] for item in feed["results"]], ids[::-1])
+
+        # 取关以后动态清空
+        self.client.post(f"/api/users/{self.user1.id}/follow/", format="json")
+        self.assertEqual(self.client.get("/api/feed/").data["results"], [])
+
+    def test_13_static_mode_serves_precompressed_body(self):
+        self.login("u1", "pass12345")
+        post_id = self.client.post(
+            "/api/articles/", {"title": "gz", "body": "b" * 500, "status": "published"},
+            format="json",
+        ).data["id"]
+
+        bodies = []
+        for _ in range(2):
+            resp = self.client.get(f"/api/articles/{post_id}/?mode=static", HTTP_ACCEPT_ENCODING="gzip")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp["Content-Encoding"], "gzip")
+            self.assertEqual(resp["X-Post-Is-Like"], "false")
+            bodies.append(resp.content)
+        # 第二次直接是缓存里的字节
+        self.assertEqual(bodies[0], bodies[1])
+        data = json.loads(gzip.decompress(bodies[1]))
+        self.assertEqual(data["title"], "gz")
+        self.assertNotIn("views", data)
+
+        counters = self.client.get(f"/api/articles/{post_id}/counters/").data
+        self.assertEqual(counters["views"], int(resp["X-Post-Views"]))
+
+        # 新评论后压缩缓存跟着失效
+        self.client.post("/api/comments/", {"post": post_id, "body": "hi"}, format="json")
+        resp = self.client.get(f"/api/articles/{post_id}/?mode=static", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(json.loads(gzip.decompress(resp.content))["comment_count"], 1)
+
+        # 组装期间换了版本：旧内容写到旧版本的键上，读的时候不会命中
+        from apps.blog.cache import get_encoded_detail, set_encoded_detail, bump_post
+        key, body = get_encoded_detail(post_id, "identity")
+        self.assertIsNone(body)
+        bump_post(post_id, "comments")
+        set_encoded_detail(key, "identity", {**data, "author": {"id": self.user1.pk}})
+        self.assertIsNone(get_encoded_detail(post_id, "identity")[1])
+
+        # 草稿的计数只有作者能看
+        draft_id = self.client.post("/api/articles/", {"title": "d", "body": "b", "status": "draft"},
+                                    format="json").data["id"]
+        self.assertEqual(self.client.get(f"/api/articles/{draft_id}/counters/").status_code, status.HTTP_200_OK)
+        self.login("u2", "pass12345")
+        self.assertEqual(self.client.get(f"/api/articles/{draft_id}/counters/").status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_14_frontend_shell_is_served_with_etag(self):
+        resp = self.client.get("/", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp["Cache-Control"], "no-cache")
+        resp = self.client.get("/", HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=resp["ETag"])
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        # 不存在的资源 404，也不留在进程缓存里
+        from utils import frontend
+        size = len(frontend._cache)
+        for i in range(3):
+            self.assertEqual(self.client.get(f"/assets/missing-{i}.js").status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(len(frontend._cache), size)
+        # 还没构建过：明确的 503，提示执行 build_frontend
+        empty = tempfile.mkdtemp()
+        with override_settings(FRONTEND_DIST_DIR=empty, FRONTEND_SRC_DIR=empty):
+            resp = self.client.get("/")
+            self.assertEqual(resp.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertIn("build_frontend", resp.content.decode())
+
+        # 每种编码一个 ETag；q=0 表示拒绝，不能当成接受
+        dist = tempfile.mkdtemp()
+        os.makedirs(os.path.join(dist, "assets"))
+        path = os.path.join(dist, "assets", "app.1234.js")
+        with open(path, "wb") as f:
+            f.write(b"console.log(1)")
+        with open(path + ".gz", "wb") as f:
+            f.write(gzip.compress(b"console.log(1)"))
+        with override_settings(FRONTEND_DIST_DIR=dist):
+            url = "/assets/app.1234.js"
+            plain = self.client.get(url, HTTP_ACCEPT_ENCODING="br, gzip;q=0")
+            self.assertNotIn("Content-Encoding", plain)
+            zipped = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip;q=0.5")
+            self.assertEqual(zipped["Content-Encoding"], "gzip")
+            self.assertNotEqual(plain["ETag"], zipped["ETag"])
+            # 拿 identity 的 ETag 来校验 gzip 版本不能 304
+            resp = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=plain["ETag"])
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            resp = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=zipped["ETag"])
+            self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_15_profiler_only_runs_with_signed_header(self):
+        profile_dir = tempfile.mkdtemp()
+        conf = {"ENABLED": True, "SAMPLE_RATE": 0, "DIR": profile_dir, "MAX_FILES": 2, "MAX_FOLDED_BYTES": 1}
+        with override_settings(PROFILING=conf):
+            resp = self.client.get("/api/articles/")
+            self.assertNotIn("X-Profile-File", resp)
+            resp = self.client.get("/api/articles/", HTTP_X_PROFILE="forged")
+            self.assertNotIn("X-Profile-File", resp)
+
+            resp = self.client.get("/api/articles/", HTTP_X_PROFILE=make_token())
+            self.assertTrue(resp["X-Profile-File"].startswith("GET_api_articles/"))
+            self.assertTrue(resp["X-Profile-File"].endswith(".prof"))
+            self.assertTrue(os.path.exists(os.path.join(profile_dir, resp["X-Profile-File"])))
+
+            resp = self.client.get("/api/articles/", HTTP_X_PROFILE=make_token(), HTTP_X_PROFILE_MODE="sample")
+            self.assertTrue(resp["X-Profile-File"].endswith("stacks.folded"))
+
+            # 文件数和大小有上限：.prof 只留最新的 MAX_FILES 个，stacks.folded 超限轮转
+            for _ in range(3):
+                self.client.get("/api/articles/", HTTP_X_PROFILE=make_token())
+            route_dir = os.path.join(profile_dir, os.path.dirname(resp["X-Profile-File"]))
+            with open(os.path.join(route_dir, "stacks.folded"), "a") as f:
+                f.write("a;b 1\n")  # 请求太快可能一次都没采到，先写一行
+            self.client.get("/api/articles/", HTTP_X_PROFILE=make_token(), HTTP_X_PROFILE_MODE="sample")
+            self.assertEqual(len([n for n in os.listdir(route_dir) if n.endswith(".prof")]), 2)
+            self.assertTrue(os.path.exists(os.path.join(route_dir, "stacks.folded.1")))
+
+    def test_16_category_and_tag_stats_are_incremental(self):
+        for key in redis.scan_iter("stats:*"):
+            redis.delete(key)
+        cat_a = Category.objects.create(name="a")
+        cat_b = Category.objects.create(name="b")
+        tag = Tag.objects.create(name="t")
+        self.login("u1", "pass12345")
+
+        def counts(url):
+            data = self.client.get(url).data
+            return {row["id"]: row["post_count"] for row in data["results"]}
+
+        # 第一次读按数据库建好
+        self.assertEqual(counts("/api/categories/"), {cat_a.id: 0, cat_b.id: 0})
+        post_id = self.client.post(
+            "/api/articles/",
+            {"title": "s", "body": "b", "status": "published", "category_id": cat_a.id, "tags_ids": [tag.id]},
+            format="json",
+        ).data["id"]
+        self.client.post("/api/articles/", {"title": "d", "body": "b", "status": "draft",
+                                            "category_id": cat_a.id}, format="json")
+        self.assertEqual(counts("/api/categories/"), {cat_a.id: 1, cat_b.id: 0})
+        self.assertEqual(counts("/api/tags/"), {tag.id: 1})
+        self.assertIsNotNone(self.client.get(f"/api/tags/{tag.id}/").data["latest_post_at"])
+
+        self.client.patch(f"/api/articles/{post_id}/", {"category_id": cat_b.id, "tags_ids": []}, format="json")
+        self.assertEqual(counts("/api/categories/"), {cat_a.id: 0, cat_b.id: 1})
+        self.assertEqual(counts("/api/tags/"), {tag.id: 0})
+
+        self.client.delete(f"/api/articles/{post_id}/")
+        self.assertEqual(counts("/api/categories/"), {cat_a.id: 0, cat_b.id: 0})
+        self.assertIsNone(self.client.get(f"/api/categories/{cat_b.id}/").data["latest_post_at"])
+
+        # 分类、标签只有管理员能改
+        self.assertEqual(self.client.post("/api/tags/", {"name": "x"}, format="json").status_code,
+                         status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.delete(f"/api/categories/{cat_a.id}/").status_code, status.HTTP_403_FORBIDDEN)
+        User.objects.filter(pk=self.user1.pk).update(is_staff=True)
+        self.assertEqual(self.client.post("/api/tags/", {"name": "x"}, format="json").status_code,
+                         status.HTTP_201_CREATED)
+
+    def test_17_likers_are_paged_from_redis_set(self):
+        post = Post.objects.create(title="l", body="b", author=self.user1)
+        fans = [User.objects.create_user(username=f"fan{i}", password="pass12345") for i in range(5)]
+        post.likes.add(*fans)
+        redis.delete(f"post:{post.id}:like_member")
+
+        seen, url = [], f"/api/articles/{post.id}/likers/?page_size=2"
+        while url:
+            data = self.client.get(url).data
+            self.assertEqual(data["like_count"], 5)
+            seen += [card["username"] for card in data["results"]]
+            url = data["next"]
+        self.assertEqual(sorted(set(seen)), sorted(f.username for f in fans))
+
+        # 加载期间别人已经把集合换上去、又点了赞：这次加载的结果丢掉，不覆盖
+        from unittest import mock
+        from apps.blog import cache
+        key = cache.like_key(post.id)
+        redis.delete(key)
+        redis.sadd(key, self.user1.id)
+        with mock.patch.object(cache.redis, "exists", return_value=0):
+            cache.ensure_like_set(post)
+        self.assertEqual(redis.smembers(key), {str(self.user1.id).encode()})
+        # 加载失败也不留下临时集合
+        redis.delete(key)
+        with mock.patch.object(cache.Post.likes.through.objects, "filter", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                cache.ensure_like_set(post)
+        self.assertEqual(list(redis.scan_iter(f"{key}:loading:*")), [])
+
+    def test_18_batch_detail(self):
+        a = Post.objects.create(title="a", body="b", author=self.user1)
+        b = Post.objects.create(title="b", body="b", author=self.user2)
+        draft = Post.objects.create(title="d", body="b", author=self.user2, status="draft")
+        url = f"/api/articles/batch/?ids={b.id},{a.id},{draft.id},999999"
+
+        data = self.client.get(url).data
+        self.assertEqual([item["id"] for item in data["results"]], [b.id, a.id])
+        self.assertEqual(data["missing"], [draft.id, 999999])
+        self.assertEqual(data["results"][0]["author"]["username"], "u2")
+        # 第二次正文全部命中缓存
+        with self.assertNumQueries(2):  # 回源检查草稿 + 点赞集合不在 Redis 时一条 SQL 数点赞
+            self.client.get(url)
+
+        # 作者自己能看到草稿，点赞状态一次算好
+        self.login("u2", "pass12345")
+        self.client.post(f"/api/articles/{a.id}/like/", format="json")
+        data = self.client.get(url).data
+        self.assertEqual([item["id"] for item in data["results"]], [b.id, a.id, draft.id])
+        self.assertEqual([item["is_like"] for item in data["results"]], [False, True, False])
+        # 登录用户全部回源时查询数也是固定的，不会每篇文章查一次点赞
+        from apps.blog.cache import bump_post
+        for pk in (a.id, b.id):
+            bump_post(pk, "core")
+        # JWT 查用户 + 回源取文章 + 预取标签 + 点赞集合不在 Redis 时回源查是否点赞、数点赞各一条
+        with self.assertNumQueries(5):
+            data = self.client.get(url).data
+        self.assertEqual([item["is_like"] for item in data["results"]], [False, True, False])
+        self.assertEqual([item["like_count"] for item in data["results"]], [0, 1, 0])
+
+        resp = self.client.get("/api/articles/batch/?ids=x")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_19_body_delta_update(self):
+        self.login("u1", "pass12345")
+        post_id = self.client.post(
+            "/api/articles/", {"title": "d", "body": "hello world", "status": "published"}, format="json",
+        ).data["id"]
+        self.client.get(f"/api/articles/{post_id}/")  # 把正文片段缓存起来
+        core_ver = int(redis.get(f"post:{post_id}:ver:core") or 0)
+        stale = Post.objects.get(pk=post_id)
+
+        resp = self.client.patch(f"/api/articles/{post_id}/body/", {
+            "revision": 0, "ops": [{"pos": 6, "delete": 5, "insert": "there"}, {"pos": 0, "insert": ">> "}],
+        }, format="json")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK, resp.data)
+        self.assertEqual(resp.data["revision"], 1)
+        # 换了版本号（回源到一半的旧数据只会写到旧版本上），新版本的片段已经写好，不用回源
+        self.assertEqual(int(redis.get(f"post:{post_id}:ver:core")), core_ver + 1)
+        self.assertEqual(json.loads(redis.get(f"post:{post_id}:frag:core:v{core_ver + 1}"))["revision"], 1)
+        from apps.blog.cache import set_post_fragment
+        set_post_fragment(post_id, "core", core_ver, {"body": "hello world", "revision": 0})
+        detail = self.client.get(f"/api/articles/{post_id}/").data
+        self.assertEqual(detail["body"], ">> hello there")
+        self.assertEqual(detail["revision"], 1)
+        self.assertEqual(Post.objects.get(pk=post_id).body, ">> hello there")
+
+        # 基于旧版本的保存被拒绝
+        resp = self.client.patch(f"/api/articles/{post_id}/body/", {
+            "revision": 0, "ops": [{"pos": 0, "insert": "x"}]}, format="json")
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(resp.data["revision"], 1)
+        resp = self.client.patch(f"/api/articles/{post_id}/body/", {
+            "revision": 1, "ops": [{"pos": 100, "delete": 1}]}, format="json")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # 增量更新之前读出来的对象做整篇保存：只写传了的字段，revision 在库里加一
+        from apps.blog.serializers import PostSerializer
+        serializer = PostSerializer(stale, data={"title": "t2"}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.assertEqual(Post.objects.get(pk=post_id).body, ">> hello there")
+        resp = self.client.patch(f"/api/articles/{post_id}/", {"body": "new"}, format="json")
+        self.assertEqual(resp.data["revision"], 2)
+        self.assertEqual(Post.objects.get(pk=post_id).title, "t2")
+
+        # 草稿的增量保存不让文章列表缓存换代，已发布的才换
+        draft_id = self.client.post("/api/articles/", {"title": "d2", "body": "x", "status": "draft"},
+                                    format="json").data["id"]
+        gen = int(redis.get("posts:gen") or 0)
+        self.client.patch(f"/api/articles/{draft_id}/body/", {"revision": 0, "ops": [{"pos": 0, "insert": "y"}]},
+                          format="json")
+        self.assertEqual(int(redis.get("posts:gen") or 0), gen)
+        self.client.patch(f"/api/articles/{post_id}/body/", {"revision": 2, "ops": [{"pos": 0, "insert": "y"}]},
+                          format="json")
+        self.assertEqual(int(redis.get("posts:gen")), gen + 1)
+
+    def test_20_autocomplete(self):
+        for key in redis.scan_iter("ac:*"):
+            redis.delete(key)
+        Tag.objects.create(name="Python")
+        self.login("u1", "pass12345")
+        post_id = self.client.post("/api/articles/", {"title": "Learning Python Fast", "body": "b",
+                                                      "status": "published"}, format="json").data["id"]
+        self.client.post("/api/articles/", {"title": "Python draft", "body": "b", "status": "draft"}, format="json")
+
+        # 数据库里直接建的标签要重建一次才有
+        call_command("rebuild_autocomplete", stdout=io.StringIO())
+        with self.assertNumQueries(0):
+            results = self.client.get("/api/autocomplete/?q=PYT").data["results"]
+        self.assertEqual([(r["type"], r["text"]) for r in results],
+                         [("tag", "Python"), ("post", "Learning Python Fast")])
+
+        self.client.patch(f"/api/articles/{post_id}/", {"title": "Go Basics"}, format="json")
+        self.assertEqual([r["type"] for r in self.client.get("/api/autocomplete/?q=pyt").data["results"]], ["tag"])
+        self.assertEqual(self.client.get("/api/autocomplete/?q=go b").data["results"][0]["id"], post_id)
+
+        self.client.delete(f"/api/articles/{post_id}/")
+        self.assertEqual(self.client.get("/api/autocomplete/?q=go").data["results"], [])
+
+        # 以 items 开头的词：前缀和条目表不能是同一个 key
+        resp = self.client.post("/api/articles/", {"title": "Items list", "body": "b", "status": "published"},
+                                format="json")
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.client.get("/api/autocomplete/?q=items").data["results"][0]["id"], resp.data["id"])
+
+        # 管理员改标签名，按文章数的排名不变
+        popular, quiet = Tag.objects.create(name="rust"), Tag.objects.create(name="ruby")
+        Post.objects.get(pk=resp.data["id"]).tags.add(popular)
+        call_command("rebuild_autocomplete", stdout=io.StringIO())
+        User.objects.filter(pk=self.user1.pk).update(is_staff=True)
+        self.client.patch(f"/api/tags/{popular.id}/", {"name": "rustlang"}, format="json")
+        self.assertEqual([r["id"] for r in self.client.get("/api/autocomplete/?q=ru").data["results"]],
+                         [popular.id, quiet.id])
+
+    def test_21_redis_sharding(self):
+        from django_redis import get_redis_connection
+        from utils.redis_shard import HashRing, ShardedRedis, rebalance
+
+        # 一致性哈希：分布大致均匀，加一个节点只有新节点接走一部分 key
+        keys = [f"post:{i}:" for i in range(3000)]
+        ring = HashRing(["a", "b", "c"])
+        owners = {key: ring.node_for(key) for key in keys}
+        for node in "abc":
+            self.assertGreater(list(owners.values()).count(node), 600)
+        bigger = HashRing(["a", "b", "c", "d"])
+        moved = [key for key in keys if bigger.node_for(key) != owners[key]]
+        self.assertTrue(all(bigger.node_for(key) == "d" for key in moved))
+        self.assertLess(len(moved), 1200)
+
+        # 用同一个 Redis 的几个 db 模拟几个节点；这几个 db 里可能还有别的数据，
+        # 只用单独的前缀 shardtest，也只删这个前缀的 key，不能 flushdb
+        base = settings.CACHES["default"]
+        location = base["LOCATION"].rsplit("/", 1)[0]
+        caches = {"default": base, **{alias: {**base, "LOCATION": f"{location}/{db}"}
+                                      for alias, db in (("shard-home", 4), ("shard-a", 2), ("shard-b", 3))}}
+        with override_settings(CACHES=caches):
+            home, a, b = (get_redis_connection(alias) for alias in ("shard-home", "shard-a", "shard-b"))
+
+            def cleanup():
+                for client in (home, a, b):
+                    stale = list(client.scan_iter("shardtest*"))
+                    if stale:
+                        client.delete(*stale)
+
+            cleanup()
+            self.addCleanup(cleanup)
+            # 还没分片时的 key 都在 home 上
+            for i in range(40):
+                home.set(f"shardtest:{i}:view_count", i)
+                home.sadd(f"shardtest:{i}:like_member", i)
+            home.set("shardtest-gen", 1)
+
+            sharded = ShardedRedis(home, {"a": a, "b": b}, sharded_prefixes=("shardtest",))
+            self.assertEqual(sum(rebalance(sharded).values()), 80)
+            self.assertEqual(home.keys("shardtest:*"), [])
+            self.assertTrue(a.keys("shardtest:*") and b.keys("shardtest:*"))
+            self.assertEqual(sharded.get("shardtest-gen"), b"1")
+
+            # 同一篇文章的 key 在同一个节点；跨节点的 mget / pipeline 结果顺序不变
+            self.assertIs(sharded.client_for("shardtest:7:view_count"), sharded.client_for("shardtest:7:like_member"))
+            self.assertEqual(sharded.mget([f"shardtest:{i}:view_count" for i in range(40)]),
+                             [str(i).encode() for i in range(40)])
+            pipe = sharded.pipeline(transaction=False)
+            for i in range(40):
+                pipe.sismember(f"shardtest:{i}:like_member", i)
+            self.assertEqual(pipe.execute(), [True] * 40)
+            self.assertEqual(sharded.delete(*[f"shardtest:{i}:view_count" for i in range(40)]), 40)
+
+            script = sharded.register_script("return redis.call('SCARD', KEYS[1]) + #KEYS")
+            self.assertEqual(script(keys=["shardtest:3:like_member", "shardtest:3:view_count"]), 3)
+            spread = [f"shardtest:{i}:like_member" for i in range(40)]
+            with self.assertRaises(ValueError):
+                script(keys=spread)
+
+            # 去掉节点 b：把加减之前的节点传进去，b 上的 key 全部搬到 a，一个都不丢
+            on_b = len(b.keys("shardtest:*"))
+            self.assertGreater(on_b, 0)
+            smaller = ShardedRedis(home, {"a": a}, sharded_prefixes=("shardtest",))
+            self.assertEqual(rebalance(smaller, old_nodes={"a": a, "b": b}), {("b", "a"): on_b})
+            self.assertEqual(b.keys("shardtest:*"), [])
+            pipe = smaller.pipeline(transaction=False)
+            for i in range(40):
+                pipe.sismember(f"shardtest:{i}:like_member", i)
+            self.assertEqual(pipe.execute(), [True] * 40)
+
+    def test_22_old_posts_are_archived(self):
+        from datetime import timedelta
+        from django.utils import timezone
+
+        tag = Tag.objects.create(name="old")
+        old = Post.objects.create(title="old", body="b", author=self.user1)
+        old.tags.add(tag)
+        old.likes.add(self.user2)
+        first = Comment.objects.create(body="c1", author=self.user2, post=old)
+        Comment.objects.create(body="c2", author=self.user1, post=old, parent=first)
+        fresh = Post.objects.create(title="fresh", body="b", author=self.user1)
+        Post.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=400))
+        self.client.get(f"/api/articles/{old.pk}/")  # 浏览量只在 Redis 里
+        # 点赞切换了但还没落库（persist_like 还在队列里）
+        self.login("u1", "pass12345")
+        self.client.post(f"/api/articles/{old.pk}/like/")
+        self.logout()
+
+        out = io.StringIO()
+        call_command("archive_posts", "--days", "365", "--dry-run", stdout=out)
+        self.assertIn("1 篇文章、2 条评论", out.getvalue())
+        self.assertTrue(Post.objects.filter(pk=old.pk).exists())
+        call_command("archive_posts", "--days", "365", "--batch", "1", stdout=io.StringIO())
+
+        self.assertEqual(list(Post.objects.values_list("id", flat=True)), [fresh.pk])
+        self.assertFalse(Comment.objects.exists())
+        archived = ArchivedPost.objects.get(pk=old.pk)
+        self.assertEqual(archived.views, 1)
+        self.assertEqual(list(archived.tags.all()), [tag])
+        self.assertEqual(set(archived.likes.all()), {self.user1, self.user2})
+        self.assertFalse(redis.exists(f"post:{old.pk}:like_member"))
+        self.assertEqual(ArchivedComment.objects.get(body="c2").parent_id, first.pk)
+
+        # 列表只有热表里的文章，详情和评论分页回退到归档表
+        self.assertEqual([row["id"] for row in self.client.get("/api/articles/").data["results"]], [fresh.pk])
+        data = self.client.get(f"/api/articles/{old.pk}/").data
+        self.assertTrue(data["archived"])
+        self.assertEqual((data["like_count"], data["comment_count"], data["views"]), (2, 2, 1))
+        self.assertEqual(data["comments"][0]["reply_to"], "u2")
+        resp = self.client.get(f"/api/articles/{old.pk}/comments/?page_size=1")
+        self.assertEqual(len(resp.data["results"]), 1)
+        self.assertIsNotNone(resp.data["next"])
+        self.assertEqual(self.client.get("/api/articles/999999/").status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_23_generate_dataset(self):
+        from django.db.models import F
+
+        call_command("generate_dataset", "--users", "50", "--posts", "120", "--comments", "400", "--likes", "300",
+                     "--tags", "5", "--categories", "3", "--seed", "3", stdout=io.StringIO())
+        self.assertEqual(User.objects.filter(username__startswith="load").count(), 50)
+        self.assertEqual(Post.objects.count(), 120)
+        self.assertEqual(Comment.objects.count(), 400)
+        self.assertTrue(Comment.objects.filter(parent__isnull=False).exists())
+        # 回复只会挂在同一篇文章的评论下面
+        self.assertFalse(Comment.objects.filter(parent__isnull=False).exclude(parent__post=F("post")).exists())
+        self.assertGreater(Post.likes.through.objects.count(), 0)
+        # 共用的预哈希密码能正常登录
+        self.login(User.objects.filter(username__startswith="load").first().username, "pass12345")
+
+    @override_settings(LIVE={**settings.LIVE, "WINDOW": 0.1})
+    async def test_24_live_counters_are_coalesced(self):
+        from asgiref.sync import sync_to_async
+        from apps.blog import live
+
+        post = await sync_to_async(Post.objects.create)(title="live", body="b", author=self.user1)
+        self.assertEqual((await self.async_client.get("/api/live/counters/?ids=999999")).status_code, 404)
+        # 草稿、已删除的文章订阅不到
+        for hidden in ("draft", "deleted"):
+            other = await sync_to_async(Post.objects.create)(title=hidden, body="b", author=self.user1, status=hidden)
+            await sync_to_async(redis.set)(f"post:{other.pk}:view_count", 5)
+            resp = await self.async_client.get(f"/api/live/counters/?ids={other.pk}")
+            self.assertEqual(resp.status_code, 404)
+        resp = await self.async_client.get(f"/api/live/counters/?ids={post.pk},999999")
+        self.assertEqual(resp["Content-Type"], "text/event-stream")
+        events = aiter(resp.streaming_content)
+        self.assertTrue((await anext(events)).startswith(b"retry:"))
+        first = json.loads((await anext(events)).split(b"data: ")[1])
+        self.assertEqual((first["id"], first["views"], first["like_count"]), (post.pk, 0, 0))
+
+        # 一个窗口里的多次更新只推最后的值
+        pending = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0.05)
+        for views in (1, 2, 3):
+            live.publish(post.pk, views=views)
+        live.publish(post.pk, like_count=1)
+        update = json.loads((await asyncio.wait_for(pending, 2)).split(b"data: ")[1])
+        self.assertEqual(update, {"id": post.pk, "views": 3, "like_count": 1})
+
+        # 客户端断开时 ASGI 会取消正在等待的响应，连接从订阅里退出
+        pending = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0.05)
+        pending.cancel()
+        await asyncio.gather(pending, return_exceptions=True)
+        self.assertEqual(live.get_broadcaster().listeners, {})
+
+    def test_25_reply_notifications(self):
+        from apps.blog import notifications
+        from apps.blog.models import Notification
+
+        for key in list(redis.scan_iter("user:*:inbox*")) + [notifications.DIRTY_KEY]:
+            redis.delete(key)
+        post = Post.objects.create(title="n", body="b", author=self.user1)
+        user3 = User.objects.create_user(username="u3", password="pass12345")
+        self.login("u2", "pass12345")
+        parent = self.client.post("/api/comments/", {"post": post.pk, "body": "q"}, format="json").data["id"]
+        self.client.post("/api/comments/", {"post": post.pk, "body": "self", "parent": parent}, format="json")
+        for username in ("u1", "u3", "u1"):
+            self.login(username, "pass12345")
+            self.client.post("/api/comments/", {"post": post.pk, "body": "a", "parent": parent}, format="json")
+
+        # 三条回复合并成一条，自己回复自己不算
+        self.login("u2", "pass12345")
+        data = self.client.get("/api/users/me/notifications/").data
+        self.assertEqual(data["unread_count"], 1)
+        [item] = data["results"]
+        self.assertEqual((item["thread"], item["count"], item["is_read"]), (parent, 3, False))
+        self.assertEqual([a["username"] for a in item["actors"]], ["u1", "u3"])
+        self.assertFalse(Notification.objects.exists())
+        with self.assertNumQueries(1):  # 收件箱加载过以后只有 JWT 认证查用户
+            self.assertEqual(self.client.get("/api/users/me/notifications/unread/").data["unread_count"], 1)
+
+        # 落库失败：用户放回 notify:dirty，并且自己重新排一次（不靠新回复触发）
+        from unittest import mock
+        from utils.jobs import delayed_key
+        redis.delete(delayed_key("default"))
+        with mock.patch.object(notifications, "persist", side_effect=RuntimeError), \
+                self.assertLogs("apps.blog.notifications", "ERROR"):
+            notifications.flush_notifications()
+        self.assertTrue(redis.sismember(notifications.DIRTY_KEY, self.user2.id))
+        [payload] = redis.zrange(delayed_key("default"), 0, -1)
+        self.assertEqual(json.loads(payload)["job"], notifications.flush_notifications.name)
+
+        # MySQL 不支持指定冲突列：走 ON DUPLICATE KEY，不传 unique_fields
+        from django.db import connection
+        with mock.patch.object(connection.features, "supports_update_conflicts_with_target", False), \
+                mock.patch.object(Notification.objects, "bulk_create") as bulk_create:
+            notifications.persist([self.user2.id])
+        self.assertNotIn("unique_fields", bulk_create.call_args.kwargs)
+        self.assertTrue(bulk_create.call_args.kwargs["update_conflicts"])
+
+        # 延迟任务批量落库；Redis 收件箱丢了以后从表里加载
+        notifications.flush_notifications()
+        row = Notification.objects.get(recipient=self.user2)
+        self.assertEqual((row.parent_id, row.count, row.is_read), (parent, 3, False))
+        # 只通知被回复的人，回复别人的 u3 自己没有通知
+        self.assertFalse(Notification.objects.filter(recipient=user3).exists())
+        for key in notifications._keys(self.user2.id):
+            redis.delete(key)
+        self.assertEqual(self.client.get("/api/users/me/notifications/unread/").data["unread_count"], 1)
+        self.assertEqual(self.client.get("/api/users/me/notifications/").data["results"][0]["count"], 3)
+
+        resp = self.client.post("/api/users/me/notifications/read/", {}, format="json")
+        self.assertEqual(resp.data["unread_count"], 0)
+        self.assertTrue(Notification.objects.get(recipient=self.user2).is_read)
+        self.assertTrue(self.client.get("/api/users/me/notifications/").data["results"][0]["is_read"])
+        self.login("u1", "pass12345")
+        self.assertEqual(self.client.get("/api/users/me/notifications/").data["results"], [])
+
+    def test_26_delete_is_hidden_then_purged_in_batches(self):
+        from unittest import mock
+        from apps.blog import tasks
+        from apps.blog.models import Notification
+
+        tag = Tag.objects.create(name="gone")
+        post = Post.objects.create(title="big", body="b", author=self.user1)
+        post.tags.add(tag)
+        post.likes.add(self.user1, self.user2)
+        parent = None
+        for i in range(7):  # 一条很深的回复链
+            parent = Comment.objects.create(body=f"c{i}", author=self.user2, post=post, parent=parent)
+        Notification.objects.create(recipient=self.user2, post=post, parent=parent, last_comment_id=parent.pk,
+                                    count=1, updated_at=parent.created_at)
+        self.client.get(f"/api/articles/{post.pk}/")
+        self.assertTrue(redis.exists(f"post:{post.pk}:view_count"))
+
+        self.login("u1", "pass12345")
+        self.assertEqual(self.client.delete(f"/api/articles/{post.pk}/").status_code, status.HTTP_204_NO_CONTENT)
+        # 请求里只标记，马上对所有人（包括作者）隐藏
+        self.assertEqual(Post.objects.get(pk=post.pk).status, "deleted")
+        self.assertEqual(Comment.objects.filter(post=post).count(), 7)
+        self.assertEqual(self.client.get(f"/api/articles/{post.pk}/").status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get("/api/articles/").data["results"], [])
+        resp = self.client.post("/api/comments/", {"post": post.pk, "body": "late"}, format="json")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # 每批 2 行、每次任务最多 3 批：要重新入队好几次才删完
+        worker = Worker(["default"], block_ms=None)
+        worker.ensure_groups()
+        with mock.patch.object(tasks, "PURGE_BATCH", 2), mock.patch.object(tasks, "PURGE_MAX_BATCHES", 3), \
+                mock.patch.object(tasks.purge_post, "delay", wraps=tasks.purge_post.delay) as requeue:
+            while worker.run_once():
+                pass
+        self.assertGreater(requeue.call_count, 1)
+        self.assertFalse(Post.objects.filter(pk=post.pk).exists())
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(Notification.objects.exists())
+        self.assertFalse(Post.likes.through.objects.exists() or Post.tags.through.objects.exists())
+        self.assertEqual(list(redis.scan_iter(f"post:{post.pk}:*")), [])
+        self.assertTrue(Tag.objects.filter(pk=tag.pk).exists())
+
+    def test_27_avatar_upload_renders_thumbnails(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from PIL import Image
+        from apps.users import avatars
+
+        buf = io.BytesIO()
+        Image.new("RGB", (300, 200), "red").save(buf, "PNG")
+        Post.objects.create(title="a", body="b", author=self.user1)
+        self.login("u1", "pass12345")
+        # 列表页先进缓存
+        before = self.client.get("/api/articles/").data["results"][0]["author"]
+        with override_settings(MEDIA_ROOT=tempfile.mkdtemp()):
+            resp = self.client.post("/api/users/me/avatar/",
+                                    {"file": SimpleUploadedFile("a.png", buf.getvalue(), "image/png")})
+            self.assertEqual(resp.status_code, status.HTTP_202_ACCEPTED, resp.data)
+            self.assertEqual(set(resp.data["avatar_thumbs"]), {str(size) for size in avatars.AVATAR_SIZES})
+            avatar_hash = User.objects.get(pk=self.user1.pk).avatar_hash
+            # 等进程池里的任务跑完
+            avatars._pool.shutdown(wait=True)
+            avatars._pool = None
+            # 生成好以后缓存的列表页换代，作者卡片是新头像
+            after = self.client.get("/api/articles/").data["results"][0]["author"]
+            self.assertNotEqual(after["avatar"], before["avatar"])
+            self.assertEqual((after["avatar"], after["avatar_thumbs"]), (resp.data["avatar"], resp.data["avatar_thumbs"]))
+            for size in avatars.AVATAR_SIZES:
+                for ext in avatars.AVATAR_FORMATS:
+                    with Image.open(os.path.join(avatars.avatar_dir(avatar_hash), f"{size}.{ext}")) as thumb:
+                        self.assertEqual(thumb.size, (size, size))
+
+            resp = self.client.post("/api/users/me/avatar/",
+                                    {"file": SimpleUploadedFile("a.png", b"not an image", "image/png")})
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+            # 子进程里生成失败：记日志，整个目录删掉，用户退回原来的头像
+            out_dir = avatars.avatar_dir("broken")
+            os.makedirs(out_dir)
+            User.objects.filter(pk=self.user1.pk).update(avatar_hash="broken")
+            # 进程池退出时等回调跑完，所以 assertLogs 要套在外面
+            with self.assertLogs("apps.users.avatars", "ERROR"), avatars.ProcessPoolExecutor(max_workers=1) as pool:
+                future = pool.submit(avatars.render_variants, os.path.join(out_dir, "original"), out_dir, (32,))
+                avatars.watch_render(future, self.user1.pk, "broken", (avatar_hash, "http://testserver/old.jpeg"))
+            self.assertFalse(os.path.exists(out_dir))
+            user = User.objects.get(pk=self.user1.pk)
+            self.assertEqual((user.avatar_hash, user.avatar), (avatar_hash, "http://testserver/old.jpeg"))
+
+    def test_28_load_shedding_counts_in_flight_across_workers(self):
+        from utils.middleware import IN_FLIGHT_KEY
+
+        self.login("u1", "pass12345")
+        now_ms = int(redis.time()[0]) * 1000
+        # 别的 worker 正在处理的请求：全站并发到上限时拒掉写请求，读请求照常
+        limit = settings.LOAD_SHEDDING["MAX_IN_FLIGHT"]
+        redis.zadd(IN_FLIGHT_KEY, {f"other-{i}": now_ms for i in range(limit)})
+        resp = self.client.post("/api/articles/", {"title": "x", "body": "b"}, format="json")
+        self.assertEqual(resp.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(self.client.get("/api/articles/").status_code, status.HTTP_200_OK)
+        # 挂掉的 worker 留下的过期登记不算
+        redis.zadd(IN_FLIGHT_KEY, {f"other-{i}": 0 for i in range(limit)})
+        resp = self.client.post("/api/articles/", {"title": "x", "body": "b"}, format="json")
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(redis.zcard(IN_FLIGHT_KEY), 0)
+
+        # 单个客户端同时占着太多请求：429
+        client_key = f"{IN_FLIGHT_KEY}:127.0.0.1"
+        redis.zadd(client_key, {f"mine-{i}": now_ms for i in range(settings.LOAD_SHEDDING["MAX_IN_FLIGHT_PER_CLIENT"])})
+        self.assertEqual(self.client.get("/api/articles/").status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        # 客户端自己填的 X-Forwarded-For 不作数，换着填也还是同一个客户端
+        resp = self.client.get("/api/articles/", HTTP_X_FORWARDED_FOR="10.0.0.9")
+        self.assertEqual(resp.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        redis.delete(client_key)
+        self.assertEqual(self.client.get("/api/articles/").status_code, status.HTTP_200_OK)
+
+    def test_29_startup_benchmark_prints_timings(self):
+        # 冒烟测试：跑一次子进程，打出启动和第一个请求的耗时；超预算时报错
+        out = io.StringIO()
+        options = {"settings_module": "config.settings", "path": "/", "runs": 1, "forbid": []}
+        call_command("startup_benchmark", boot_budget_ms=60000, request_budget_ms=60000, stdout=out, **options)
+        self.assertIn("config.settings  / -> 200", out.getvalue())
+        self.assertRegex(out.getvalue(), r"启动 \d+ms.*第一个请求 \d+ms")
+        with self.assertRaises(CommandError):
+            call_command("startup_benchmark", boot_budget_ms=0, stdout=io.StringIO(), **options)
+
 # Create your tests here.
@@ -1,18 +1,31 @@
-import json
-
 from django.db import transaction
-from rest_framework import serializers
-from django.db.models import Q
+from django.http import StreamingHttpResponse, HttpResponse, Http404
+from django.db.models import Q, Count, F
+from django.utils import timezone
 from utils.redis_pool import redis
+from utils.throttling import LikeUserThrottle, LikeIPThrottle, CommentUserThrottle, CommentIPThrottle
 
 # Create your views here.
 from rest_framework import viewsets, permissions, filters, status
-from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
-from .models import Post, Category, Comment
-from .serializers import PostSerializer, CategorySerializer, CommentSerializer, PostDetailSerializer
+from .models import Post, Category, Comment, Tag, ArchivedComment
+from apps.users.models import User
+from .serializers import PostSerializer, CategorySerializer, CommentSerializer, AuthorSerializer, \
+    TagSerializer, BodyPatchSerializer, ArchivedPostSerializer, comment_page_data, make_summary
+from .cache import get_post_fragments, set_post_fragment, get_author_card, set_author_card, \
+    bump_post, is_liked, liked_post_ids, bump_generation, CachedListMixin, ensure_like_set, toggle_like, \
+    negotiate_encoding, get_encoded_detail, set_encoded_detail, read_counters, scan_likers, like_key, \
+    get_many_post_fragments, get_many_author_cards, set_many_fragments, patch_post_core, like_counts
+from .tasks import sync_post_views, persist_like, purge_post, rebuild_post_stats
+from .feed import fanout_post, feed_page
+from .visitors import record_visit, unique_visitors
+from .bulk import export_ndjson, import_ndjson
+from .pagination import CommentKeysetPagination
+from .delta import apply_ops, DeltaError
+from . import stats, autocomplete, archive, live, notifications
 
 
 # 自定义权限：只有作者能改，别人只能看 (对象级权限)
@@ -23,7 +36,18 @@ class IsAuthorOrReadOnly(permissions.BasePermission):
         return obj.author == request.user
 
 
-class PostViewSet(viewsets.ModelViewSet):
+# 分类、标签是全站共用的：谁都能看，只有管理员能增删改
+class IsAdminOrReadOnly(permissions.BasePermission):
+    def has_permission(self, request, view):
+        if request.method in permissions.SAFE_METHODS:
+            return True
+        return bool(request.user and request.user.is_staff)
+
+
+BATCH_MAX_IDS = 100
+
+
+class PostViewSet(CachedListMixin, viewsets.ModelViewSet):
     """
     文章接口
     支持：增删改查、分页、搜索、筛选、排序
@@ -35,6 +59,7 @@ class PostViewSet(viewsets.ModelViewSet):
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     ordering_fields = ['created_at', 'views']
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly]
+    list_cache_name = 'posts'
     # 2. 权限控制
     # permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly]
     #
@@ -45,140 +70,518 @@ class PostViewSet(viewsets.ModelViewSet):
     # ordering_fields = ['created_at', 'id']  # 支持 ?ordering=-created_at
 
 
-    def get_serializer_class(self):
-        if self.action == 'retrieve':
-            return PostDetailSerializer
-        return PostSerializer
     # 4. 重写 perform_create：自动把当前登录用户设为作者
     def perform_create(self, serializer):
         with transaction.atomic():
-            serializer.save(author=self.request.user)
+            post = serializer.save(author=self.request.user)
+            after = stats.snapshot(post)
+            transaction.on_commit(lambda: bump_generation('posts'))
+            transaction.on_commit(lambda: stats.apply_change(None, after))
+            transaction.on_commit(lambda: autocomplete.index_post(post))
+            if post.status == 'published':
+                # 推送到粉丝的时间线，粉丝多的时候很慢，交给后台任务
+                transaction.on_commit(lambda: fanout_post.delay(post.id))
+
+    def list_cache_allowed(self, request):
+        # 登录用户能看到自己的草稿，有草稿的人列表和别人不一样，不走缓存
+        user = request.user
+        if not user.is_authenticated:
+            return True
+        return not Post.objects.filter(author=user, status='draft').exists()
+
+    def overlay_list_data(self, request, data):
+        # is_like 因人而异：整页一次 pipeline 查出点过赞的文章
+        liked = liked_post_ids([item['id'] for item in data['results']], request.user)
+        for item in data['results']:
+            item['is_like'] = item['id'] in liked
+        return data
+
     def retrieve(self, request, pk=None,*args,**kwargs):
-        cache_key = f"post:detail:{pk}"
-        view_key = f"post:{pk}:view_count"
         user = request.user
+        # 先组装内容再计数：片段没命中时 detail_payload 走 get_object 的可见性检查，命中的片段只会是
+        # 已发布的文章，所以看不到的文章（别人的草稿、已删除）在这里就 404，不会加浏览量、访客数，也不会推计数
+        try:
+            if request.query_params.get('mode') == 'static':
+                response = self.retrieve_static(request, pk)
+            else:
+                response = Response(self.detail_payload(pk), status=status.HTTP_200_OK)
+        except Http404:
+            # 热表里没有，可能是被归档了
+            return self.retrieve_archived(request, pk)
 
+        view_key = f"post:{pk}:view_count"
     #先处理浏览量 ----------------------------------------------------
         if not redis.exists(view_key):
             # 极端情况：Redis 丢数据了，这里才需要被迫查库（只会发生 1 次）
-            # 为了代码简洁，这里可以直接给个初始值，或者回源查一次
-            try:
-                # 这里的查询是为了容错，虽有性能损耗但概率极低
-                view_data = Post.objects.values('views').get(pk=pk)
-                db_views = view_data['views']
-                redis.set(view_key, db_views + 1, ex=86400)
-                current_views = db_views + 1
-            except Post.DoesNotExist:
-                return Response(status=status.HTTP_404_NOT_FOUND)
+            db_views = Post.objects.filter(pk=pk).values_list('views', flat=True).first() or 0
+            redis.set(view_key, db_views + 1, ex=86400)
+            current_views = db_views + 1
         else:
             current_views = redis.incr(view_key)
     #-------------------------------------------------------------
-    #然后处理内容缓存的问题------------------------------------------
-        cache_data = redis.get(cache_key)
-        #只在redis里存储公共部分
-        if cache_data:
-            print("命中缓存")
-            data = json.loads(cache_data)
-            if user.is_authenticated:
-                is_like = redis.sismember(f"post:{pk}:like_member", user.id)
-            else:
-                is_like = False
-            data["is_like"] = is_like
+        if current_views % 10 == 0:
+            # 落库交给后台任务，不占用响应时间
+            sync_post_views.delay(int(pk), current_views)
+        # 独立访客数：HyperLogLog 去重，刷新/爬虫不会把它刷高
+        unique = record_visit(pk, request)
+        # 推给正在看这篇文章计数的 SSE 连接（live.py 里按时间窗口合并）
+        live.publish(pk, views=current_views, unique_visitors=unique)
+
+        # 点赞数以 Redis 点赞集合为准，和 /counters/、SSE 推的是同一个数；片段里不存，点赞时不用让片段失效
+        like_count = like_counts([int(pk)])[int(pk)]
+        if isinstance(response, Response):
+            #不管redis有没有,都要去处理的私密数据
+            response.data["is_like"] = is_liked(pk, user)
+            response.data["like_count"] = like_count
+            response.data["views"] = current_views
+            response.data["unique_visitors"] = unique
         else:
+            response['X-Post-Views'] = current_views
+            response['X-Post-Unique-Visitors'] = unique
+            response['X-Post-Like-Count'] = like_count
+        return response
+
+    def retrieve_archived(self, request, pk):
+        """归档文章的详情：只读，不计浏览量，不走片段缓存（冷数据，访问很少）"""
+        post = archive.get_post(pk, request.user)
+        if post is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response(ArchivedPostSerializer(post, context=self.get_serializer_context()).data)
+
+    def detail_payload(self, pk):
+        """
+        组装详情里所有人都一样的部分：按片段取，哪块没命中就只重建哪块
+        返回的 dict 不含 is_like / like_count / unique_visitors，views 是数据库里的旧值
+        """
+        fragments = get_post_fragments(pk)
+        core_ver, core = fragments['core']
+        instance = None
+        if core is None:
+            # 片段只缓存已发布的文章，所以没命中时才需要走 get_object 的可见性检查
             instance = self.get_object()
-            print("没有命中缓存,回源查询")
-            serializer = self.get_serializer(instance)
-            data = serializer.data
-            if "is_like" in data:
-                data.pop("is_like")
+            core = PostSerializer(instance, context=self.get_serializer_context()).data
+            # 会变的计数不进片段，由 retrieve 按 Redis 里的最新值补上
+            core.pop("is_like", None)
+            core.pop("like_count", None)
+            # 作者卡片单独缓存，正文片段里只留作者 id
+            core["author"] = instance.author_id
             if instance.status == 'published':
-                redis.set(cache_key, json.dumps(data), ex=86400)
-            if user.is_authenticated:
-                data["is_like"] = instance.likes.filter(id=user.id).exists()
-            else:
-                data["is_like"] = False
-
-        # #不管redis有没有,都要去处理的私密数据
-        # if request.user.is_authenticated:
-        #     data["is_like"] = instance.likes.filter(id=request.user.id).exists()
-        # else:
-        #     is_like = False
-        data["views"] = current_views
-        if current_views % 10 == 0:
-            # 这里为了不影响响应速度，可以用 celery 异步，或者用简单的 update 语句
-            # 使用 update 语句极快，不会加载对象，也不会触发信号
-            Post.objects.filter(pk=pk).update(views=current_views)
-            print(f"💾 [MySQL] 浏览量已同步: {current_views}")
-        return Response(data, status=status.HTTP_200_OK)
+                set_post_fragment(pk, 'core', core_ver, core)
+        data = dict(core)
+        data.pop("like_count", None)  # 升级前缓存的片段里还有
+
+        author_id = data["author"]
+        card_ver, card = get_author_card(author_id)
+        if card is None:
+            author = instance.author if instance else User.objects.get(pk=author_id)
+            card = AuthorSerializer(author).data
+            set_author_card(author_id, card_ver, card)
+        data["author"] = card
+
+        comments_ver, comment_page = fragments['comments']
+        if comment_page is None:
+            comment_page = comment_page_data(pk, self.get_serializer_context())
+            if data["status"] == 'published':
+                set_post_fragment(pk, 'comments', comments_ver, comment_page)
+        data.update(comment_page)
+        return data
+
+    def retrieve_static(self, request, pk):
+        """
+        ?mode=static：响应体是缓存里压缩好的字节，命中时不解 JSON、不重新编码、不再压缩
+        会变的字段放在响应头里：X-Post-Views / X-Post-Unique-Visitors / X-Post-Like-Count / X-Post-Is-Like，
+        也可以单独调 /api/articles/{id}/counters/
+        """
+        encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        key, body = get_encoded_detail(pk, encoding)
+        if body is None:
+            data = self.detail_payload(pk)
+            data.pop("views", None)
+            body = set_encoded_detail(key, encoding, data, cacheable=data["status"] == 'published')
+        response = HttpResponse(body, content_type='application/json')
+        if encoding != 'identity':
+            response['Content-Encoding'] = encoding
+        response['Vary'] = 'Accept-Encoding'
+        response['X-Post-Is-Like'] = 'true' if is_liked(pk, request.user) else 'false'
+        return response
+
+    @action(detail=True, methods=['GET'])
+    def counters(self, request, pk=None):
+        """只返回会变的计数，配合 ?mode=static 的详情使用；不增加浏览量"""
+        self.get_object()  # 别人的草稿、已删除的文章不能看计数
+        counters = read_counters(pk, request.user)
+        if counters is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response(counters)
+
+    @action(detail=True, methods=['GET'])
+    def uv(self, request, pk=None):
+        """独立访客统计：?days=7 合并最近 7 天的 HyperLogLog"""
+        self.get_object()  # 复用 get_queryset 的可见性规则
+        try:
+            days = int(request.query_params.get('days', 7))
+        except ValueError:
+            return Response({'detail': 'days 必须是整数'}, status=status.HTTP_400_BAD_REQUEST)
+        total, daily = unique_visitors(pk, days)
+        return Response({'id': int(pk), 'days': len(daily),
+                         'unique_visitors': total, 'daily': daily})
+
+    @action(detail=True, methods=['GET'], pagination_class=CommentKeysetPagination)
+    def comments(self, request, pk=None):
+        """文章评论分页：?before=<上一页最后的评论id>&page_size=20"""
+        try:
+            post = self.get_object()
+            queryset = Comment.objects.filter(post=post)
+        except Http404:
+            post = archive.get_post(pk, request.user)
+            if post is None:
+                raise
+            queryset = ArchivedComment.objects.filter(post=post)
+        queryset = queryset.select_related('author', 'parent__author')
+        page = self.paginate_queryset(queryset)
+        serializer = CommentSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['GET'])
+    def likers(self, request, pk=None):
+        """点过赞的人：?cursor=<上一页返回的游标>&page_size=20，按 Redis 点赞集合 SSCAN 分页"""
+        post = self.get_object()
+        try:
+            cursor = int(request.query_params.get('cursor', 0))
+            size = max(1, min(int(request.query_params.get('page_size', 20)), 100))
+        except ValueError:
+            return Response({'detail': 'cursor / page_size 必须是整数'}, status=status.HTTP_400_BAD_REQUEST)
+        ensure_like_set(post)
+        ids, next_cursor = scan_likers(post.pk, cursor, size)
+        # 一页一条 SQL 取用户卡片，按 SSCAN 返回的顺序排
+        users = User.objects.only('id', 'username', 'avatar', 'avatar_hash', 'bio').in_bulk(ids)
+        cards = AuthorSerializer([users[uid] for uid in dict.fromkeys(ids) if uid in users], many=True,
+                                 context=self.get_serializer_context()).data
+        return Response({
+            'like_count': redis.scard(like_key(post.pk)),
+            'next': replace_query_param(request.get_full_path(), 'cursor', next_cursor) if next_cursor else None,
+            'results': cards,
+        })
+
+    @action(detail=False, methods=['GET'])
+    def batch(self, request):
+        """
+        批量取详情：?ids=1,2,3（最多 100 个），仪表盘/信息流一次请求代替 N 次 retrieve
+        返回正文 + 作者卡片 + views / is_like，不含评论（评论走 /comments/ 分页），不增加浏览量；
+        不存在或看不到的 id 放在 missing 里
+        """
+        try:
+            ids = list(dict.fromkeys(int(i) for i in request.query_params.get('ids', '').split(',') if i.strip()))
+        except ValueError:
+            return Response({'detail': 'ids 必须是逗号分隔的整数'}, status=status.HTTP_400_BAD_REQUEST)
+        if not ids or len(ids) > BATCH_MAX_IDS:
+            return Response({'detail': f'ids 需要 1 到 {BATCH_MAX_IDS} 个'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # 1. 一次往返取所有正文片段（片段只缓存已发布的文章，命中的都是可见的）
+        fetched = dict(zip(ids, get_many_post_fragments(ids, 'core')))
+        cores = {pk: data for pk, (_, data) in fetched.items() if data is not None}
+        misses = [pk for pk in ids if pk not in cores]
+
+        # 2. 没命中的一条查询补齐，走 get_queryset 保证可见性规则和 retrieve 一致
+        post_fragments = []
+        if misses:
+            instances = list(self.get_queryset().filter(pk__in=misses)
+                             .annotate(like_total=Count('likes', distinct=True)))
+            # is_like 下面一次 pipeline 统一算，这里给个空集合，免得序列化时每行查一次库
+            context = {**self.get_serializer_context(), 'liked_ids': set()}
+            rows = PostSerializer(instances, many=True, context=context).data
+            for instance, core in zip(instances, rows):
+                core.pop("is_like", None)
+                core.pop("like_count", None)
+                core["author"] = instance.author_id
+                cores[instance.pk] = core
+                if instance.status == 'published':
+                    post_fragments.append((instance.pk, 'core', fetched[instance.pk][0], core))
+
+        # 作者卡片同样批量取、一条查询补齐
+        author_ids = list({core["author"] for core in cores.values()})
+        card_fetched = dict(zip(author_ids, get_many_author_cards(author_ids)))
+        cards = {uid: data for uid, (_, data) in card_fetched.items() if data is not None}
+        author_cards = []
+        card_misses = [uid for uid in author_ids if uid not in cards]
+        if card_misses:
+            for author in User.objects.filter(pk__in=card_misses):
+                cards[author.pk] = AuthorSerializer(author).data
+                author_cards.append((author.pk, card_fetched[author.pk][0], cards[author.pk]))
+
+        # 3. 回填缓存，一个 pipeline
+        if post_fragments or author_cards:
+            set_many_fragments(post_fragments, author_cards)
+
+        # 4. is_like、点赞数各一次 pipeline；浏览量读 Redis 计数，没有就用片段里数据库的值
+        visible = [pk for pk in ids if pk in cores]
+        liked = liked_post_ids(visible, request.user)
+        likes = like_counts(visible)
+        views = redis.mget([f"post:{pk}:view_count" for pk in visible]) if visible else []
+        results = []
+        for pk, current_views in zip(visible, views):
+            data = dict(cores[pk])
+            data["author"] = cards.get(data["author"])
+            data["is_like"] = pk in liked
+            data["like_count"] = likes[pk]
+            data["views"] = int(current_views) if current_views is not None else data["views"]
+            results.append(data)
+        return Response({'results': results, 'missing': [pk for pk in ids if pk not in cores]})
+
+    @action(detail=True, methods=['PATCH'], url_path='body')
+    def patch_body(self, request, pk=None):
+        """
+        正文增量更新：{"revision": 基于的版本, "ops": [{"pos": 0, "delete": 3, "insert": "..."}]}
+        版本号对不上返回 409 和当前版本号，客户端拉最新正文重新算 diff
+        """
+        post = self.get_object()
+        serializer = BodyPatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        revision = serializer.validated_data['revision']
+        if revision != post.revision:
+            return Response({'detail': '正文已经被改过了，请基于最新版本重试', 'revision': post.revision},
+                            status=status.HTTP_409_CONFLICT)
+        try:
+            body = apply_ops(post.body, serializer.validated_data['ops'])
+        except DeltaError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            # 条件更新：版本号还是 revision 才写，两个并发的保存只有一个能成功
+            updated = Post.objects.filter(pk=post.pk, revision=revision) \
+                .update(body=body, revision=revision + 1, updated_at=timezone.now())
+            if not updated:
+                current = Post.objects.filter(pk=post.pk).values_list('revision', flat=True).first()
+                return Response({'detail': '正文已经被改过了，请基于最新版本重试', 'revision': current},
+                                status=status.HTTP_409_CONFLICT)
+
+            # 正文片段换版本并直接写好新版本，评论片段不受影响
+            changes = {'body': body, 'summary': make_summary(body), 'revision': revision + 1}
+            transaction.on_commit(lambda: patch_post_core(post.pk, changes, revision + 1))
+            # 列表里有正文、摘要和版本号，但缓存的列表只有已发布的文章（有草稿的人不走列表缓存），
+            # 草稿的自动保存不用换代，否则有人在写稿时所有列表缓存每隔几秒就全部失效
+            if post.status == 'published':
+                transaction.on_commit(lambda: bump_generation('posts'))
+        return Response({'id': post.pk, 'revision': revision + 1, 'length': len(body)})
+
+    @action(detail=False, methods=['GET'])
+    def export(self, request):
+        """流式导出 NDJSON（文章 + 标签 + 评论），内存占用和总行数无关"""
+        response = StreamingHttpResponse(export_ndjson(self.get_queryset()),
+                                         content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="posts.ndjson"'
+        return response
+
+    @action(detail=False, methods=['POST'], url_path='import',
+            permission_classes=[permissions.IsAuthenticated])
+    def bulk_import(self, request):
+        """批量导入 NDJSON：每行一篇文章（可以直接用 export 的输出，评论和原始发布时间一起导入），文章作者统一为当前用户"""
+        created, errors, throughput = import_ndjson(request.stream or [], request.user)
+        if created:
+            # 整批导入只换一次列表的代；导入的是旧内容，故意不逐篇推到粉丝时间线（fanout_post）
+            bump_generation('posts')
+            rebuild_post_stats.delay()
+        return Response({'created': created, 'errors': errors, **throughput},
+                        status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST)
 
     def perform_update(self, serializer):
+        was_published = serializer.instance.status == 'published'
+        before = stats.snapshot(serializer.instance)
+        extra = {}
+        if 'body' in serializer.validated_data:
+            # 在库里加一，不用内存里读到的旧值：同时提交的增量更新也加过一次
+            extra['revision'] = F('revision') + 1
         with transaction.atomic():
-            instance = serializer.save()
-            cache_key = f"post:detail:{instance.pk}"
-            transaction.on_commit(lambda : redis.delete(cache_key))
+            instance = serializer.save(**extra)
+            after = stats.snapshot(instance)
+            # 状态、分类、标签变了才会真的改统计
+            transaction.on_commit(lambda: stats.apply_change(before, after))
+            transaction.on_commit(lambda: autocomplete.index_post(instance))
+            if not was_published and instance.status == 'published':
+                # 草稿转发布，这时候才推给粉丝
+                transaction.on_commit(lambda: fanout_post.delay(instance.pk))
+            # 只让正文片段失效，评论片段和作者卡片不受影响
+            transaction.on_commit(lambda: bump_post(instance.pk, 'core'))
+            transaction.on_commit(lambda: bump_generation('posts'))
     def perform_destroy(self, instance):
+        # 不在请求里级联删评论/点赞：先标成 deleted 马上对所有人隐藏，后台任务再分批清理
         pk = instance.id
+        before = stats.snapshot(instance)
         with transaction.atomic():
-            instance.delete()
+            Post.objects.filter(pk=pk).update(status='deleted', updated_at=timezone.now())
             def clear_redis():
-                cache_key = f"post:detail:{pk}"
-                redis.delete(cache_key)
-                redis.delete(f"post:{pk}:view_count")
+                stats.apply_change(before, None)
+                autocomplete.remove('post', pk)
+                bump_post(pk, 'core', 'comments')
+                bump_generation('posts')
+                purge_post.delay(pk)
             transaction.on_commit(clear_redis)
 
     def get_queryset(self):
         user = self.request.user
         queryset = Post.objects.select_related('author','category').prefetch_related('tags').all()
         if user.is_authenticated:
-            return queryset.filter(Q(author=user)|Q(status='published'))
+            # 作者能看到自己的草稿，但已删除（等待后台清理）的谁都看不到
+            return queryset.filter(Q(author=user, status='draft')|Q(status='published'))
         return queryset.filter(status='published')
-    @action(detail=True, methods=['POST'], permission_classes=[permissions.IsAuthenticated])
+    @action(detail=True, methods=['POST'], permission_classes=[permissions.IsAuthenticated],
+            throttle_classes=[LikeUserThrottle, LikeIPThrottle])
     def like(self, request, pk=None):
         post = self.get_object()
         user = self.request.user
-        like_key = f"post:{pk}:like_member"  #点赞作者名单
-        is_like = redis.sismember(like_key, user.id)
-    #先看有没有这个键位,如果没有就读一遍数据库,存放到redis,把读操作放在事务外面
-        if not redis.exists(like_key):
-            user_ids = post.likes.values_list('id', flat=True)
-            if user_ids:
-                redis.sadd(like_key, *user_ids)
-            redis.expire(like_key, 86400)
-        with transaction.atomic():
-        #再去判断点赞/取消点赞逻辑
-            if is_like:
-                post.likes.remove(request.user)
-                def redis_remove():
-                    redis.srem(like_key, user.id)
-                message="取消点赞"
-                transaction.on_commit(redis_remove)
-            else:
-                post.likes.add(request.user)
-                def redis_add():
-                    redis.sadd(like_key, user.id)
-                message = '点赞成功'
-                transaction.on_commit(redis_add)
-
-        final_count = redis.scard(like_key)
+        #先看有没有这个键位,如果没有就读一遍数据库,存放到redis
+        ensure_like_set(post)
+        #以 Redis 为准原子地切换点赞状态，落库交给后台任务
+        liked, final_count = toggle_like(pk, user.id)
+        persist_like.delay(int(pk), user.id, liked)
+        live.publish(pk, like_count=final_count)
+        message = '点赞成功' if liked else '取消点赞'
         return Response({'message': message,
                          'like_count': final_count
                          }
                         )
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class FeedViewSet(viewsets.GenericViewSet):
+    """
+    关注动态：/api/feed/?before=<上一页最后一条的时间戳>
+    一次 ZREVRANGEBYSCORE 拿到本页文章 id，再一条 SQL 批量取文章
+    """
+    serializer_class = PostSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    page_size = 20
+
+    def list(self, request):
+        try:
+            before = float(request.query_params['before']) if request.query_params.get('before') else None
+        except ValueError:
+            return Response({'detail': 'before 必须是时间戳'}, status=status.HTTP_400_BAD_REQUEST)
+        entries, next_cursor = feed_page(request.user.id, before=before, size=self.page_size)
+        ids = [pk for pk, _ in entries]
+        # like_total 和 batch 一样先 annotate 好，否则每条文章一次 COUNT
+        posts = Post.objects.select_related('author', 'category').prefetch_related('tags') \
+            .filter(status='published').annotate(like_total=Count('likes', distinct=True)).in_bulk(ids)
+        # 按时间线顺序输出，已删除/转草稿的文章直接跳过
+        ordered = [posts[pk] for pk in ids if pk in posts]
+        context = self.get_serializer_context()
+        context['liked_ids'] = liked_post_ids(ids, request.user)
+        serializer = self.get_serializer(ordered, many=True, context=context)
+        next_url = None
+        if next_cursor is not None:
+            next_url = replace_query_param(request.path, 'before', repr(next_cursor))
+        return Response({'next': next_url, 'results': serializer.data})
+
+
+class PostStatsMixin:
+    """分类/标签接口：返回前补上文章数和最新发布时间（stats.py 里增量维护，不进列表缓存）"""
+    stats_kind = None
+
+    def overlay_list_data(self, request, data):
+        stats.attach_stats(self.stats_kind, data['results'] if isinstance(data, dict) else data)
+        return data
+
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        stats.attach_stats(self.stats_kind, [response.data])
+        return response
+
+
+class CategoryViewSet(PostStatsMixin, CachedListMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
-    # 分类随便谁都能看，但只有管理员能改
-    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    permission_classes = [IsAdminOrReadOnly]
+    list_cache_name = 'categories'
+    stats_kind = 'category'
+
+    def perform_create(self, serializer):
+        autocomplete.index_taxonomy('category', serializer.save())
+        bump_generation('categories')
+
+    def perform_update(self, serializer):
+        obj = serializer.save()
+        # 改名不能把补全排名清零：分数和 rebuild 一样按已发布文章数算
+        autocomplete.index_taxonomy('category', obj, obj.post_set.filter(status='published').count())
+        # 文章列表里内嵌了分类名
+        bump_generation('categories')
+        bump_generation('posts')
+
+    def perform_destroy(self, instance):
+        pk = instance.pk
+        instance.delete()
+        # 删分类会把文章的 category 置空
+        stats.forget('category', pk)
+        autocomplete.remove('category', pk)
+        bump_generation('categories')
+        bump_generation('posts')
+
+
+class TagViewSet(PostStatsMixin, CachedListMixin, viewsets.ModelViewSet):
+    queryset = Tag.objects.all()
+    serializer_class = TagSerializer
+    permission_classes = [IsAdminOrReadOnly]
+    list_cache_name = 'tags'
+    stats_kind = 'tag'
+
+    def perform_create(self, serializer):
+        autocomplete.index_taxonomy('tag', serializer.save())
+        bump_generation('tags')
+
+    def perform_update(self, serializer):
+        obj = serializer.save()
+        # 改名不能把补全排名清零：分数和 rebuild 一样按已发布文章数算
+        autocomplete.index_taxonomy('tag', obj, obj.post_set.filter(status='published').count())
+        # 文章列表里内嵌了标签名
+        bump_generation('tags')
+        bump_generation('posts')
+
+    def perform_destroy(self, instance):
+        pk = instance.pk
+        instance.delete()
+        stats.forget('tag', pk)
+        autocomplete.remove('tag', pk)
+        bump_generation('tags')
+        bump_generation('posts')
 
 
 class CommentViewSet(viewsets.ModelViewSet):
     queryset = Comment.objects.select_related('author', 'parent', 'parent__author').all()
     serializer_class = CommentSerializer
 
-
+    def get_throttles(self):
+        # 只限制发评论，读评论不限
+        if self.action == 'create':
+            return [CommentUserThrottle(), CommentIPThrottle()]
+        return super().get_throttles()
 
     def perform_create(self, serializer):
         with transaction.atomic():
-            serializer.save(author=self.request.user)
+            comment = serializer.save(author=self.request.user)
+            # 新评论只让文章的评论片段失效，正文片段照常命中
+            transaction.on_commit(lambda: bump_post(comment.post_id, 'comments'))
+            # 回复通知只写 Redis 收件箱，落库由 flush_notifications 攒一批再做
+            transaction.on_commit(lambda: notifications.notify_reply(comment, self.request.user))
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            comment = serializer.save()
+            transaction.on_commit(lambda: bump_post(comment.post_id, 'comments'))
+
+    def perform_destroy(self, instance):
+        post_id = instance.post_id
+        with transaction.atomic():
+            instance.delete()
+            transaction.on_commit(lambda: bump_post(post_id, 'comments'))
+
+
+class AutocompleteViewSet(viewsets.ViewSet):
+    """搜索框联想：/api/autocomplete/?q=py&limit=10，只查 Redis 前缀索引，不碰数据库"""
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []  # 结果和用户无关，也省掉 JWT 查用户的那次查询
+
+    def list(self, request):
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 10)), 20))
+        except ValueError:
+            limit = 10
+        q = request.query_params.get('q', '')
+        return Response({'q': q, 'results': autocomplete.suggest(q, limit)})
@@ -0,0 +1,61 @@
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.throttling import BaseThrottle
+
+from utils.redis_pool import redis
+
+# 每篇文章每天一个 HyperLogLog，固定约 12KB，误差约 0.81%
+UV_RETENTION_DAYS = getattr(settings, 'UV_RETENTION_DAYS', 30)
+
+
+def uv_key(pk, day):
+    return f"post:{pk}:uv:{day.strftime('%Y%m%d')}"
+
+
+def visitor_id(request):
+    """
+    登录用户用 user id，匿名用户用 IP + UA 的指纹
+    IP 和限流一样用 DRF 的 get_ident（代理层数见 REST_FRAMEWORK['NUM_PROXIES']），
+    客户端自己填的 X-Forwarded-For 不能用来造出任意多个"独立访客"
+    """
+    if request.user.is_authenticated:
+        return f"u:{request.user.id}"
+    ip = BaseThrottle().get_ident(request)
+    ua = request.META.get('HTTP_USER_AGENT', '')
+    return "a:" + hashlib.sha1(f"{ip}|{ua}".encode()).hexdigest()[:16]
+
+
+def record_visit(pk, request):
+    """记录一次访问，返回今天的独立访客数（一次往返）"""
+    key = uv_key(pk, timezone.localdate())
+    pipe = redis.pipeline()
+    pipe.pfadd(key, visitor_id(request))
+    pipe.expire(key, 86400 * (UV_RETENTION_DAYS + 1))
+    pipe.pfcount(key)
+    return pipe.execute()[-1]
+
+
+def unique_visitors(pk, days):
+    """最近 days 天（含今天）的去重访客数，以及每天的明细"""
+    days = max(1, min(days, UV_RETENTION_DAYS))
+    today = timezone.localdate()
+    dates = [today - timedelta(days=i) for i in range(days)]
+    keys = [uv_key(pk, d) for d in dates]
+    # 临时合并键，用完即删
+    merged_key = f"post:{pk}:uv:merged:{days}"
+
+    # pipeline 默认是 MULTI 事务，合并-计数-删除 是原子的
+    pipe = redis.pipeline()
+    for key in keys:
+        pipe.pfcount(key)
+    pipe.pfmerge(merged_key, *keys)
+    pipe.pfcount(merged_key)
+    pipe.delete(merged_key)
+    results = pipe.execute()
+
+    daily = [{'date': d.isoformat(), 'unique_visitors': count}
+             for d, count in zip(dates, results[:days])]
+    return results[-2], daily
@@ -0,0 +1,131 @@
+"""
+头像缩略图
+
+上传的原图按内容哈希存到 MEDIA_ROOT/avatars/{hash}/original，
+各尺寸的缩略图在进程池里生成（缩放是 CPU 密集型，放线程里会抢 GIL），
+文件名固定为 {size}.webp / {size}.jpeg。内容一样的图片哈希一样，
+已经生成过的直接复用，URL 也永远不变，前端/CDN 可以长期缓存。
+"""
+import hashlib
+import io
+import logging
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+AVATAR_SIZES = getattr(settings, 'AVATAR_SIZES', (32, 64, 128))
+AVATAR_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+MAX_AVATAR_BYTES = 5 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+
+
+def _get_pool():
+    # 用到的时候才建进程池，不上传头像的 worker 不多占进程
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=getattr(settings, 'AVATAR_WORKERS', 2))
+    return _pool
+
+
+def avatar_dir(avatar_hash):
+    return os.path.join(settings.MEDIA_ROOT, 'avatars', avatar_hash)
+
+
+def variant_urls(avatar_hash):
+    """{'32': {'webp': url, 'jpeg': url}, ...}，没上传过头像返回 None"""
+    if not avatar_hash:
+        return None
+    base = f"{settings.MEDIA_URL}avatars/{avatar_hash}/"
+    return {str(size): {fmt: f"{base}{size}.{fmt}" for fmt in AVATAR_FORMATS} for size in AVATAR_SIZES}
+
+
+def render_variants(src, out_dir, sizes):
+    """在子进程里执行：居中裁成正方形，缩放到各个尺寸，先写临时文件再 rename，不会读到半截文件"""
+    from PIL import Image, ImageOps
+
+    with Image.open(src) as img:
+        img = ImageOps.exif_transpose(img).convert('RGB')
+        side = min(img.size)
+        left, top = (img.width - side) // 2, (img.height - side) // 2
+        img = img.crop((left, top, left + side, top + side))
+        for size in sizes:
+            thumb = img.resize((size, size), Image.LANCZOS)
+            for ext, fmt in AVATAR_FORMATS.items():
+                path = os.path.join(out_dir, f"{size}.{ext}")
+                tmp = f"{path}.tmp"
+                thumb.save(tmp, fmt, quality=85, optimize=True)
+                os.replace(tmp, path)
+
+
+def save_avatar(upload):
+    """
+    保存原图并把缩略图任务丢进进程池，立即返回 (内容哈希, future)；
+    同一张图已经处理过时 future 是 None
+    """
+    data = upload.read(MAX_AVATAR_BYTES + 1)
+    if len(data) > MAX_AVATAR_BYTES:
+        raise ValueError('头像不能超过 5MB')
+    _verify_image(data)
+
+    avatar_hash = hashlib.sha256(data).hexdigest()[:20]
+    out_dir = avatar_dir(avatar_hash)
+    last = os.path.join(out_dir, f"{AVATAR_SIZES[-1]}.jpeg")
+    if os.path.exists(last):
+        return avatar_hash, None  # 同一张图已经处理过
+
+    os.makedirs(out_dir, exist_ok=True)
+    src = os.path.join(out_dir, 'original')
+    with open(src, 'wb') as f:
+        f.write(data)
+    return avatar_hash, _get_pool().submit(render_variants, src, out_dir, AVATAR_SIZES)
+
+
+def watch_render(future, user_id, avatar_hash, previous):
+    """
+    用户的新头像存好以后再调用（future 已经跑完的话会立即回调）：
+    生成失败时记日志、删掉目录（同一张图再传一次会重新生成），
+    用户还指着这张图的话退回 previous = (原来的 avatar_hash, 原来的 avatar)
+    """
+    future.add_done_callback(lambda f: _check_rendered(f, user_id, avatar_hash, previous))
+
+
+def _check_rendered(future, user_id, avatar_hash, previous):
+    from apps.blog.cache import bump_author_card, bump_generation
+
+    exc = future.exception()
+    if exc is None:
+        # 缩略图都有了，缓存的文章列表页（内嵌了作者卡片）换代，换上新头像
+        bump_generation('posts')
+        return
+    logger.error('头像缩略图生成失败 %s', avatar_hash, exc_info=exc)
+    shutil.rmtree(avatar_dir(avatar_hash), ignore_errors=True)
+
+    from django.db import close_old_connections
+    from apps.users.models import User
+
+    # 回调跑在进程池的管理线程里，数据库连接按 CONN_MAX_AGE 回收
+    close_old_connections()
+    try:
+        old_hash, old_avatar = previous
+        if User.objects.filter(pk=user_id, avatar_hash=avatar_hash).update(avatar_hash=old_hash, avatar=old_avatar):
+            bump_author_card(user_id)
+            bump_generation('posts')
+    except Exception:
+        logger.exception('头像生成失败后恢复用户 %s 原来的头像出错', user_id)
+    finally:
+        close_old_connections()
+
+
+def _verify_image(data):
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.verify()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as exc:
+        raise ValueError('不是有效的图片文件') from exc
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Follow",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "followee",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="follower_relations",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "follower",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="following_relations",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "关注",
+                "verbose_name_plural": "关注",
+            },
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="following",
+            field=models.ManyToManyField(
+                blank=True,
+                related_name="followers",
+                through="users.Follow",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="follow",
+            index=models.Index(
+                fields=["followee", "id"], name="users_follo_followe_a50ef6_idx"
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="follow",
+            unique_together={("follower", "followee")},
+        ),
+    ]
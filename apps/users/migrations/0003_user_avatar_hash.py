@@ -0,0 +1,20 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0002_follow"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="avatar_hash",
+            field=models.CharField(
+                blank=True, default="", max_length=64, verbose_name="头像哈希"
+            ),
+        ),
+    ]
@@ -13,9 +13,31 @@ class User(AbstractUser):
     bio = models.TextField("个人简介", blank=True, null=True)
     # 实际项目中通常会用 ImageField，这里用 URL 简化演示
     avatar = models.URLField("头像", blank=True, null=True)
+    # 上传头像的内容哈希，缩略图地址由它拼出来（见 apps/users/avatars.py）
+    avatar_hash = models.CharField("头像哈希", max_length=64, blank=True, default='')
+    # 关注关系：user.following 是我关注的人，user.followers 是关注我的人
+    following = models.ManyToManyField('self', through='Follow', symmetrical=False,
+                                       related_name='followers', blank=True)
     class Meta:
         verbose_name = "用户"
         verbose_name_plural = verbose_name
 
     def __str__(self):
-        return self.username
\ No newline at end of file
+        return self.username
+
+
+class Follow(models.Model):
+    """关注关系（follower 关注了 followee）"""
+    follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following_relations')
+    followee = models.ForeignKey(User, on_delete=models.CASCADE, related_name='follower_relations')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "关注"
+        verbose_name_plural = verbose_name
+        unique_together = ('follower', 'followee')
+        # 扇出时按被关注者分批扫粉丝
+        indexes = [models.Index(fields=['followee', 'id'])]
+
+    def __str__(self):
+        return f"{self.follower_id} -> {self.followee_id}"
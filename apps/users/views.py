@@ -1,9 +1,18 @@
-from django.shortcuts import render
+from django.shortcuts import render, get_object_or_404
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from rest_framework_simplejwt.views import TokenObtainPairView
 
+from apps.blog.cache import bump_author_card, bump_generation
+from apps.blog import notifications
+from apps.blog.feed import refresh_celebrity, invalidate_timeline
+from apps.users.avatars import save_avatar, variant_urls, watch_render
+from apps.users.models import User, Follow
 from apps.users.serializers import UserSerializer
+from utils.throttling import LoginIPThrottle, LoginUsernameThrottle
 
 
 # Create your views here.
@@ -19,5 +28,85 @@ class UserInfoViewSet(viewsets.ModelViewSet):
             serializer = UserSerializer(user,data=request.data)
             if serializer.is_valid():
                 serializer.save()
+                # 资料改了，文章详情里缓存的作者卡片换新版本，内嵌了作者信息的文章列表页换代
+                bump_author_card(user.id)
+                bump_generation('posts')
                 return Response(serializer.data)
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['post'], url_path='me/avatar',
+            permission_classes=[permissions.IsAuthenticated], parser_classes=[MultiPartParser])
+    def avatar(self, request):
+        """上传头像（表单字段 file），缩略图在后台进程池里生成，先返回 202 和各尺寸地址"""
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'detail': '缺少 file 字段'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            avatar_hash, pending = save_avatar(upload)
+        except ValueError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        user = request.user
+        previous = (user.avatar_hash, user.avatar)
+        thumbs = variant_urls(avatar_hash)
+        user.avatar_hash = avatar_hash
+        # 兼容只认 avatar 字段的老客户端：指向最大的那张 jpeg
+        user.avatar = request.build_absolute_uri(thumbs[max(thumbs, key=int)]['jpeg'])
+        user.save(update_fields=['avatar_hash', 'avatar'])
+        bump_author_card(user.id)
+        if pending is not None:
+            # 先存好再挂回调：生成失败时才能把用户退回原来的头像；生成好了回调里再让列表页换代
+            watch_render(pending, user.id, avatar_hash, previous)
+        else:
+            # 同一张图已经生成过，列表页直接换代
+            bump_generation('posts')
+        return Response({'avatar': user.avatar, 'avatar_thumbs': thumbs}, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'], url_path='me/notifications',
+            permission_classes=[permissions.IsAuthenticated])
+    def notifications(self, request):
+        """回复通知：?before=<上一页最后一条的 at>&page_size=20，同一条评论下的回复合并成一条"""
+        try:
+            before = float(request.query_params['before']) if request.query_params.get('before') else None
+            size = max(1, min(int(request.query_params.get('page_size', 20)), 100))
+        except ValueError:
+            return Response({'detail': 'before / page_size 格式不对'}, status=status.HTTP_400_BAD_REQUEST)
+        unread, items, next_cursor = notifications.page(request.user.id, before=before, size=size)
+        next_url = None
+        if next_cursor is not None:
+            next_url = replace_query_param(request.get_full_path(), 'before', repr(next_cursor))
+        return Response({'unread_count': unread, 'next': next_url, 'results': items})
+
+    @action(detail=False, methods=['get'], url_path='me/notifications/unread',
+            permission_classes=[permissions.IsAuthenticated])
+    def notifications_unread(self, request):
+        """只要未读数（角标用），一次 Redis 往返"""
+        return Response({'unread_count': notifications.unread_count(request.user.id)})
+
+    @action(detail=False, methods=['post'], url_path='me/notifications/read',
+            permission_classes=[permissions.IsAuthenticated])
+    def notifications_read(self, request):
+        """标记已读：{"threads": [被回复的评论 id, ...]}，不传就是全部已读"""
+        threads = request.data.get('threads') or []
+        if not isinstance(threads, list) or not all(isinstance(t, int) for t in threads):
+            return Response({'detail': 'threads 必须是整数列表'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'unread_count': notifications.mark_read(request.user.id, threads)})
+
+    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def follow(self, request, pk=None):
+        """关注/取消关注（再调一次就是取消）"""
+        target = get_object_or_404(User, pk=pk)
+        if target == request.user:
+            return Response({'detail': '不能关注自己'}, status=status.HTTP_400_BAD_REQUEST)
+        deleted, _ = Follow.objects.filter(follower=request.user, followee=target).delete()
+        if not deleted:
+            Follow.objects.get_or_create(follower=request.user, followee=target)
+        invalidate_timeline(request.user.id)
+        refresh_celebrity(target.id)
+        return Response({'message': '取消关注' if deleted else '关注成功',
+                         'is_following': not deleted,
+                         'follower_count': Follow.objects.filter(followee=target).count()})
+
+
+class LoginView(TokenObtainPairView):
+    """登录要做密码哈希，很贵：按 IP 和用户名两个维度限流"""
+    throttle_classes = [LoginIPThrottle, LoginUsernameThrottle]
@@ -5,6 +5,10 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+实时计数推送（/api/live/counters/，见 apps/blog/live.py）是长连接，只能跑在这个入口上，例如
+    gunicorn config.asgi:application -k uvicorn.workers.UvicornWorker
+每个 worker 只占一条 Redis 订阅连接，普通接口仍然可以继续走 WSGI。
 """
 
 import os
@@ -52,6 +52,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware', # 必须放在最前面
+    'utils.middleware.LoadSheddingMiddleware',  # 过载时尽早拒绝，越靠前越省
+    'utils.profiling.ProfilingMiddleware',  # 按需性能分析，没开启时不会加载
     'debug_toolbar.middleware.DebugToolbarMiddleware',# <--- 【新增】加在这里，必须靠前！
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -138,6 +140,17 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# 前端：build_frontend 把 fronted/ 构建到 dist，资源通过 /assets/ 提供
+FRONTEND_SRC_DIR = BASE_DIR / "fronted"
+FRONTEND_DIST_DIR = BASE_DIR / "fronted" / "dist"
+FRONTEND_ASSET_URL = "/assets/"
+
+# 用户上传的文件（头像缩略图等）
+MEDIA_URL = "/media/"
+MEDIA_ROOT = BASE_DIR / "media"
+AVATAR_SIZES = (32, 64, 128)
+AVATAR_WORKERS = 2
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -156,8 +169,67 @@ REST_FRAMEWORK = {
     # 默认分页
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
+    # 前面有几层反向代理：限流、过载保护按 X-Forwarded-For 倒数第 NUM_PROXIES 个地址认客户端，
+    # 0 表示只认 REMOTE_ADDR。不能不设：None 时 DRF 直接用整个 X-Forwarded-For，客户端随便填就能换个 IP
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', '0')),
     # 默认过滤引擎
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    # 限流频率：限流类挂在具体接口上（见 utils/throttling.py），这里只配频率
+    'DEFAULT_THROTTLE_RATES': {
+        'like': '30/min',
+        'like_ip': '120/min',
+        'comment': '10/min',
+        'comment_ip': '60/min',
+        'login_ip': '30/min',
+        'login_user': '10/min',
+    },
+}
+# 粉丝数超过这个值的作者发文不扇出，读时间线时再合并
+FEED_CELEBRITY_THRESHOLD = 5000
+# 后台任务（utils/jobs.py）：True 时 .delay() 直接同步执行，不需要起 worker
+JOBS_ALWAYS_EAGER = False
+# 过载保护（utils/middleware.py）：并发数记在 Redis 里，是整个部署（所有 gunicorn worker、所有机器）加起来的，不是单个进程的
+LOAD_SHEDDING = {
+    'MAX_IN_FLIGHT': 64,
+    'MAX_IN_FLIGHT_PER_CLIENT': 16,  # 单个 IP 同时超过这么多请求就 429
+    'STALE_SECONDS': 60,
+    'P99_MS': 2000,
+    'WINDOW': 500,
+    'EXPENSIVE_PATHS': [r'^/api/token/login/', r'^/api/articles/export/'],
+    'RETRY_AFTER': 1,
+}
+# 按需性能分析：带签名请求头 X-Profile 的请求或按比例抽样的请求会被记录
+# 默认关闭，要用的环境设 PROFILING_ENABLED=1
+PROFILING = {
+    'ENABLED': os.environ.get('PROFILING_ENABLED', '0') == '1',
+    'SAMPLE_RATE': float(os.environ.get('PROFILING_SAMPLE_RATE', '0')),
+    'MODE': 'cprofile',  # cprofile / sample
+    'SAMPLE_INTERVAL': 0.005,
+    'DIR': BASE_DIR / 'profiles',
+    'MAX_FILES': 200,  # 每个路由最多留多少个 .prof，超出删最旧的
+    'MAX_FOLDED_BYTES': 16 * 1024 * 1024,  # stacks.folded 超过这个大小就轮转成 stacks.folded.1
+}
+# worker 启动预算（startup_benchmark 命令用）：启动耗时、第一个请求耗时（毫秒），
+# 以及启动加第一个请求之后不应该被导入的模块
+STARTUP_BUDGET = {
+    'BOOT_MS': 1500,
+    'FIRST_REQUEST_MS': 500,
+    'PATH': '/api/categories/',
+    'FORBIDDEN_MODULES': ['debug_toolbar', 'drf_spectacular'],
+}
+# 冷数据归档（archive_posts 命令）：发布超过 POST_AGE_DAYS 天的文章连同评论、点赞、标签搬到归档表，
+# 每批 BATCH_SIZE 篇一个事务
+ARCHIVE = {
+    'POST_AGE_DAYS': int(os.environ.get('ARCHIVE_POST_AGE_DAYS', '365')),
+    'BATCH_SIZE': 200,
+}
+# 实时计数推送（apps/blog/live.py，只在 ASGI 下可用）：合并窗口（秒）、心跳间隔（秒）、一个连接最多看几篇文章；
+# REDIS_URL 为空时用 CACHES['default'] 的地址
+LIVE = {
+    'WINDOW': 1.0,
+    'HEARTBEAT': 15,
+    'MAX_IDS': 100,
+    'REDIS_URL': os.environ.get('LIVE_REDIS_URL', ''),
 }
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=20), # 访问令牌活60分钟
@@ -174,6 +246,11 @@ REDIS_HOST = os.environ.get('REDIS_HOST', '127.0.0.1')
 REDIS_PORT = 6379
 REDIS_DB = 1
 
+# 独立访客 HyperLogLog 保留天数
+UV_RETENTION_DAYS = 30
+# 文章详情里内嵌的评论条数，其余走评论分页接口
+POST_DETAIL_COMMENTS = 20
+
 CACHES = {
     'default': {
         'BACKEND': 'django_redis.cache.RedisCache',
@@ -184,6 +261,24 @@ CACHES = {
         }
     }
 }
+# Redis 分片（utils/redis_shard.py）：REDIS_SHARD_NODES="a=redis://r1:6379/1,b=redis://r2:6379/1"
+# 名字要固定，一致性哈希按名字算；不配就只用上面的 default 一个节点
+# 去掉节点时把它从 REDIS_SHARD_NODES 挪到 REDIS_SHARD_RETIRED（格式一样），跑完 rebalance_redis 再删
+REDIS_SHARDS = {
+    'NODES': [],
+    'RETIRED': [],
+    'REPLICAS': 160,
+    'SHARDED_PREFIXES': ['post'],
+}
+for _env, _group in (('REDIS_SHARD_NODES', 'NODES'), ('REDIS_SHARD_RETIRED', 'RETIRED')):
+    for _node in filter(None, os.environ.get(_env, '').split(',')):
+        _name, _url = _node.split('=', 1)
+        CACHES[f'shard-{_name}'] = {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': _url,
+            'OPTIONS': {'CLIENT_CLASS': 'django_redis.client.DefaultClient'},
+        }
+        REDIS_SHARDS[_group].append(f'shard-{_name}')
 # REDIS_HOST = '127.0.0.1'
 # REDIS_HOST = 'redis' # <--- 重点改这里！
 # REDIS_PORT = 6379
@@ -0,0 +1,43 @@
+"""
+生产环境配置：DJANGO_SETTINGS_MODULE=config.settings_prod
+
+在 settings.py 的基础上关掉 DEBUG，去掉只有开发时才用的 app（debug_toolbar、
+接口文档），密钥和域名必须从环境变量 DJANGO_SECRET_KEY / DJANGO_ALLOWED_HOSTS 传进来，
+缺了直接报错。worker 启动越轻，gunicorn 扩容/重启越快，
+改完用 `python manage.py startup_benchmark` 看有没有超出启动预算。
+"""
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import *  # noqa: F401,F403
+from .settings import INSTALLED_APPS, MIDDLEWARE, REST_FRAMEWORK, MEDIA_ROOT
+
+
+def _require_env(name):
+    # 线上不允许退回开发用的密钥 / 任意域名，没配就直接起不来
+    value = os.environ.get(name, '').strip()
+    if not value:
+        raise ImproperlyConfigured(f'生产环境必须设置环境变量 {name}')
+    return value
+
+
+DEBUG = False
+SECRET_KEY = _require_env('DJANGO_SECRET_KEY')
+ALLOWED_HOSTS = [host.strip() for host in _require_env('DJANGO_ALLOWED_HOSTS').split(',') if host.strip()]
+
+# 上传的头像（MEDIA_URL 下的文件）Django 只在 DEBUG 时提供（config/urls.py），线上必须由前面的
+# 静态服务器直接发，否则接口返回的缩略图地址全是 404。例如 nginx：
+#     location /media/ { alias /srv/media/; expires max; add_header Cache-Control "public, immutable"; }
+# 头像按内容哈希命名，可以永久缓存。DJANGO_MEDIA_ROOT 指到 web 容器和 nginx 共享的卷上
+MEDIA_ROOT = os.environ.get('DJANGO_MEDIA_ROOT', MEDIA_ROOT)
+
+# 线上要看接口文档时设 API_DOCS=1
+DEV_ONLY_APPS = {'debug_toolbar'}
+if os.environ.get('API_DOCS') != '1':
+    DEV_ONLY_APPS.add('drf_spectacular')
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in DEV_ONLY_APPS]
+MIDDLEWARE = [m for m in MIDDLEWARE if m.split('.')[0] not in DEV_ONLY_APPS]
+if 'drf_spectacular' not in INSTALLED_APPS:
+    REST_FRAMEWORK = {**REST_FRAMEWORK, 'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.openapi.AutoSchema'}
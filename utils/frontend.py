@@ -0,0 +1,122 @@
+"""
+前端壳页面和带哈希的静态资源
+
+index.html 由 `python manage.py build_frontend` 预先构建好（连 gzip/br 版本一起），
+进程里第一次请求时读进内存，之后每次请求只是把内存里的字节写出去，
+不走模板引擎和 context processor。
+带内容哈希的资源文件名变了内容才会变，可以放心让浏览器缓存一年。
+"""
+import hashlib
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, Http404
+from django.utils.http import parse_etags
+from django.views.decorators.http import require_GET
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+ASSET_NAME_RE = re.compile(r'^[\w.-]+$')
+CONTENT_TYPES = {
+    '.css': 'text/css; charset=utf-8',
+    '.js': 'application/javascript; charset=utf-8',
+    '.html': 'text/html; charset=utf-8',
+    '.svg': 'image/svg+xml',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.ico': 'image/x-icon',
+    '.woff2': 'font/woff2',
+}
+
+_cache = {}
+
+
+def _load(path):
+    """
+    读文件及其 .br/.gz 版本，返回 {encoding: (bytes, etag)}；进程内只读一次
+    不存在的路径不缓存（返回 None），否则随便请求 /assets/<任意名字> 就能让 _cache 无限增长
+    """
+    if path not in _cache:
+        if not path.is_file():
+            return None
+        body = path.read_bytes()
+        digest = hashlib.sha256(body).hexdigest()[:16]
+        # 强 ETag 必须每种编码各不相同，否则缓存 304 之后可能拿错编码的内容
+        variants = {'identity': (body, '"%s"' % digest)}
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            compressed = path.with_name(path.name + suffix)
+            if compressed.is_file():
+                variants[encoding] = (compressed.read_bytes(), '"%s-%s"' % (digest, encoding))
+        _cache[path] = variants
+    return _cache[path]
+
+
+def _accepted_encodings(header):
+    """解析 Accept-Encoding，返回 {编码: q}，q=0 表示明确拒绝"""
+    accepted = {}
+    for item in header.split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+def _pick_encoding(request, variants):
+    accepted = _accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    wildcard = accepted.get('*', 0.0)
+    for encoding in ('br', 'gzip'):
+        if encoding in variants and accepted.get(encoding, wildcard) > 0:
+            return encoding
+    return 'identity'
+
+
+def _respond(request, variants, content_type, cache_control):
+    encoding = _pick_encoding(request, variants)
+    body, etag = variants[encoding]
+    # If-None-Match 按弱比较，W/ 前缀不影响匹配
+    if_none_match = {tag.removeprefix('W/') for tag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))}
+    if etag in if_none_match or '*' in if_none_match:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type=content_type)
+        if encoding != 'identity':
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = cache_control
+    return response
+
+
+@require_GET
+def index(request):
+    variants = _load(Path(settings.FRONTEND_DIST_DIR) / 'index.html')
+    if variants is None:
+        # 还没执行 build_frontend（本地开发），直接发源文件
+        variants = _load(Path(settings.FRONTEND_SRC_DIR) / 'index.html')
+    if variants is None:
+        # 源文件也没有：部署时漏了构建步骤，明确告诉运维，而不是 500
+        return HttpResponse('前端还没有构建，请先执行 python manage.py build_frontend\n',
+                            status=503, content_type='text/plain; charset=utf-8')
+    # 壳页面引用的资源文件名会随部署变化，所以自己不能长缓存，每次用 ETag 校验
+    return _respond(request, variants, CONTENT_TYPES['.html'], 'no-cache')
+
+
+@require_GET
+def asset(request, name):
+    if not ASSET_NAME_RE.match(name):
+        raise Http404
+    variants = _load(Path(settings.FRONTEND_DIST_DIR) / 'assets' / name)
+    if variants is None:
+        raise Http404
+    content_type = CONTENT_TYPES.get(Path(name).suffix, 'application/octet-stream')
+    return _respond(request, variants, content_type, IMMUTABLE)
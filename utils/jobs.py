@@ -0,0 +1,208 @@
+"""
+基于 Redis Streams 的轻量后台任务，只依赖现有的 Redis
+
+用法：
+    from utils.jobs import job
+
+    @job(queue='default', max_retries=3)
+    def sync_post_views(pk, views):
+        ...
+
+    sync_post_views.delay(1, 100)          # 丢进队列，马上返回
+    sync_post_views.delay_for(5, 1, 100)   # 5 秒以后执行，到期前重复排的只算一次
+    sync_post_views(1, 100)                # 当普通函数同步调用
+
+    python manage.py runjobs --queues default --concurrency 8
+
+键：
+    jobs:{queue}            任务流（XADD / 消费组 XREADGROUP）
+    jobs:{queue}:delayed    等待重试、延迟执行的任务（ZSET，score 是可以重新执行的时间戳）
+    jobs:{queue}:dead       重试次数用完的任务（死信流，留着人工排查）
+
+投递语义是 at-least-once：执行成功才 XACK，worker 挂掉时没 ack 的消息
+超过 claim_idle_ms 会被别的 worker 用 XAUTOCLAIM 认领重跑，所以任务要写成幂等的。
+"""
+import json
+import logging
+import os
+import socket
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from utils.redis_pool import redis, register_script
+
+logger = logging.getLogger(__name__)
+
+GROUP = 'workers'
+JOB_REGISTRY = {}
+
+# 把到期的延迟任务原子地挪回任务流
+_MOVE_DUE = register_script("""
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], 0, ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, payload in ipairs(due) do
+    redis.call('ZREM', KEYS[1], payload)
+    redis.call('XADD', KEYS[2], '*', 'payload', payload)
+end
+return #due
+""")
+
+
+def stream_key(queue):
+    return f"jobs:{queue}"
+
+
+def delayed_key(queue):
+    return f"jobs:{queue}:delayed"
+
+
+def dead_key(queue):
+    return f"jobs:{queue}:dead"
+
+
+class Job:
+    def __init__(self, func, queue, max_retries, retry_delay):
+        self.func = func
+        self.name = f"{func.__module__}.{func.__qualname__}"
+        self.queue = queue
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.__doc__ = func.__doc__
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        """入队；JOBS_ALWAYS_EAGER=True 时直接同步执行（本地调试用）"""
+        if getattr(settings, 'JOBS_ALWAYS_EAGER', False):
+            return self.func(*args, **kwargs)
+        payload = json.dumps({'job': self.name, 'args': args, 'kwargs': kwargs, 'attempt': 0})
+        return redis.xadd(stream_key(self.queue), {'payload': payload})
+
+    def delay_for(self, seconds, *args, **kwargs):
+        """
+        seconds 秒以后再执行（放进延迟队列，到期由 worker 挪回任务流）
+        参数完全一样的任务在执行前只会排一次，适合"攒一会儿再批量处理"的场景
+        """
+        if getattr(settings, 'JOBS_ALWAYS_EAGER', False):
+            return self.func(*args, **kwargs)
+        payload = json.dumps({'job': self.name, 'args': args, 'kwargs': kwargs, 'attempt': 0})
+        ready_at = int((time.time() + seconds) * 1000)
+        return redis.zadd(delayed_key(self.queue), {payload: ready_at}, nx=True)
+
+
+def job(func=None, *, queue='default', max_retries=3, retry_delay=5):
+    """把函数注册成后台任务；参数必须能被 json 序列化"""
+    def decorator(f):
+        j = Job(f, queue, max_retries, retry_delay)
+        JOB_REGISTRY[j.name] = j
+        return j
+    if func is not None:
+        return decorator(func)
+    return decorator
+
+
+def _execute(payload):
+    """执行一个任务，返回 None 表示成功，否则返回错误信息"""
+    try:
+        data = json.loads(payload)
+        JOB_REGISTRY[data['job']].func(*data['args'], **data['kwargs'])
+        return None
+    except Exception:
+        return traceback.format_exc()
+
+
+def _execute_pooled(payload):
+    # 池里的线程/进程各有各的数据库连接，跑完一个任务就按 CONN_MAX_AGE 回收
+    try:
+        return _execute(payload)
+    finally:
+        close_old_connections()
+
+
+class Worker:
+    def __init__(self, queues, concurrency=4, use_processes=False,
+                 block_ms=5000, claim_idle_ms=60000, consumer=None):
+        self.queues = list(queues)
+        self.concurrency = concurrency
+        self.use_processes = use_processes
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.stopping = False
+
+    def ensure_groups(self):
+        for queue in self.queues:
+            try:
+                # id=0：消费组建立之前入队的任务也要处理
+                redis.xgroup_create(stream_key(queue), GROUP, id='0', mkstream=True)
+            except Exception as exc:
+                if 'BUSYGROUP' not in str(exc):
+                    raise
+
+    def fetch(self):
+        """取一批消息：先认领别人挂掉留下的，再读新消息"""
+        messages = []
+        now = int(time.time() * 1000)
+        for queue in self.queues:
+            _MOVE_DUE(keys=[delayed_key(queue), stream_key(queue)], args=[now, self.concurrency])
+            _, claimed, *_ = redis.xautoclaim(stream_key(queue), GROUP, self.consumer,
+                                              self.claim_idle_ms, start_id='0-0',
+                                              count=self.concurrency)
+            messages += [(queue, msg_id, fields) for msg_id, fields in claimed if fields]
+        if messages:
+            return messages
+        streams = {stream_key(q): '>' for q in self.queues}
+        for stream, entries in redis.xreadgroup(GROUP, self.consumer, streams,
+                                                count=self.concurrency, block=self.block_ms) or []:
+            queue = (stream.decode() if isinstance(stream, bytes) else stream)[len('jobs:'):]
+            messages += [(queue, msg_id, fields) for msg_id, fields in entries]
+        return messages
+
+    def finish(self, queue, msg_id, payload, error):
+        """成功就 ack 并删掉；失败就重试或进死信，原消息同样 ack 掉"""
+        pipe = redis.pipeline()
+        if error:
+            data = json.loads(payload)
+            j = JOB_REGISTRY.get(data['job'])
+            data['attempt'] += 1
+            if j and data['attempt'] <= j.max_retries:
+                ready_at = int(time.time() * 1000) + j.retry_delay * 1000 * data['attempt']
+                pipe.zadd(delayed_key(queue), {json.dumps(data): ready_at})
+                logger.warning("任务 %s 第 %s 次失败，稍后重试\n%s", data['job'], data['attempt'], error)
+            else:
+                data['error'] = error
+                pipe.xadd(dead_key(queue), {'payload': json.dumps(data)})
+                logger.error("任务 %s 重试用完，进入死信队列\n%s", data['job'], error)
+        pipe.xack(stream_key(queue), GROUP, msg_id)
+        pipe.xdel(stream_key(queue), msg_id)
+        pipe.execute()
+
+    def run_once(self, executor=None):
+        """处理一批消息，返回处理的条数"""
+        messages = self.fetch()
+        if not messages:
+            return 0
+        payloads = [fields.get(b'payload') or fields.get('payload') for _, _, fields in messages]
+        if executor is None:
+            results = [_execute(p) for p in payloads]
+        else:
+            results = list(executor.map(_execute_pooled, payloads))
+        for (queue, msg_id, _), payload, error in zip(messages, payloads, results):
+            self.finish(queue, msg_id, payload, error)
+        return len(messages)
+
+    def run(self):
+        self.ensure_groups()
+        if self.use_processes:
+            # fork 之前把数据库连接关掉，子进程各自重连，不要共用同一个 socket
+            connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=self.concurrency)
+        else:
+            executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        with executor:
+            while not self.stopping:
+                self.run_once(executor)
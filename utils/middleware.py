@@ -0,0 +1,136 @@
+import re
+import threading
+import time
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django.http import JsonResponse
+from redis.exceptions import RedisError
+from rest_framework.throttling import BaseThrottle
+
+from utils.redis_pool import redis, register_script
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+IN_FLIGHT_KEY = 'shed:inflight'
+
+# 登记一个正在处理的请求：先清掉超过 STALE_SECONDS 还没走的（worker 被杀、没来得及登出），
+# 返回 0 放行并登记，1 这个客户端同时占的请求太多（429），2 全站并发太高、拒掉贵请求（503）
+_ENTER = register_script("""
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local stale = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, now - stale)
+redis.call('ZREMRANGEBYSCORE', KEYS[2], 0, now - stale)
+if redis.call('ZCARD', KEYS[2]) >= tonumber(ARGV[4]) then
+    return 1
+end
+if ARGV[5] == '1' and redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+    return 2
+end
+for i = 1, 2 do
+    redis.call('ZADD', KEYS[i], now, ARGV[2])
+    redis.call('PEXPIRE', KEYS[i], stale)
+end
+return 0
+""")
+
+
+class LoadSheddingMiddleware:
+    """
+    过载保护：正在处理的请求太多，或者最近请求的 p99 延迟超标时，
+    直接用 503 拒掉"贵"的请求（写操作 + 配置的重接口），让读请求还能正常返回；
+    单个客户端（按 IP）同时占着太多请求时，它的请求一律 429。
+
+    配置在 settings.LOAD_SHEDDING：
+        MAX_IN_FLIGHT             整个部署（所有 worker、所有机器）的并发请求上限
+        MAX_IN_FLIGHT_PER_CLIENT  单个 IP 的并发请求上限
+        STALE_SECONDS             登记超过这么久还没结束的请求当作已经没了（worker 被杀时不会一直占着名额）
+        P99_MS                    最近 WINDOW 个请求的 p99 延迟上限（毫秒）
+        WINDOW                    统计 p99 用的样本数
+        EXPENSIVE_PATHS           额外视为"贵"的路径正则（GET 也算）
+        RETRY_AFTER               503/429 时告诉客户端多少秒后重试
+    gunicorn 同步 worker 一个进程同时只处理一个请求，进程内计数永远到不了上限，
+    所以并发数记在 Redis 里（shed:inflight 和 shed:inflight:{ip} 两个 ZSET，进出各一次往返）；
+    Redis 不可用时不拦请求。p99 是各 worker 自己统计的（每个 worker 都能看到自己的全部请求）。
+    客户端按 DRF 的 get_ident 认，反向代理的层数在 REST_FRAMEWORK['NUM_PROXIES'] 里配。
+
+    流式响应（导出、SSE）在视图返回、开始发响应体的时候就登出了，发响应体的这段时间
+    既不算并发也不进 p99：SSE 长连接大部分时间是空闲的，算进来几十个人开着页面就会把写请求全拒掉，
+    而且连得比 STALE_SECONDS 久也会被当成过期清掉。导出这类贵的流式接口靠 EXPENSIVE_PATHS 在入口处拦。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        conf = getattr(settings, 'LOAD_SHEDDING', {})
+        self.max_in_flight = conf.get('MAX_IN_FLIGHT', 64)
+        self.max_per_client = conf.get('MAX_IN_FLIGHT_PER_CLIENT', 16)
+        self.stale_ms = conf.get('STALE_SECONDS', 60) * 1000
+        self.p99_ms = conf.get('P99_MS', 2000)
+        self.window = conf.get('WINDOW', 500)
+        self.retry_after = str(conf.get('RETRY_AFTER', 1))
+        self.expensive_paths = [re.compile(p) for p in conf.get('EXPENSIVE_PATHS', [])]
+
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=self.window)
+        self.p99 = 0.0
+        self.p99_at = 0.0
+        self.since_recompute = 0
+
+    def is_expensive(self, request):
+        if request.method not in SAFE_METHODS:
+            return True
+        return any(p.search(request.path) for p in self.expensive_paths)
+
+    def slow(self):
+        # 全在拒绝"贵"请求时可能没有新样本，p99 超过 5 秒没更新就不再作数
+        fresh = time.monotonic() - self.p99_at < 5
+        return fresh and self.p99 * 1000 > self.p99_ms
+
+    def reject(self, status):
+        response = JsonResponse({'detail': '请求太多，请稍后重试' if status == 429 else '服务繁忙，请稍后重试'},
+                                status=status)
+        response['Retry-After'] = self.retry_after
+        return response
+
+    def enter(self, keys, token, expensive):
+        """登记到 Redis，返回 0 / 429 / 503；Redis 出问题时放行（返回 None，不用登出）"""
+        try:
+            code = _ENTER(keys=keys, args=[self.stale_ms, token, self.max_in_flight, self.max_per_client,
+                                           1 if expensive else 0])
+        except RedisError:
+            return None
+        return (0, 429, 503)[code]
+
+    def __call__(self, request):
+        expensive = self.is_expensive(request)
+        if expensive and self.slow():
+            return self.reject(503)
+        keys = [IN_FLIGHT_KEY, f"{IN_FLIGHT_KEY}:{BaseThrottle().get_ident(request)}"]
+        token = uuid.uuid4().hex
+        code = self.enter(keys, token, expensive)
+        if code:
+            return self.reject(code)
+
+        start = time.perf_counter()
+        try:
+            return self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - start
+            if code is not None:
+                try:
+                    pipe = redis.pipeline(transaction=False)
+                    for key in keys:
+                        pipe.zrem(key, token)
+                    pipe.execute()
+                except RedisError:
+                    pass  # 没登出的会在 STALE_SECONDS 以后被清掉
+            with self.lock:
+                self.samples.append(elapsed)
+                self.since_recompute += 1
+                # p99 不用每个请求都排序，攒够一批再算一次
+                if self.since_recompute >= max(1, self.window // 10):
+                    self.since_recompute = 0
+                    ordered = sorted(self.samples)
+                    self.p99 = ordered[int(len(ordered) * 0.99) - 1] if len(ordered) >= 100 else 0.0
+                    self.p99_at = time.monotonic()
@@ -0,0 +1,165 @@
+"""
+按需的单请求性能分析
+
+两种触发方式：
+    1. 请求头 X-Profile: <签名 token>，token 用 `python manage.py profile_token` 生成，有有效期
+    2. 按 settings.PROFILING['SAMPLE_RATE'] 随机抽样（0 表示不抽样）
+
+两种模式（PROFILING['MODE']，也可以在请求头里用 X-Profile-Mode 覆盖）：
+    cprofile  cProfile 全量记录函数调用，输出 pstats 文件
+    sample    后台线程定时抓当前请求线程的调用栈，输出 collapsed stack（flamegraph.pl / speedscope 直接能用）
+
+输出目录 PROFILING['DIR']/<路由名>/ 下：
+    <时间>-<pid>-<序号>.prof     每个请求一个 pstats 文件，每个路由最多留 MAX_FILES 个，超出删最旧的
+    stacks.folded                同一路由所有采样累加在一个文件里，超过 MAX_FOLDED_BYTES 轮转成 stacks.folded.1
+汇总用 `python manage.py profile_report`，合并结果写到同目录的 aggregate.prof / aggregate.folded。
+
+没触发时只多一次请求头查找（和一次 random()），基本没有开销。
+"""
+import cProfile
+import itertools
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+
+SIGNING_SALT = 'utils.profiling'
+_seq = itertools.count()
+
+
+def make_token(max_age=3600):
+    """生成 X-Profile 请求头用的签名 token"""
+    return signing.dumps({'exp': int(time.time()) + max_age}, salt=SIGNING_SALT)
+
+
+def token_valid(token):
+    try:
+        data = signing.loads(token, salt=SIGNING_SALT)
+    except signing.BadSignature:
+        return False
+    return data.get('exp', 0) >= time.time()
+
+
+def route_name(request):
+    """按 URL 模式归类，如 GET_api_articles_pk；view_name 是中文，不适合做目录名和响应头"""
+    match = getattr(request, 'resolver_match', None)
+    route = match.route if match and match.route else 'unresolved'
+    route = re.sub(r'\(\?P<(\w+)>[^)]*\)', r'\1', route)
+    return f"{request.method}_" + (re.sub(r'[^A-Za-z0-9.-]+', '_', route).strip('_') or 'root')
+
+
+class _StackSampler(threading.Thread):
+    """每隔 interval 秒抓一次目标线程的调用栈，按 collapsed 格式计数"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}")
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        conf = getattr(settings, 'PROFILING', {})
+        if not conf.get('ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = conf.get('SAMPLE_RATE', 0.0)
+        self.mode = conf.get('MODE', 'cprofile')
+        self.interval = conf.get('SAMPLE_INTERVAL', 0.005)
+        self.directory = str(conf.get('DIR', os.path.join(settings.BASE_DIR, 'profiles')))
+        self.max_files = conf.get('MAX_FILES', 200)
+        self.max_folded_bytes = conf.get('MAX_FOLDED_BYTES', 16 * 1024 * 1024)
+        self.lock = threading.Lock()
+
+    def should_profile(self, request):
+        token = request.META.get('HTTP_X_PROFILE')
+        if token is not None:
+            return token_valid(token)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        mode = request.META.get('HTTP_X_PROFILE_MODE', self.mode)
+        if mode == 'sample':
+            sampler = _StackSampler(threading.get_ident(), self.interval)
+            sampler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                sampler.stop()
+            path = self.save_stacks(route_name(request), sampler.counts)
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            path = self.save_pstats(route_name(request), profiler)
+        response['X-Profile-File'] = os.path.relpath(path, self.directory)
+        return response
+
+    def route_dir(self, route):
+        path = os.path.join(self.directory, route)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def save_pstats(self, route, profiler):
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_seq)}.prof"
+        path = os.path.join(self.route_dir(route), name)
+        profiler.dump_stats(path)
+        self.prune(os.path.dirname(path))
+        return path
+
+    def prune(self, route_dir):
+        # 按修改时间删掉最旧的，profile_report 生成的 aggregate.prof 不算
+        files = [entry for entry in os.scandir(route_dir)
+                 if entry.name.endswith('.prof') and entry.name != 'aggregate.prof']
+        if len(files) <= self.max_files:
+            return
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in files[:len(files) - self.max_files]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass  # 别的 worker 已经删了
+
+    def save_stacks(self, route, counts):
+        # collapsed 格式本身就是可累加的：同一路由的采样直接追加到一个文件
+        path = os.path.join(self.route_dir(route), 'stacks.folded')
+        with self.lock:
+            try:
+                if os.path.getsize(path) >= self.max_folded_bytes:
+                    os.replace(path, path + '.1')  # 只留一份旧的，总大小不超过两倍上限
+            except FileNotFoundError:
+                pass
+            with open(path, 'a', encoding='utf-8') as f:
+                for stack, count in counts.items():
+                    f.write(f"{stack} {count}\n")
+        return path
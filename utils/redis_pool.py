@@ -1,2 +1,52 @@
-from django_redis import get_redis_connection
-redis = get_redis_connection("default")
+"""
+全局 Redis 连接
+
+redis 是个懒加载代理：导入这个模块不会建连接池，第一次真正调用命令时才创建，
+manage.py 的各种命令、gunicorn 的 master 进程启动都不用为它付钱。
+Lua 脚本用 register_script 注册，同样在第一次执行时才绑定到连接上。
+
+配置了 settings.REDIS_SHARDS['NODES'] 时 redis 是按文章分片的客户端（见 utils/redis_shard.py），
+用法不变；一次脚本调用要碰多篇文章的 key 时先用 group_keys 按节点分组。
+"""
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+
+
+def _connect():
+    from django_redis import get_redis_connection
+    default = get_redis_connection("default")
+    conf = getattr(settings, 'REDIS_SHARDS', {})
+    if not conf.get('NODES'):
+        return default
+    from utils.redis_shard import ShardedRedis
+    return ShardedRedis(
+        default,
+        {alias: get_redis_connection(alias) for alias in conf['NODES']},
+        replicas=conf.get('REPLICAS', 160),
+        sharded_prefixes=conf.get('SHARDED_PREFIXES', ('post',)),
+    )
+
+
+redis = SimpleLazyObject(_connect)
+
+
+def group_keys(keys):
+    """按所在节点给 key 分组，返回 [下标列表, ...]；没分片时只有一组"""
+    if not hasattr(redis, 'group_keys'):
+        return [list(range(len(keys)))] if keys else []
+    return [indexes for _, indexes in redis.group_keys(keys)]
+
+
+class LazyScript:
+    def __init__(self, source):
+        self.source = source
+        self._script = None
+
+    def __call__(self, keys=(), args=(), client=None):
+        if self._script is None:
+            self._script = redis.register_script(self.source)
+        return self._script(keys=keys, args=args, client=client)
+
+
+def register_script(source):
+    return LazyScript(source)
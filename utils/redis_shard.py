@@ -0,0 +1,259 @@
+"""
+Redis 一致性哈希分片
+
+单个 Redis 节点的内存和吞吐是上限，按文章把 post:{pk}:* 这类 key 分散到多个节点：
+    - 同一篇文章的所有 key 落在同一个节点（按 "post:{pk}" 算哈希），
+      所以只碰一篇文章的多 key Lua 脚本、PFMERGE、RENAME 照常能用
+    - 一致性哈希环（每个节点 REPLICAS 个虚拟节点），加减节点只需要搬走约 1/N 的 key
+    - 不属于分片前缀的 key（列表缓存、任务队列、限流、统计、自动补全……）都留在 default 节点
+
+配置（settings.REDIS_SHARDS）：
+    NODES              CACHES 里的别名列表，每个别名一个节点，例如 ['shard-a', 'shard-b']；为空就不分片
+    RETIRED            刚从 NODES 里去掉、还没搬空的节点别名，只有 rebalance 会读它们
+    REPLICAS           每个节点的虚拟节点数
+    SHARDED_PREFIXES   要分片的实体前缀，'post' 表示 post:{数字}:* 的 key
+
+加减节点之后跑 `python manage.py rebalance_redis` 把不在该在的节点上的 key 搬过去。
+去掉的节点要先挪到 RETIRED 里（CACHES 里还留着它的地址），rebalance 才能把它上面的 key 全部搬走，
+搬完以后再从配置里删掉；直接删掉的话它上面还没落库的浏览量、点赞集合就丢了。
+"""
+import bisect
+import hashlib
+import re
+from collections import Counter
+from itertools import chain
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    def __init__(self, nodes, replicas=160):
+        self.nodes = list(nodes)
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas))
+        self._hashes = [h for h, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node_for(self, shard_key):
+        i = bisect.bisect(self._hashes, _hash(shard_key)) % len(self._hashes)
+        return self._owners[i]
+
+
+def _decode(key):
+    return key.decode() if isinstance(key, bytes) else key
+
+
+class ShardedRedis:
+    """
+    接口和 redis.Redis 一样：单 key 命令按第一个参数路由，
+    mget / delete / exists / scan_iter / pipeline / register_script 会按节点拆开再合并
+    """
+
+    def __init__(self, default, nodes, replicas=160, sharded_prefixes=('post',)):
+        self.default = default
+        self.nodes = dict(nodes)
+        self.ring = HashRing(self.nodes, replicas)
+        self._pattern = re.compile(r'^(?:%s):\d+:' % '|'.join(map(re.escape, sharded_prefixes)))
+        self.sharded_prefixes = tuple(sharded_prefixes)
+
+    def shard_key(self, key):
+        """分片用的实体键（例如 'post:12:'），不分片的 key 返回 None"""
+        if not isinstance(key, (str, bytes)):
+            return None
+        match = self._pattern.match(_decode(key))
+        return match.group(0) if match else None
+
+    def node_name_for(self, key):
+        shard_key = self.shard_key(key)
+        return self.ring.node_for(shard_key) if shard_key else None
+
+    def client_for(self, key):
+        name = self.node_name_for(key)
+        return self.default if name is None else self.nodes[name]
+
+    def all_clients(self):
+        seen = {}
+        for client in chain([self.default], self.nodes.values()):
+            seen.setdefault(id(client), client)
+        return list(seen.values())
+
+    def group_keys(self, keys):
+        """按所在节点给 key 分组，返回 [(client, [下标...])]"""
+        groups = {}
+        for i, key in enumerate(keys):
+            client = self.client_for(key)
+            groups.setdefault(id(client), (client, []))[1].append(i)
+        return list(groups.values())
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            client = self.client_for(args[0]) if args else self.default
+            return getattr(client, name)(*args, **kwargs)
+        return command
+
+    # ---- 跨节点的多 key 命令 ----
+
+    def mget(self, keys, *args):
+        keys = ([keys] if isinstance(keys, (str, bytes)) else list(keys)) + list(args)
+        result = [None] * len(keys)
+        for client, indexes in self.group_keys(keys):
+            for i, value in zip(indexes, client.mget([keys[i] for i in indexes])):
+                result[i] = value
+        return result
+
+    def _sum_over_nodes(self, command, keys):
+        return sum(getattr(client, command)(*[keys[i] for i in indexes])
+                   for client, indexes in self.group_keys(keys)) if keys else 0
+
+    def delete(self, *keys):
+        return self._sum_over_nodes('delete', keys)
+
+    def unlink(self, *keys):
+        return self._sum_over_nodes('unlink', keys)
+
+    def exists(self, *keys):
+        return self._sum_over_nodes('exists', keys)
+
+    def scan_iter(self, match=None, count=None, **kwargs):
+        for client in self.all_clients():
+            yield from client.scan_iter(match=match, count=count, **kwargs)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return ShardedPipeline(self, transaction)
+
+    def register_script(self, script):
+        return ShardedScript(self, script)
+
+
+class ShardedScript:
+    """Lua 脚本按 KEYS[1] 路由到节点；所有 KEYS 必须在同一个节点上"""
+
+    def __init__(self, router, source):
+        self.router = router
+        self.script = router.default.register_script(source)
+
+    def __call__(self, keys=(), args=(), client=None):
+        if client is None:
+            nodes = {self.router.node_name_for(key) for key in keys}
+            if len(nodes) > 1:
+                raise ValueError(f'Lua 脚本的 key 分布在多个节点上: {list(keys)}')
+            client = self.router.client_for(keys[0]) if keys else self.router.default
+        return self.script(keys=keys, args=args, client=client)
+
+
+class ShardedPipeline:
+    """
+    命令先按顺序记下来，execute 时按节点各开一个 pipeline 执行，结果按原顺序拼回去
+    transaction=True 只保证单个节点内的原子性
+    watch() 之后整个 pipeline 绑定到被 watch 的 key 所在的节点（乐观锁只能针对一个节点）
+    """
+
+    def __init__(self, router, transaction=True):
+        self.router = router
+        self.transaction = transaction
+        self.commands = []
+        self.bound = None
+
+    def __getattr__(self, name):
+        if self.bound is not None:
+            return getattr(self.bound, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    def watch(self, *keys):
+        self.bound = self.router.client_for(keys[0]).pipeline(transaction=self.transaction)
+        return self.bound.watch(*keys)
+
+    def execute(self):
+        if self.bound is not None:
+            return self.bound.execute()
+        commands, self.commands = self.commands, []
+        keys = [args[0] if args else None for _, args, _ in commands]
+        results = [None] * len(commands)
+        for client, indexes in self.router.group_keys(keys):
+            pipe = client.pipeline(transaction=self.transaction)
+            for i in indexes:
+                name, args, kwargs = commands[i]
+                getattr(pipe, name)(*args, **kwargs)
+            for i, value in zip(indexes, pipe.execute()):
+                results[i] = value
+        return results
+
+    def reset(self):
+        self.commands = []
+        if self.bound is not None:
+            self.bound.reset()
+            self.bound = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.reset()
+
+    def __len__(self):
+        return len(self.commands)
+
+
+def rebalance(router, old_nodes=None, batch_size=500, dry_run=False):
+    """
+    扫描所有节点上的分片 key，不在环上该在的节点的就搬过去，返回 Counter({(源, 目标): 个数})
+    old_nodes 是加减节点之前的节点 {名字: 客户端}：已经不在新环上的节点也会被扫描，
+    新环上没有任何 key 属于它们，所以它们上面的分片 key 会全部搬走
+    先在源节点 DUMP + PTTL，再到目标节点 RESTORE，最后删源节点上的；
+    搬的过程中对这些 key 的写可能丢：缓存会重建，浏览量、点赞集合会从数据库回源
+    """
+    names = {id(client): name for name, client in router.nodes.items()}
+    names.setdefault(id(router.default), 'default')
+    sources = router.all_clients()
+    for name, client in (old_nodes or {}).items():
+        if id(client) not in names:
+            names[id(client)] = name
+            sources.append(client)
+    moved = Counter()
+
+    def move(source, batch):
+        if dry_run:
+            for _, target in batch:
+                moved[(names[id(source)], names[id(target)])] += 1
+            return
+        pipe = source.pipeline(transaction=False)
+        for key, _ in batch:
+            pipe.dump(key)
+            pipe.pttl(key)
+        dumped = pipe.execute()
+        targets = {}
+        for n, (key, target) in enumerate(batch):
+            value, ttl = dumped[2 * n], dumped[2 * n + 1]
+            if value is None:
+                continue  # 扫到以后过期/被删了
+            targets.setdefault(id(target), (target, []))[1].append((key, value, max(ttl, 0)))
+        done = []
+        for target, items in targets.values():
+            pipe = target.pipeline(transaction=False)
+            for key, value, ttl in items:
+                pipe.restore(key, ttl, value, replace=True)
+            pipe.execute()
+            done += [key for key, _, _ in items]
+            moved[(names[id(source)], names[id(target)])] += len(items)
+        if done:
+            source.delete(*done)
+
+    for source in sources:
+        for prefix in router.sharded_prefixes:
+            batch = []
+            for key in source.scan_iter(match=f'{prefix}:*', count=1000):
+                target = router.client_for(key)
+                if target is source:
+                    continue
+                batch.append((key, target))
+                if len(batch) >= batch_size:
+                    move(source, batch)
+                    batch = []
+            if batch:
+                move(source, batch)
+    return moved